@@ -1,6 +1,6 @@
 """
 Title: Run analyses
-Author: Ryan Gan 
+Author: Ryan Gan
 Email: ganr1@gene.com
 
 Purpose: 00_run_analyses.py runs the subsequent splitting of
@@ -11,67 +11,177 @@ You can run the sequence of scripts using a command from the terminal:
 
 'python3 00_run_analyses.py'
 
+Each script is declared as a step with the files it reads and writes.
+Steps run in dependency order in their own python process; steps that do
+not depend on each other (e.g. the models 03, 04, 05 and 09) run
+at the same time. A step is skipped if its script and input files have not
+changed since its last successful run, so a failure at 09 only reruns 09.
+
+Options:
+'python3 00_run_analyses.py --workers 2' runs at most 2 scripts at once.
+'python3 00_run_analyses.py --cores 16' splits 16 cores between the running
+    scripts (default 11); each script gets cores // workers for its pools.
+'python3 00_run_analyses.py --force' reruns every step.
+'python3 00_run_analyses.py 05 07' only runs steps 05 and 07.
+
+Output of each script is written to data/logs/<step>.log.
+
 Note: The tableone.py script creates the table one of the manuscript.
 This is not executed as this depends on the relational OPTUM EHR database.
 """
 
+import argparse
+import os
 
-"""
-Execute modularized scripts
-"""
-print('\n 01: Running script to select labs measured on 70% of visits' +
-      '\n Saving labs to evaluate to config yaml file. \n')
-exec(open('01_lab_selector.py').read())
+from analysis_functions.pipeline import Step, run_steps
+from analysis_functions.fit_cache import clean_preprocessing_cache
+from analysis_functions.model_tuning import clean_fold_caches
 
-print('\n 02: Running script to split visits randomly in to test and train.' +
-      '\n Train/test will be used in subsequent models. \n')
-exec(open('02_train_test.py').read())
+# define project root directory based on project structure
+analysis_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(os.path.dirname(analysis_dir))
 
 """
-Models
+Shared files
 """
-
-print('\n 03: Running benchmark logistic model \n')
-exec(open('03_logreg_clinical_benchmark.py').read())
-
-
-print('\n 04: Running logistic model with labs \n')
-exec(open('04_logreg_regularization.py').read())
-
-
-print('\n 05: Running random forest main model \n')
-exec(open('05_rf.py').read())
-
-
-print('\n 05a: Running random forest on chrons disease subgroup \n')
-exec(open('05a_rf_cd.py').read())
-
-
-print('\n 05b: Running random forest on ulcerative colitis subgroup \n')
-exec(open('05b_rf_uc.py').read())
-
-
-print('\n 05c: Running random forest on indeterminate colitis subgroup \n')
-exec(open('05c_rf_ic.py').read())
-
-
-print('\n 06: Running script to build most figures for manuscript \n')
-exec(open('06_manuscript_figures.py').read())
-
-
-print('\n 07: Running TreeSHAP script. Also creates results for treeshap \n')
-exec(open('07_rf_shap_values.py').read())
+raw_data = 'data/raw/ibd_flare_analysis.csv'
+config = 'scripts/analysis/analysis_config.yaml'
+# row indexes of the train and test splits built by 02
+splits = ['data/splits/' + name + '_' + part + '.npy'
+          for name in ['random', 'patient'] for part in ['train', 'test']]
+# float32 feature store of train and test built by 02
+features = ['data/features/meta.json'] + [
+    'data/features/' + split + '_' + part + '.npy'
+    for split in ['train', 'test']
+    for part in ['x', 'y', 'disease_category', 'index', 'patient']]
+
+# result files read by the manuscript figures script
+benchmark_results = ['results/logreg_clinical_benchmark/logreg_roc.csv',
+                     'results/logreg_clinical_benchmark/dx_intervals.csv',
+                     'results/logreg_clinical_benchmark/logreg_pred.csv',
+                     'results/logreg_clinical_benchmark/logreg_oddratio.csv']
+logreg_results = ['results/logreg_regularization/logreg_roc.csv',
+                  'results/logreg_regularization/dx_intervals.csv',
+                  'results/logreg_regularization/logreg_pred.csv',
+                  'results/logreg_regularization/logreg_oddratio.csv']
+rf_results = ['results/rf/rf_roc.csv',
+              'results/rf/dx_intervals.csv',
+              'results/rf/dx_intervals_patient.csv',
+              'results/rf/rf_pred.csv',
+              'results/rf/rf_vif.csv']
+rf_cd_results = ['results/rf_cd/rf_cd_roc.csv',
+                 'results/rf_cd/rf_cd_dx_intervals.csv',
+                 'results/rf_cd/rf_cd_dx_intervals_patient.csv',
+                 'results/rf_cd/rf_cd_vif.csv']
+rf_uc_results = ['results/rf_uc/rf_uc_roc.csv',
+                 'results/rf_uc/rf_uc_dx_intervals.csv',
+                 'results/rf_uc/rf_uc_dx_intervals_patient.csv',
+                 'results/rf_uc/rf_uc_vif.csv']
+rf_ic_results = ['results/rf_ic/rf_ic_roc.csv',
+                 'results/rf_ic/rf_ic_dx_intervals.csv',
+                 'results/rf_ic/rf_ic_dx_intervals_patient.csv',
+                 'results/rf_ic/rf_ic_vif.csv']
 
 """
-Sensitivity Analysis Models
+Steps
 """
-
-print('\n 08: Running sensitivity model of random forest model' +
-      '\n\n This model is as close to replicating the Waljee 2017 model' + 
-      '\n as possible with the Optum EHR')
-exec(open('08_rf_replicate.py').read())
-
-
-print('\n 09: Running sensitivity model of random forest model with' + 
-      '\n MICE imputation')
-exec(open('09_rf_mice.py').read())
+steps = [
+    Step('01', '01_lab_selector.py',
+         inputs=[raw_data, 'results/query_metrics/lab_catalog.csv',
+                 'results/query_metrics/labs_extract.csv'],
+         outputs=[config, 'results/query_metrics/variable_completeness.csv'],
+         message='Selecting labs measured on 70% of visits; saving labs ' +
+                 'to evaluate to config yaml file.'),
+    Step('02', '02_train_test.py',
+         inputs=[raw_data, config],
+         outputs=splits + features + [
+                  'results/query_metrics/cortsteroid_7day_exlcude.txt',
+                  'results/query_metrics/flare_events_summary.csv',
+                  'results/query_metrics/flare_events_ibd_subtype_summary.csv'],
+         message='Splitting visits randomly in to test and train.'),
+    # models
+    Step('03', '03_logreg_clinical_benchmark.py',
+         inputs=features + [config],
+         outputs=['models/logreg_clinical_benchmark.joblib'] + benchmark_results,
+         message='Running benchmark logistic model'),
+    Step('04', '04_logreg_regularization.py',
+         inputs=features + [config],
+         outputs=['models/logreg_regularization.joblib'] + logreg_results,
+         message='Running logistic model with labs'),
+    Step('05', '05_rf.py',
+         inputs=features + [config],
+         outputs=(['models/rf.joblib'] + rf_results + rf_cd_results +
+                  rf_uc_results + rf_ic_results),
+         message='Running random forest main model and chrons disease, ' +
+                 'ulcerative colitis and indeterminate colitis subgroups'),
+    Step('06', '06_manuscript_figures.py',
+         inputs=(benchmark_results + logreg_results + rf_results +
+                 rf_cd_results + rf_uc_results + rf_ic_results),
+         outputs=['results/manuscript/fig2_roc_dca_plot.png',
+                  'results/manuscript/ibd_subgroup_rf_roc_plot.png',
+                  'results/manuscript/rf_vif_plot.png',
+                  'results/manuscript/rf_vif_ibd_subgroups_plot.png',
+                  'results/manuscript/logistic_or_plot.png'],
+         message='Building most figures for manuscript'),
+    Step('07', '07_rf_shap_values.py',
+         inputs=['models/rf.joblib', config] + features,
+         outputs=['results/rf_shap/fig3_shap_summary.png',
+                  'results/rf_shap/fig4_dependence_plot.png'],
+         message='Running TreeSHAP script and results for treeshap'),
+    # sensitivity analysis models
+    Step('08', '08_rf_replicate.py',
+         inputs=[raw_data, config],
+         outputs=['data/splits/temporal_train.npy',
+                  'data/splits/temporal_test.npy',
+                  'results/rf_replicate/rf_roc.csv',
+                  'results/rf_replicate/rf_pred.csv'],
+         message='Running sensitivity random forest model as close to ' +
+                 'replicating the Waljee 2017 model as possible'),
+    Step('09', '09_rf_mice.py',
+         inputs=features + [config],
+         outputs=['results/rf_mice/rf_mice_roc.csv',
+                  'results/rf_mice/rf_mice_dx_intervals.csv'],
+         message='Running sensitivity random forest model with MICE ' +
+                 'imputation'),
+    Step('10', '10_model_tuning.py',
+         inputs=features + [config],
+         outputs=['results/rf_tuning/rf_tuning_results.csv',
+                  'results/rf_tuning/rf_best_params.json'],
+         message='Searching random forest hyperparameters with successive ' +
+                 'halving over n_estimators'),
+]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run analysis scripts in dependency order.')
+    parser.add_argument('steps', nargs='*',
+                        help='names of steps to run (default: all steps)')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='number of scripts to run at the same time')
+    parser.add_argument('--cores', type=int, default=11,
+                        help='total cores split between running scripts')
+    parser.add_argument('--force', action='store_true',
+                        help='rerun steps even if inputs have not changed')
+    args = parser.parse_args()
+
+    status = run_steps(
+        steps,
+        root_dir=root_dir,
+        analysis_dir=analysis_dir,
+        state_file=root_dir + '/data/logs/run_state.json',
+        log_dir=root_dir + '/data/logs/',
+        workers=args.workers,
+        force=args.force,
+        only=args.steps or None,
+        n_cores=args.cores)
+
+    # reduce the shared preprocessing cache once no step is using it
+    clean_preprocessing_cache(root_dir)
+    # and the cv fold caches of old data cuts and pipes
+    for fold_dir in clean_fold_caches(root_dir + '/data/cache/tuning_folds/'):
+        print('Removed cv fold cache:', fold_dir)
+
+    print('\nSummary of steps')
+    for step in steps:
+        print(step.name, ':', status[step.name])
@@ -13,31 +13,58 @@ EHR and hence the most useful in practice.
 Modules
 """
 print('Importing modules/packages')
-# import pandas and numpy
-import pandas as pd
 import os
+import importlib.util
 import yaml
 from datetime import date 
-
-# define project root directory based on project structure; c
-root_dir = os.path.dirname(os.path.dirname(os.getcwd()))
-
-# read flare prediction csv using pandas
-analysis_df = pd.read_csv(
-    (root_dir + "/data/raw/ibd_flare_analysis.csv"), 
-    dtype = {'birth_yr': str, 
-             'date_of_death': str}
-)
-
-# drop unnamed variable
-del(analysis_df['Unnamed: 0'])
-del(analysis_df['PTID'])
+# dtypes of the analysis csv
+from analysis_functions.data_cache import ANALYSIS_DTYPES
+
+# define project root directory based on location of this script
+analysis_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(os.path.dirname(analysis_dir))
+
+
+def load_query_module(name):
+    """load_query_module: Loads one module of sql_query/query_functions by
+    file. The query_functions package itself is not imported, so the
+    template and database modules (and jinja2) are not needed here.
+
+    name: module name (e.g. 'lab_catalog').
+    """
+    path = os.path.join(root_dir, 'scripts', 'sql_query', 'query_functions',
+                        name + '.py')
+    spec = importlib.util.spec_from_file_location('query_functions_' + name,
+                                                  path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# catalog of lab variable names saved by the sql_query labs stage and
+# column statistics saved by the export of the analysis table
+LabCatalog = load_query_module('lab_catalog').LabCatalog
+read_column_stats = load_query_module('export').read_column_stats
+
+# lab test names, variable names and suffix groups of the numeric labs; built
+# from the committed labs extracted table if the catalog was not saved
+catalog = LabCatalog.read_or_extract(
+    root_dir + '/results/query_metrics/lab_catalog.csv',
+    root_dir + '/results/query_metrics/labs_extract.csv')
+print('Labs in catalog:', len(catalog.labs))
+
+# column statistics (non missing count, min, max, mean) saved next to the
+# analysis csv by the export; computed in chunks if the csv has none
+column_stats = read_column_stats(root_dir + "/data/raw/ibd_flare_analysis.csv",
+                                 dtype=ANALYSIS_DTYPES)
+column_stats = column_stats.drop(['Unnamed: 0', 'PTID'], errors='ignore')
 
 """
 Calculation of variable completeness and identificaiton 
 of labs measured on at least 70% of observations
 """
-variable_completeness = (analysis_df.count()/analysis_df['id'].count())
+variable_completeness = (column_stats['non_null'] /
+                         column_stats.loc['id', 'non_null'])
 
 # save variable completeness
 variable_completeness.to_csv(
@@ -46,32 +73,13 @@ variable_completeness.to_csv(
     '/results/query_metrics/variable_completeness.csv',
     index_label='variable', header=['proportion'])
 
-# subset variable names with at least 70% complete
-var_names = list(variable_completeness.loc[lambda x: x >= 0.7].index)
-
-# creating list of wbc subset labs that will not be considered in the model 
-# as they are a subset of wbc in general
-wbc_subset = ['monocyte', 'lymphocyte', 'eosinophil', 'neutrophil', 'basophil']
-
-# append list of wbc subsets to exclude from analysis
-wbc_subset_list = [j for j in var_names if any(i in j for i in wbc_subset)]
-
 """
 Create dictionary of lists of labs measured on at least 70% of visits to
-add to yaml config file. These labs will be used in all models
+add to yaml config file. These labs will be used in all models; white blood
+cell subsets (e.g. monocytes) are flagged in the catalog and left out as
+they are a subset of wbc in general
 """
-
-# create empty dictionry labs to append to config yaml file
-labs = {}
-
-for i in ['_base', '_mean', '_max', '_mean_acc', '_max_acc']:
-    # this finds all labs with the lab version and excludes white bloodcell subsets 
-    labs_list = list(set([j for j in var_names if i in j]) - set(wbc_subset_list))
-    # sort labs list
-    labs_list.sort()
-    # append labs dictionary
-    labs.update({'labs' + i: labs_list})
-
+labs = catalog.config_labs(variable_completeness, threshold=0.7)
 
 """
 Open analysis_config.yaml and update with labs that will
@@ -18,10 +18,16 @@ print('Importing modules/packages')
 # import pandas and numpy
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split 
 import os
-import joblib # for saving train_test split
 import yaml
+# columnar cache of the analysis csv
+from analysis_functions.data_cache import read_analysis_table
+# vectorized exclusion filters with attrition counts
+from analysis_functions.cohort_filters import apply_exclusions
+# float32 feature matrix store shared by the models
+from analysis_functions.feature_store import build_feature_store
+# train and test splits saved as row index arrays
+from analysis_functions.splits import random_split, grouped_split, save_split
 
 """
 Read in analysis dataframe and process dataframe
@@ -31,33 +37,46 @@ root_dir = os.path.dirname(os.path.dirname(os.getcwd()))
 # define results folder as query metrics
 results_folder = root_dir + '/results/query_metrics/'
 
-# read flare prediction csv using pandas
-analysis_df = pd.read_csv(
-    (root_dir + "/data/raw/ibd_flare_analysis.csv"), 
-    dtype = {'birth_yr': str, 
-             'date_of_death': str}
-)
+# load yaml file that contains list of variables
+# labs must meet measured on at least 70% of observations 
+# requirement to be included
+with open('analysis_config.yaml', 'r') as f:
+    config = yaml.safe_load(f)
 
-# delete Unnamed: 0 column
-try:
-    del(analysis_df['Unnamed: 0'])
-except:
-    print('Already deleted column')
+# set outcome column name
+outcome = config['outcome']['flare_v1']
+
+# set features names
+cat_vars = config['features']['patient_indicator']['categorical']
+num_vars = config['features']['patient_indicator']['numeric']
+other_vars = config['features']['patient_indicator']['other']
+# set base, mean, and max labs list
+labs_base = config['features']['labs']['labs_base']
+labs_mean = config['features']['labs']['labs_mean']
+labs_max = config['features']['labs']['labs_max']
+
+# combine all columns together
+predictors = (cat_vars + num_vars + other_vars + 
+              labs_base + labs_mean + labs_max)
+
+# read only the columns used for filtering, summaries and the split
+analysis_df = read_analysis_table(
+    root_dir + "/data/raw/ibd_flare_analysis.csv",
+    columns = (['id', outcome, 'day_supply_criteria', 'disease_category'] + 
+               predictors)
+)
 
 print("Filtering out observations of corticosteroid without 7 day supply")
-# count number of observations before filter
-obs_pre_filter = analysis_df.shape[0] 
-
-# remove observations where flare_v1 = 0 and steorid_flare is present, but day supply is missing
-analysis_df = (
-    analysis_df
-    # ~ inverts the logic operator
-    .loc[~analysis_df[['flare_v1', 'day_supply_criteria']]
-    .apply(lambda x: x['flare_v1'] == 0 and x['day_supply_criteria']=='no',
-           axis=1)]
+# remove observations where flare_v1 = 0 and steorid_flare is present, but 
+# day supply is missing; expression is evaluated on whole columns at once
+analysis_df, attrition = apply_exclusions(
+    analysis_df,
+    [('Corticosteroid missing 7 day supply', 
+      "flare_v1 == 0 and day_supply_criteria == 'no'")]
 )
-# count up rows post filter
-obs_post_filter = analysis_df.shape[0]
+# count number of observations before and after filter
+obs_pre_filter = attrition.loc[0, 'n_before']
+obs_post_filter = attrition.loc[0, 'n_after']
 
 print('Corticosteroid missing 7 day supply filter',
       '\nNumber of rows before filter:', obs_pre_filter,
@@ -111,46 +130,35 @@ print(subtype_summary)
 subtype_summary.to_csv(results_folder + 'flare_events_ibd_subtype_summary.csv')
 
 """
-Split and save permanent train test datasets
+Split and save train test row indexes
 """
-# load yaml file that contains list of variables
-# labs must meet measured on at least 70% of observations 
-# requirement to be included
-with open('analysis_config.yaml', 'r') as f:
-    config = yaml.safe_load(f)
-
-# set outcome column name
-outcome = config['outcome']['flare_v1']
-
-# set features names
-cat_vars = config['features']['patient_indicator']['categorical']
-num_vars = config['features']['patient_indicator']['numeric']
-other_vars = config['features']['patient_indicator']['other']
-# set base, mean, and max labs list
-labs_base = config['features']['labs']['labs_base']
-labs_mean = config['features']['labs']['labs_mean']
-labs_max = config['features']['labs']['labs_max']
-
-# combine all columns together
-predictors = (cat_vars + num_vars + other_vars + 
-              labs_base + labs_mean + labs_max)
-
 print('Splitting training (70%) and testing set (30%)')
-# split to train test split; including outcome with predictors
-train, test = train_test_split(
-    # features + outcome + disease category for subset analyses later on
-    analysis_df.loc[:, [outcome] + predictors + ['disease_category']], 
-    # random state for replicability
-    random_state = 12, 
-    # reserve 30% for testing
-    test_size = 0.3)
-
-print('Saving train and test data in datafolder for use with models')
-# define data directory to save train and test
-data_dir = root_dir + '/data/train_test/'
-# save 70% train
-train.to_csv(data_dir + 'train.csv')
-# save 30% test
-test.to_csv(data_dir + 'test.csv')
-
-print('Finished writting train and test')
\ No newline at end of file
+# split row index of the analysis table; the same rows and order as
+# train_test_split on the dataframe with random state 12
+train_index, test_index = random_split(analysis_df.index,
+                                       # reserve 30% for testing
+                                       test_size = 0.3,
+                                       # random state for replicability
+                                       random_state = 12)
+
+print('Saving train and test row indexes in data folder')
+# only the row indexes are saved; no copies of the data
+split_dir = root_dir + '/data/splits/'
+save_split(split_dir, 'random', train_index, test_index)
+# patient level split for sensitivity analyses where visits of a person
+# should not be in both train and test
+save_split(split_dir, 'patient',
+           *grouped_split(analysis_df.index, analysis_df['id'],
+                          test_size = 0.3, random_state = 12))
+
+# features + outcome + disease category for subset analyses later on; id for
+# the patient bootstrap
+train = analysis_df.loc[train_index, [outcome] + predictors + ['disease_category', 'id']]
+test = analysis_df.loc[test_index, [outcome] + predictors + ['disease_category', 'id']]
+
+print('Building feature store of model features for train and test')
+# features are saved as float32 arrays that the models load memory mapped
+build_feature_store({'train': train, 'test': test}, config,
+                    store_dir = root_dir + '/data/features/')
+
+print('Finished building feature store')
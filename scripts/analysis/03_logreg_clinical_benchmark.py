@@ -19,8 +19,8 @@ import time
 import yaml
 # import os
 import os 
-# joblib for saving models and parallel for multi processing (bootstraps)
-from joblib import dump, Parallel, delayed
+# joblib for saving models
+from joblib import dump
 # plot packages
 import matplotlib.pyplot as plt
 import seaborn as sns; sns.set_style('whitegrid')
@@ -48,10 +48,16 @@ from sklearn.metrics import brier_score_loss
 
 # import custom metrics function
 from analysis_functions.custom_metrics import dx_accuracy
-from analysis_functions.custom_metrics import model_metrics_boot
+from analysis_functions.custom_metrics import boot_dx_metrics
 from analysis_functions.custom_metrics import boot_95
 # custom roc plot
 from analysis_functions.custom_metrics import roc_plot
+# feature lists and float32 feature store built by 02_train_test.py
+from analysis_functions.feature_store import model_columns, load_features
+# cache of fitted transformation steps shared by the model scripts
+from analysis_functions.fit_cache import preprocessing_memory
+# number of cores of this step when run by 00_run_analyses.py
+from analysis_functions.pipeline import step_n_jobs
 from analysis_functions.custom_metrics import odds_ratio_plot
 
 """
@@ -62,6 +68,12 @@ root_dir = os.path.dirname(os.path.dirname(os.getcwd()))
 # load config yaml file
 with open('analysis_config.yaml', 'r') as f:
     config = yaml.safe_load(f)
+# numeric features and other features passed as is; same order as the store
+num_cols, other_cols = model_columns(config, labs = False)
+# set outcome; leaving as a string
+outcome = config['outcome']['flare_v1']
+# feature store of train and test features built by 02_train_test.py
+store_dir = root_dir + '/data/features/'
 
 
 """
@@ -72,15 +84,12 @@ Import train data
 
 print('Fitting model on training data')
 
-train_data_path = root_dir + '/data/train_test/train.csv'
 # start time
 start_time = time.time()
-# read flare prediction csv using pandas
-train = pd.read_csv(train_data_path, 
-                    dtype = {'birth_yr': str, 'date_of_death': str})
-
-# create male_v_female binary variable; easier to interpret in this model
-train['male_v_female'] = train['gender'].apply(lambda x: 1 if x=='Male' else 0)
+# load train features memory mapped from the feature store
+x_train, y_train, _ = load_features(store_dir, 'train',
+                                    columns = num_cols + other_cols,
+                                    config = config)
 
 # print run time
 print("%s seconds" % (time.time()-start_time))
@@ -102,16 +111,6 @@ Fit:
 1. Fit features to outcome using logistic regresion (no regularization added)
 """
 
-# define predictors
-num_cols = config['features']['patient_indicator']['numeric']
-# set other columns
-other_cols = ['immuno_med', 'male_v_female', 'prev_flare_v1_sum']
-# set outcome; leaving as a string
-outcome = config['outcome']['flare_v1'] 
-
-
-# split features and outcomes
-x_train, y_train = train.loc[:, num_cols + other_cols], train.loc[:, outcome]
 
 print("Setting up sklearn pipelines")
 # numeric transformation pipeline to standardize
@@ -147,7 +146,8 @@ model_pipe = Pipeline([
     ('transform_pipe', transform_pipe),
     ('random_undersample', rand_undersamp),
     ('logistic_model', logreg)
-])
+    # fitted preprocessing steps reused from data/cache/preprocessing/
+], memory = preprocessing_memory(root_dir))
 
 """
 Fitting x_train and y_train through transformation pipeline
@@ -173,32 +173,17 @@ TESTING/VALIDATION
 Import test data
 """
     
-data_path = root_dir + '/data/train_test/test.csv'
 # start time
 start_time = time.time()
-# read flare prediction csv using pandas
-test = pd.read_csv(data_path, dtype = {'birth_yr': str, 'date_of_death': str})
-
-# create male_v_female binary variable; easier to interpret in this model
-test['male_v_female'] = test['gender'].apply(lambda x: 1 if x=='Male' else 0)
+# load test features memory mapped from the feature store
+x_test, y_test, _ = load_features(store_dir, 'test',
+                                  columns = num_cols + other_cols,
+                                  config = config)
 
 # print run time
 print("%s seconds" % (time.time()-start_time))
 
 
-"""
-Subset x_features data and y_outcomes data
-"""
-# define predictors
-num_cols = config['features']['patient_indicator']['numeric']
-# set other columns
-other_cols = ['immuno_med', 'male_v_female', 'prev_flare_v1_sum']
-# set outcome; leaving as a string
-outcome = config['outcome']['flare_v1'] 
-
-# split features and outcomes
-x_test, y_test = test.loc[:, num_cols + other_cols], test.loc[:, outcome]
-
 """
 Predict on test data
 """
@@ -308,17 +293,14 @@ run_boot=True
 
 if run_boot==True:
     print('Running bootstrap')
-    # using 11 workers on AWS environment to calculate performance metrics
-    # create lists of metrics
-    boot_list = Parallel(n_jobs=11)(
-        # use joblib delayed to register function
-        delayed(model_metrics_boot)
-        # function parameters
-        (model=model_pipe, 
-         x_test=x_test, 
-         y_test=y_test,
-         boot_iteration=i) for i in range(100)
-    )
+    # predict once on x_test (y_pred) and resample row indexes of the
+    # predictions; metrics for all replicates are computed with numpy
+    boot_list = boot_dx_metrics(y_true=y_test,
+                                y_prob=y_pred[:, 1],
+                                n_boot=2000,
+                                # fixed seed; replicates on the cores
+                                # of this step
+                                seed=0, n_jobs=step_n_jobs())
 
     # use boot_95 function to calculate percentile boot list
     dx_intervals = boot_95(boot_list)
@@ -134,23 +134,22 @@ rf = pd.read_csv('../../results/rf/rf_pred.csv')
 
 ### Calculate net benefits for models based on bayes probabilities ### 
 
-# logreg benchmark clinical only
-logreg_bench_net_ben = dca(
-    true_class = logreg_bench['flare_true'], 
-    model_pred_prob = logreg_bench['bayes_prob']
+# net benefit for each model in one call; returns dictionary of dataframes
+net_ben = dca(
+    true_class = {'logreg_bench': logreg_bench['flare_true'],
+                  'logreg': logreg['flare_true'],
+                  'rf': rf['flare_true']},
+    model_pred_prob = {'logreg_bench': logreg_bench['bayes_prob'],
+                       'logreg': logreg['bayes_prob'],
+                       'rf': rf['bayes_prob']}
 )
 
+# logreg benchmark clinical only
+logreg_bench_net_ben = net_ben['logreg_bench']
 # logistic clinical + labs
-logreg_net_ben = dca(
-    true_class = logreg['flare_true'], 
-    model_pred_prob = logreg['bayes_prob']
-)
-
+logreg_net_ben = net_ben['logreg']
 # random forest net benefit
-rf_net_ben = dca(
-    true_class = rf['flare_true'],
-    model_pred_prob = rf['bayes_prob']
-)
+rf_net_ben = net_ben['rf']
 
 
 # All treatment net benefit
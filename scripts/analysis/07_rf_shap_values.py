@@ -19,8 +19,7 @@ set.
 """
 Modules
 """
-# import pandas and numpy
-import pandas as pd
+# import numpy
 import numpy as np
 # timing processes
 import time
@@ -32,14 +31,18 @@ from matplotlib.colors import ListedColormap # for custom color maps
 import seaborn as sns; sns.set_style('whitegrid')
 # joblib for saving models
 from joblib import dump, load
-# import joblib for parallel processing
-from joblib import Parallel, delayed
 # SHAP python module
 import shap
 # initialize javascript output
 shap.initjs()
 # load function to make variables easier to read
 from analysis_functions.custom_metrics import readable_variables
+# chunked SHAP values cached on disk
+from analysis_functions.shap_cache import cached_shap_values
+# feature lists and float32 feature store built by 02_train_test.py
+from analysis_functions.feature_store import model_columns, load_features
+# number of cores of this step when run by 00_run_analyses.py
+from analysis_functions.pipeline import step_n_jobs
 
 """
 Setup
@@ -49,6 +52,12 @@ root_dir = os.path.dirname(os.path.dirname(os.getcwd()))
 # load config yaml file
 with open('analysis_config.yaml', 'r') as f:
     config = yaml.safe_load(f)
+# numeric features and other features passed as is; same order as the store
+num_cols, other_cols = model_columns(config)
+# set outcome; leaving as a string
+outcome = config['outcome']['flare_v1']
+# feature store of train and test features built by 02_train_test.py
+store_dir = root_dir + '/data/features/'
     
 # set results folder to save results to
 results_folder = root_dir + '/results/rf_shap/'
@@ -56,34 +65,16 @@ results_folder = root_dir + '/results/rf_shap/'
 """
 Import test data; shape doesn't really need outcome values but i'll import
 """
-# path to test dataset
-data_path = root_dir + '/data/train_test/test.csv'
 # start time
 start_time = time.time()
-# read flare prediction csv using pandas
-test = pd.read_csv(data_path, dtype = {'birth_yr': str, 'date_of_death': str})
-
-# create male_v_female binary variable; easier to interpret in this model
-test['male_v_female'] = test['gender'].apply(lambda x: 1 if x=='Male' else 0)
+# load test features memory mapped from the feature store
+x_test, y_test, _ = load_features(store_dir, 'test',
+                                  columns = num_cols + other_cols,
+                                  config = config)
 
 # print run time
 print("%s seconds" % (time.time()-start_time))
 
-"""
-Subset x_features data and y_outcomes data
-"""
-# define predictors
-labs_base = config['features']['labs']['labs_base']
-labs_mean = config['features']['labs']['labs_mean']
-labs_max = config['features']['labs']['labs_max']
-age = config['features']['patient_indicator']['numeric']
-# combine all numeric values in a single list
-num_cols = labs_base + labs_mean + labs_max + age
-# set other columns
-other_cols = ['immuno_med', 'male_v_female', 'prev_flare_v1_sum']
-# set outcome; leaving as a string
-outcome = config['outcome']['flare_v1'] 
-
 # create features list
 # define feature list; this is the same order fed in to the model
 feature_list = num_cols + other_cols
@@ -91,9 +82,6 @@ feature_list = num_cols + other_cols
 # make readable list of variable names
 readable_names = readable_variables(feature_list)
 
-# split features and outcomes
-x_test, y_test = test.loc[:, num_cols + other_cols], test.loc[:, outcome]
-
 
 """
 Load saved random forest model
@@ -113,7 +101,7 @@ x_validation = transform.transform(x_test)
 """
 SHAP Tree Expaliner
 """
-# initialze shap tree explainer
+# initialze shap tree explainer; used for the expected value in force plots
 rf_explainer = shap.TreeExplainer(rf_pipe.named_steps['rf'])
 
 """
@@ -126,10 +114,19 @@ SHAP value represents the log odds.
 Using default tree-dependent calculation of conditional shap values
 as i do not supply it data. Other option is intervential which uses
 do-calculus, but takes a whole lot longer
+
+SHAP values are computed on chunks of x_validation in parallel processes
+and each chunk is saved in data/shap_cache/ by model and rows, so reruns
+only compute missing chunks. Values of the flare class (class 1) are
+returned memory mapped.
 """
-shap_vals = rf_explainer.shap_values(
+shap_vals = cached_shap_values(
+    model_file=root_dir + '/models/rf.joblib',
     # use x_validation array
-    x_validation,
+    x=x_validation,
+    cache_dir=root_dir + '/data/shap_cache/',
+    chunk_size=1000,
+    n_jobs=step_n_jobs(),
     # using approximate=True to speed up computation time
     approximate=True)
 
@@ -150,7 +147,7 @@ newcmp = ListedColormap(vals)
 # summary plot eps format
 plt.figure()
 fig = shap.summary_plot(
-    shap_values=shap_vals[1], 
+    shap_values=shap_vals, 
     features=x_validation, 
     feature_names=readable_names,
     max_display = 10,
@@ -175,7 +172,6 @@ plt.savefig(results_folder + "fig3_shap_summary.png", dpi=300) # png version
 plt.savefig(root_dir + "/results/manuscript/fig3_shap_summary.png", dpi=300) # png version
 
 
-
 """
 Plot of top 4 features
 """
@@ -189,7 +185,7 @@ fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(
 # previous flare
 shap.dependence_plot(
     ind=33,
-    shap_values=shap_vals[1], 
+    shap_values=shap_vals, 
     features=x_validation, 
     feature_names=readable_names,
     # no interaction
@@ -203,7 +199,7 @@ ax1.set_title('A', loc='left', size=14)
 # age
 shap.dependence_plot(
     ind=30,
-    shap_values=shap_vals[1], 
+    shap_values=shap_vals, 
     features=x_validation, 
     feature_names=readable_names,
     # no interaction
@@ -218,7 +214,7 @@ ax2.set_title('B', loc='left', size=14)
 # potassium
 shap.dependence_plot(
     ind=17,
-    shap_values=shap_vals[1], 
+    shap_values=shap_vals, 
     features=x_validation, 
     feature_names=readable_names,
     # no interaction
@@ -232,7 +228,7 @@ ax3.set_title('C', loc='left', size=14)
 # wbc
 shap.dependence_plot(
     ind=19,
-    shap_values=shap_vals[1], 
+    shap_values=shap_vals, 
     features=x_validation, 
     feature_names=readable_names,
     # no interaction
@@ -258,14 +254,13 @@ plt.savefig(results_folder + "fig4_dependence_plot.png", bbox_inches='tight', dp
 plt.savefig(root_dir + "/results/manuscript/fig4_dependence_plot.png", bbox_inches='tight', dpi=300) 
 
 
-
 """
 End plots for paper
 """
 
 shap.dependence_plot(
     ind=30,
-    shap_values=shap_vals[1], 
+    shap_values=shap_vals, 
     features=x_validation, 
     feature_names=readable_names,
     # no interaction
@@ -282,20 +277,21 @@ for i,s in enumerate(readable_names):
 
     shap.dependence_plot(
         ind=s,
-        shap_values=shap_vals[1], 
+        shap_values=shap_vals, 
         features=x_validation, 
         feature_names=readable_names,
         # no interaction
         interaction_index=None,
         show=False
         )
-    # save plot
+    # save plot and close figure so plots are not held in memory
     plt.savefig(results_folder + '/dependency_plots/' + str(s) + '.png')
+    plt.close()
     
 # saving previous flare and eps and pdf for publication; last element 33
 shap.dependence_plot(
     ind=33,
-    shap_values=shap_vals[1], 
+    shap_values=shap_vals, 
     features=x_validation, 
     feature_names=readable_names,
     # no interaction
@@ -308,7 +304,7 @@ plt.savefig(results_folder + 'Previous_Flare_Sum.eps')
 # pdf version
 shap.dependence_plot(
     ind=33,
-    shap_values=shap_vals[1], 
+    shap_values=shap_vals, 
     features=x_validation, 
     feature_names=readable_names,
     # no interaction
@@ -335,17 +331,14 @@ flare_subset = np.random.choice(
 for idx in flare_subset:
     print('Observed Outcome:', np.where(y_test.iloc[idx]==1, 'Flare', 'No Flare'))
     # find 5 biggest shap values
-    shap_idx = np.argpartition(abs(shap_vals[1][idx,:]), -5)[-5:]
+    shap_idx = np.argpartition(abs(shap_vals[idx,:]), -5)[-5:]
 
     # individual level prediciton for first subject in testing set with a flare
     fig = shap.force_plot(base_value=rf_explainer.expected_value[0], 
                           # shap value
-                          shap_values=shap_vals[1][idx,shap_idx], 
-                          # need to use the transformer pipe to one hot code
-                          features=np.round(
-                              transform.transform(
-                                  x_test.iloc[[idx]])[0][shap_idx],
-                              1),
+                          shap_values=shap_vals[idx,shap_idx], 
+                          # transformed features of the same row
+                          features=np.round(x_validation[idx, shap_idx], 1),
                           # output names
                           out_names=[''],
                           # feature names
@@ -376,17 +369,14 @@ no_flare_subset = np.random.choice(
 for idx in no_flare_subset:
     print('Observed Outcome:', np.where(y_test.iloc[idx]==1, 'Flare', 'No Flare'))
     # find 5 biggest shap values
-    shap_idx = np.argpartition(abs(shap_vals[1][idx,:]), -5)[-5:]
+    shap_idx = np.argpartition(abs(shap_vals[idx,:]), -5)[-5:]
 
     # individual level prediciton for first subject in testing set with a flare
     fig = shap.force_plot(base_value=rf_explainer.expected_value[0], 
                           # shap value
-                          shap_values=shap_vals[1][idx,shap_idx], 
-                          # need to use the transformer pipe
-                          features=np.round(
-                              transform.transform(
-                                  x_test.iloc[[idx]])[0][shap_idx],
-                              1),
+                          shap_values=shap_vals[idx,shap_idx], 
+                          # transformed features of the same row
+                          features=np.round(x_validation[idx, shap_idx], 1),
                           # output names
                           out_names=[''],
                           # feature names
@@ -26,8 +26,8 @@ print('Importing modules/packages')
 import pandas as pd
 import numpy as np
 
-# import groupshufflesplit for splitting of testtrain by subject id
-from sklearn.model_selection import GroupShuffleSplit
+# per patient temporal split saved as row index arrays
+from analysis_functions.splits import temporal_split, save_split
 # import rf classifier
 from sklearn.ensemble import RandomForestClassifier
 # import preprocessing
@@ -58,14 +58,20 @@ from sklearn.metrics import brier_score_loss
 # plot packages
 import matplotlib.pyplot as plt
 import seaborn as sns; sns.set_style('whitegrid')
-# from joblib import load for model, and parallel for multi processing
-from joblib import Parallel, delayed
 # import custom metrics function
 from analysis_functions.custom_metrics import dx_accuracy
-from analysis_functions.custom_metrics import model_metrics_boot
+from analysis_functions.custom_metrics import boot_dx_metrics
 from analysis_functions.custom_metrics import boot_95
 # custom roc plot
 from analysis_functions.custom_metrics import roc_plot
+# columnar cache of the analysis csv
+from analysis_functions.data_cache import read_analysis_table
+# vectorized male_v_female encoding shared with the feature store
+from analysis_functions.feature_store import male_v_female
+# cache of fitted transformation steps shared by the model scripts
+from analysis_functions.fit_cache import preprocessing_memory
+# number of cores of this step when run by 00_run_analyses.py
+from analysis_functions.pipeline import step_n_jobs
 
 
 """
@@ -84,11 +90,18 @@ Import train data
 data_path = root_dir + '/data/raw/ibd_flare_analysis.csv'
 # start time
 start_time = time.time()
-# read flare prediction csv using pandas; subset to crohns disease
-data = pd.read_csv(data_path, dtype = {'birth_yr': str, 'date_of_death': str})
+# columns used in this model; labs, age, patient indicators and visit keys
+data_cols = (['id', 'vis_date', 'gender', 'immuno_med', 'prev_flare_v1_sum',
+              config['outcome']['flare_v1']] + 
+             config['features']['labs']['labs_base'] + 
+             config['features']['labs']['labs_mean'] + 
+             config['features']['labs']['labs_max'] + 
+             config['features']['patient_indicator']['numeric'])
+# read flare prediction data through the columnar cache
+data = read_analysis_table(data_path, columns = data_cols)
 
 # create male_v_female binary variable; easier to interpret in this model than one hot
-data['male_v_female'] = data['gender'].apply(lambda x: 1 if x=='Male' else 0)
+data['male_v_female'] = male_v_female(data['gender'])
 
 # print run time
 print("%s seconds" % (time.time()-start_time))
@@ -130,9 +143,9 @@ multi_vis = multi_vis.loc[multi_vis['vis_date'] >= 2, :]
 
 print("Sample size: ", multi_vis.shape[0])
 sample = (data.loc[data['id'].isin(multi_vis['id']), :]
-          .sort_values(['id', 'vis_date'])
-          # reset index after ordering for splitting of test train below
-          .reset_index())
+          # ordered by patient and visit; row index labels are kept so the
+          # split can be saved as row indexes of the analysis table
+          .sort_values(['id', 'vis_date']))
 
 # add visit number for my info to make sure it's sorting right
 sample['visit'] = sample.groupby('id').cumcount().add(1)
@@ -153,20 +166,15 @@ is trained on and 30% of later visits are reserved for testing validation
 print('Spitting test train by patient')
 print("Taking 30% sample of original dataframe")
 
-# Find last 30% of values to reserve for testing
-# note this takes a long time for the dataset
-test_index = (sample.groupby('id')
-              .apply(lambda x: x.tail(int(np.floor(x['visit'].max()*0.3))))
-              .index.values)
+# Find last 30% of visits of each patient to reserve for testing; visit
+# numbers from groupby cumcount instead of a python function per patient
+train_index, test_index = temporal_split(sample.index, sample['id'],
+                                         sample['vis_date'], test_size=0.3)
+save_split(root_dir + '/data/splits/', 'temporal', train_index, test_index)
 
-# flatten list of lists in to one list; sorry this is confusing....
-# this just returns one long vector/array of index's that will serve as 
-# testing validation.
-test_index_locs = [i for (pid, i) in test_index]
-
-# sample test and train datasets  by group indicators
-train = sample.iloc[~sample.index.isin(test_index_locs)]
-test = sample.iloc[sample.index.isin(test_index_locs)]
+# sample test and train datasets by row index
+train = sample.loc[train_index]
+test = sample.loc[test_index]
 
 # check that train and test contain unique ids
 assert any((test['id'].isin(train['id']))), 'Subjects in both test and train'
@@ -228,16 +236,17 @@ transform_pipe = FeatureUnion(
 
 
 # define RF model
-rf = RandomForestClassifier(n_estimators = 500, n_jobs = 11)
+rf = RandomForestClassifier(n_estimators = 500, n_jobs = step_n_jobs())
 
 # random forest pipe
 model_pipe = Pipeline([
-    ('past_median_labs', PastMedianLabs(lab_vars = labs, 
+    ('past_median_labs', PastMedianLabs(lab_vars = labs, n_jobs = min(4, step_n_jobs()),
                                         variables = predictors)),
     ('transform_pipe', transform_pipe),
     #('random_undersample', rand_undersamp),
     ('rf', rf)
-])
+    # fitted preprocessing steps reused from data/cache/preprocessing/
+], memory = preprocessing_memory(root_dir))
 
 print("Fitting RF pipeline on x_train, y_train")
 # fit y_train on x_train features on pipeline with rf cv pipe
@@ -399,17 +408,14 @@ run_boot=False
 
 if run_boot==True:
     print('Running bootstrap')
-    # using 11 workers on AWS environment to calculate performance metrics
-    # create lists of metrics
-    boot_list = Parallel(n_jobs=11)(
-        # use joblib delayed to register function
-        delayed(model_metrics_boot)
-        # function parameters
-        (model=model_pipe, 
-         x_test=x_test, 
-         y_test=y_test,
-         boot_iteration=i) for i in range(100)
-    )
+    # predict once on x_test (y_pred) and resample row indexes of the
+    # predictions; metrics for all replicates are computed with numpy
+    boot_list = boot_dx_metrics(y_true=y_test,
+                                y_prob=y_pred[:, 1],
+                                n_boot=2000,
+                                # fixed seed; replicates on the cores
+                                # of this step
+                                seed=0, n_jobs=step_n_jobs())
 
     # use boot_95 function to calculate percentile boot list
     dx_intervals = boot_95(boot_list)
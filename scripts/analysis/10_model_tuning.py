@@ -0,0 +1,157 @@
+"""
+Title: Hyperparameter search for the random forest and logistic models
+Date Created: 2026-10-18
+
+The random forest of 05_rf.py is fit with n_estimators=500 and default
+depth. This script searches depth, min_samples_leaf and max_features of
+the random forest with successive halving over n_estimators: 27 candidates
+are fit with 20 trees, the best third with 60 trees, then 180 and 500.
+The logistic model of 04_logreg_regularization.py has its regularization
+strength C searched the same way without halving.
+
+The transformation pipe is fit once per cross validation fold and cached
+in data/cache/tuning_folds/ (see analysis_functions/model_tuning.py);
+candidates and folds are fit in parallel processes on the cached arrays.
+
+Run from the analysis folder:
+
+'python3 10_model_tuning.py' tunes the random forest.
+'python3 10_model_tuning.py --model logreg' tunes the logistic model.
+'python3 10_model_tuning.py --n-jobs 8 --folds 5' sets processes and folds.
+"""
+
+
+"""
+Modules
+"""
+print('Importing modules/packages')
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import yaml
+from scipy.stats import loguniform
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import StratifiedKFold
+from sklearn.pipeline import FeatureUnion
+from sklearn.preprocessing import StandardScaler
+from imblearn.pipeline import Pipeline
+from imblearn.under_sampling import RandomUnderSampler
+
+# custom package that uses sklearn baseestimator and transformermixin
+from analysis_functions.transformers import FeatureSelector
+# transformation pipe and model steps of the random forest in 05_rf.py
+from analysis_functions.rf_trainer import rf_transform_pipe, rf_model
+# cached cv folds and successive halving search
+from analysis_functions.model_tuning import FoldCache, halving_search
+# feature lists and float32 feature store built by 02_train_test.py
+from analysis_functions.feature_store import model_columns, load_features
+# number of cores of this step when run by 00_run_analyses.py
+from analysis_functions.pipeline import step_n_jobs
+
+
+def logreg_transform_pipe(num_cols, other_cols):
+    """logreg_transform_pipe: Transformation pipe of
+    04_logreg_regularization.py; numeric features are imputed with the
+    median and standardized, other features are passed as is.
+    """
+    num_pipe = Pipeline(
+        [('num_selector', FeatureSelector(feature_names = num_cols)),
+         ('median_impute', SimpleImputer(missing_values = np.nan,
+                                         strategy = 'median')),
+         ('std_scaler', StandardScaler())
+        ])
+    other_pipe = Pipeline(
+        [('other_selector', FeatureSelector(feature_names = other_cols))
+        ])
+    return FeatureUnion(
+        [('numeric_pipeline', num_pipe),
+         ('other_pipeline', other_pipe)
+        ])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Hyperparameter search with cached cv folds.')
+    parser.add_argument('--model', choices=['rf', 'logreg'], default='rf',
+                        help='model pipeline to tune')
+    parser.add_argument('--folds', type=int, default=3,
+                        help='number of cross validation folds')
+    parser.add_argument('--n-jobs', type=int, default=step_n_jobs(),
+                        help='number of processes fitting candidates')
+    args = parser.parse_args()
+
+    """
+    Setup
+    """
+    # define project root directory based on project structure
+    root_dir = os.path.dirname(os.path.dirname(os.getcwd()))
+    # load config yaml file
+    with open('analysis_config.yaml', 'r') as f:
+        config = yaml.safe_load(f)
+    # numeric features and other features passed as is; same order as store
+    num_cols, other_cols = model_columns(config)
+    store_dir = root_dir + '/data/features/'
+    results_folder = root_dir + '/results/' + args.model + '_tuning/'
+    os.makedirs(results_folder, exist_ok=True)
+
+    # load train features memory mapped from the feature store; the test
+    # set is not used for tuning
+    x_train, y_train, _ = load_features(store_dir, 'train',
+                                        columns = num_cols + other_cols,
+                                        config = config)
+
+    """
+    Search setup
+    """
+    if args.model == 'rf':
+        transform_pipe = rf_transform_pipe(num_cols, other_cols)
+        # one core per forest; tasks run in parallel processes instead
+        model = rf_model(n_jobs = 1)
+        param_distributions = {
+            'rf__max_depth': [None, 8, 12, 16, 24],
+            'rf__min_samples_leaf': [1, 5, 10, 25, 50],
+            'rf__max_features': ['sqrt', 'log2', 0.3, 0.5]}
+        search_params = dict(n_candidates = 27,
+                             resource = 'rf__n_estimators',
+                             min_resources = 20, max_resources = 500,
+                             factor = 3)
+    else:
+        transform_pipe = logreg_transform_pipe(num_cols, other_cols)
+        model = Pipeline([
+            ('random_undersample', RandomUnderSampler(random_state=0)),
+            ('logreg', LogisticRegression(random_state=0, solver = 'saga',
+                                          penalty='l1', max_iter=1000,
+                                          fit_intercept=False))])
+        param_distributions = {'logreg__C': loguniform(1e-3, 10)}
+        search_params = dict(n_candidates = 12, resource = None)
+
+    # folds stratified on flare; fixed seed so the fold cache is reused
+    cv = StratifiedKFold(n_splits = args.folds, shuffle = True,
+                         random_state = 12)
+
+    """
+    Search
+    """
+    start_time = time.time()
+    folds = FoldCache(root_dir + '/data/cache/tuning_folds/',
+                      transform_pipe, x_train, y_train, cv)
+    results, best_params = halving_search(model, param_distributions, folds,
+                                          scoring = 'roc_auc',
+                                          n_jobs = args.n_jobs,
+                                          random_state = 0,
+                                          **search_params)
+    print("%s seconds" % (time.time()-start_time))
+
+    # save every candidate and iteration and the best parameters
+    results.to_csv(results_folder + args.model + '_tuning_results.csv')
+    with open(results_folder + args.model + '_best_params.json', 'w') as f:
+        # numpy values (e.g. sampled C) as python numbers
+        json.dump({k: getattr(v, 'item', lambda: v)()
+                   for k, v in best_params.items()}, f, indent=2)
+    print(results.sort_values(['iteration', 'mean_score'],
+                              ascending=False).head(10))
+    print('Results saved here:', results_folder)
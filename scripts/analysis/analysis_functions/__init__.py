@@ -6,4 +6,16 @@ Initializes modules used in custom utility functions for the project.
 # define custom functions
 from analysis_functions import custom_metrics
 from analysis_functions import transformers
+from analysis_functions import data_cache
 
+from analysis_functions import pipeline
+from analysis_functions import cohort_filters
+from analysis_functions import past_median
+from analysis_functions import rf_trainer
+from analysis_functions import feature_store
+from analysis_functions import shap_cache
+from analysis_functions import scoring
+from analysis_functions import compiled_forest
+from analysis_functions import splits
+from analysis_functions import model_tuning
+from analysis_functions import fit_cache
@@ -0,0 +1,53 @@
+"""
+Vectorized cohort filters
+
+Exclusion criteria are passed as boolean column expressions, evaluated on
+whole columns at once, and applied in one subset of the dataframe. The
+number of rows removed by each criterion is returned as an attrition table.
+"""
+
+import numpy
+import pandas
+
+
+def exclusion_mask(df, expression):
+    """exclusion_mask: Evaluates a boolean column expression and returns a
+    numpy boolean array where True marks rows to exclude. Missing values in
+    the result are treated as False (row kept).
+
+    df: Pandas dataframe.
+    expression: string evaluated with DataFrame.eval, e.g.
+        "flare_v1 == 0 and day_supply_criteria == 'no'", or a function that
+        takes the dataframe and returns a boolean Series/array.
+    """
+    if callable(expression):
+        mask = expression(df)
+    else:
+        mask = df.eval(expression)
+    return pandas.Series(mask).fillna(False).to_numpy(dtype=bool)
+
+
+def apply_exclusions(df, exclusions):
+    """apply_exclusions: Applies exclusion criteria in order and returns the
+    filtered dataframe and an attrition table with the number of rows
+    before and after each criterion.
+
+    df: Pandas dataframe.
+    exclusions: list of (description, expression) tuples; see
+        exclusion_mask for the expression format.
+    """
+    keep = numpy.ones(df.shape[0], dtype=bool)
+    attrition = []
+    for description, expression in exclusions:
+        n_before = int(keep.sum())
+        keep &= ~exclusion_mask(df, expression)
+        n_after = int(keep.sum())
+        attrition.append({
+            'criteria': description,
+            'n_before': n_before,
+            'n_after': n_after,
+            'n_excluded': n_before - n_after,
+            'prop_excluded': ((n_before - n_after)/n_before
+                              if n_before > 0 else numpy.nan)
+        })
+    return df.loc[keep], pandas.DataFrame(attrition)
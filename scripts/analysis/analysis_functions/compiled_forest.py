@@ -0,0 +1,165 @@
+"""
+Compiled scoring path for fitted random forest pipelines
+
+Scoring one visit with the saved pipeline goes through pandas based
+FeatureSelector/OtherTransformer steps and a FeatureUnion on every call.
+CompiledForest is built once from a fitted pipeline: it keeps the input
+column order and the SimpleImputer medians, and stores all trees of the
+forest in flat numpy arrays. Every tree is walked one level at a time for
+all trees (and rows) at once, so scoring a visit is a few numpy operations
+per tree level instead of a pass through the pipeline.
+
+Predicted probabilities match the pipeline's predict_proba: missing
+values are imputed in float64 and features are cast to float32 before the
+split thresholds are compared, as sklearn does.
+"""
+
+import numpy
+from sklearn.impute import SimpleImputer
+
+from analysis_functions.custom_metrics import bayes
+from analysis_functions.scoring import model_input_columns, POP_PROP_FLARE
+from analysis_functions.transformers import FeatureSelector, OtherTransformer
+
+
+class CompiledForest(object):
+    """CompiledForest: Random forest pipeline compiled to flat arrays.
+
+    model: fitted pipeline with a 'transform_pipe' FeatureUnion of
+        FeatureSelector + SimpleImputer and FeatureSelector +
+        OtherTransformer pipelines and a random forest 'rf' step.
+    """
+    def __init__(self, model):
+        steps = dict(model.steps)
+        self.columns = model_input_columns(model)
+        self._fill = self._compile_transform(steps['transform_pipe'])
+        self._compile_forest(steps['rf'])
+
+    def _compile_transform(self, transform_pipe):
+        """_compile_transform: Returns array of values used to fill missing
+        features (imputer medians) with NaN for features passed as is.
+        """
+        fill = []
+        for name, pipe in transform_pipe.transformer_list:
+            selector, steps = pipe.steps[0][1], pipe.steps[1:]
+            if not isinstance(selector, FeatureSelector):
+                raise ValueError(name + ' does not start with FeatureSelector')
+            n_features = len(selector.feature_names)
+            if len(steps) == 0 or isinstance(steps[0][1], OtherTransformer):
+                fill.append(numpy.full(n_features, numpy.nan))
+            elif (isinstance(steps[0][1], SimpleImputer) and len(steps) == 1):
+                imputer = steps[0][1]
+                statistics = numpy.asarray(imputer.statistics_,
+                                           dtype=numpy.float64)
+                if len(statistics) != n_features:
+                    raise ValueError(
+                        'Imputer of ' + name + ' has ' +
+                        str(len(statistics)) + ' medians for ' +
+                        str(n_features) + ' selected features')
+                # features without any training value have no median and
+                # are dropped by the imputer unless keep_empty_features, so
+                # the forest columns would no longer line up
+                empty = numpy.isnan(statistics)
+                if (empty.any() and
+                    not getattr(imputer, 'keep_empty_features', False)):
+                    raise ValueError(
+                        'Imputer of ' + name + ' dropped features without '
+                        'training values: ' + ', '.join(
+                            numpy.asarray(selector.feature_names)[empty]) +
+                        '; refit with keep_empty_features=True')
+                fill.append(statistics)
+            else:
+                raise ValueError('Step ' + steps[0][0] + ' of ' + name +
+                                 ' can not be compiled')
+        return numpy.concatenate(fill)
+
+    def _compile_forest(self, rf):
+        """_compile_forest: Stores the nodes of all trees in flat arrays.
+        Leaves point to themselves and always go left so every tree can be
+        walked for the same number of levels.
+        """
+        feature, threshold, left, right, prob, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for tree in rf.estimators_:
+            t = tree.tree_
+            n_nodes = t.node_count
+            is_leaf = t.children_left == -1
+            nodes = numpy.arange(n_nodes)
+            roots.append(offset)
+            feature.append(numpy.where(is_leaf, 0, t.feature))
+            threshold.append(numpy.where(is_leaf, numpy.inf, t.threshold))
+            left.append(numpy.where(is_leaf, nodes, t.children_left) + offset)
+            right.append(numpy.where(is_leaf, nodes, t.children_right) + offset)
+            # probability of class 1 in each node
+            value = t.value[:, 0, :]
+            prob.append(value[:, 1]/value.sum(axis=1))
+            offset += n_nodes
+            max_depth = max(max_depth, t.max_depth)
+        self._feature = numpy.concatenate(feature).astype(numpy.intp)
+        self._threshold = numpy.concatenate(threshold)
+        self._left = numpy.concatenate(left).astype(numpy.intp)
+        self._right = numpy.concatenate(right).astype(numpy.intp)
+        self._prob = numpy.concatenate(prob)
+        self._roots = numpy.asarray(roots, dtype=numpy.intp)
+        self._max_depth = max_depth
+
+    def transform(self, X):
+        """transform: Imputes missing features with the medians and casts
+        to float32. Returns 2d array (rows, features).
+
+        X: 2d array of features in the order of self.columns.
+        """
+        X = numpy.array(X, dtype=numpy.float64, ndmin=2)
+        missing = numpy.isnan(X)
+        if missing.any():
+            X = numpy.where(missing, self._fill, X)
+            # features passed as is have no value to impute
+            not_filled = numpy.isnan(X).any(axis=0)
+            if not_filled.any():
+                raise ValueError('Missing values for features: ' + ', '.join(
+                    numpy.asarray(self.columns)[not_filled]))
+        return X.astype(numpy.float32)
+
+    def predict_proba(self, X):
+        """predict_proba: Returns 2d array of predicted probability of
+        class 0 and class 1 like sklearn predict_proba.
+
+        X: 2d array of features in the order of self.columns.
+        """
+        X = self.transform(X)
+        rows = numpy.arange(X.shape[0])[:, None]
+        node = numpy.broadcast_to(self._roots,
+                                  (X.shape[0], len(self._roots)))
+        # one level of every tree at a time
+        for depth in range(self._max_depth):
+            go_left = X[rows, self._feature[node]] <= self._threshold[node]
+            node = numpy.where(go_left, self._left[node], self._right[node])
+        flare_prob = self._prob[node].mean(axis=1)
+        return numpy.stack([1 - flare_prob, flare_prob], axis=1)
+
+    def features_from_dict(self, visit):
+        """features_from_dict: Returns 1d array of features in model order
+        from a dictionary of feature name to value. Missing or None values
+        are NaN; male_v_female is derived from gender if not given.
+
+        visit: dictionary of feature values of one visit.
+        """
+        visit = dict(visit)
+        if 'male_v_female' not in visit and 'gender' in visit:
+            visit['male_v_female'] = 1 if visit['gender'] == 'Male' else 0
+        return numpy.array([numpy.nan if visit.get(c) is None else visit[c]
+                            for c in self.columns], dtype=numpy.float64)
+
+    def score_visit(self, visit, pop_prop=POP_PROP_FLARE):
+        """score_visit: Scores one visit. Returns dictionary with predicted
+        probability of flare and bayes corrected probability.
+
+        visit: dictionary of feature name to value.
+        pop_prop: proportion of flare in population for bayes probability.
+        """
+        flare_pred_prob = float(
+            self.predict_proba(self.features_from_dict(visit))[0, 1])
+        return {'flare_pred_prob': flare_pred_prob,
+                'bayes_prob': float(bayes(obs_pred=flare_pred_prob,
+                                          pop_prop=pop_prop))}
@@ -4,6 +4,7 @@ Custom functions for metrics
 
 import numpy 
 import pandas 
+from joblib import Parallel, delayed
 from sklearn.metrics import confusion_matrix
 from sklearn.metrics import roc_curve, auc
 import matplotlib.pyplot as plt
@@ -50,7 +51,7 @@ def dx_accuracy(cm):
 
 
 # use boostrap function defined in custom metrics module to find percentil 95%ci
-def model_metrics_boot(model, x_test, y_test, boot_iteration):
+def model_metrics_boot(model, x_test, y_test, boot_iteration, seed=None):
     """model_metrics_boot: Takes a sklearn model, x_test and y_test 
     data, and number of iterations and returns a list of values. 
     This is meant to be used with the Joblib parallel function.
@@ -59,11 +60,12 @@ def model_metrics_boot(model, x_test, y_test, boot_iteration):
     x_test: Pandas dataframe of features of test set
     y_test: Pandas series of outcome
     boot_iteration: number of times to repeat process. Must be number.
+    seed: seed of the draw (e.g. a child SeedSequence per iteration);
+        None draws fresh entropy in each worker.
     """
     print('Iteration: ', boot_iteration)
-    sample_index = numpy.random.choice(
-        range(0, len(y_test)), len(y_test), 
-        replace = True)
+    sample_index = numpy.random.default_rng(seed).choice(
+        len(y_test), len(y_test), replace = True)
 
     x_samples = x_test.iloc[sample_index, :]
     y_samples = y_test.iloc[sample_index] 
@@ -101,51 +103,250 @@ def model_metrics_boot(model, x_test, y_test, boot_iteration):
     return [sn, sp, ppv, npv, acc, roc_auc]
 
 
+def bayes(obs_pred, pop_prop):
+    """bayes: Corrected probability based on risk proportion for flare
+    using bayes theorem. Works on single values and numpy arrays.
+
+    obs_pred: predicted probability of y=1 from model.
+    pop_prop: proportion of flare in population.
+    """
+    bayes_pred = ((obs_pred * pop_prop)/
+                  ((obs_pred * pop_prop) + 
+                   (1-obs_pred)*(1-pop_prop)))
+    return(bayes_pred)
+
+
+def boot_auc(counts, y_sorted, group_starts):
+    """boot_auc: ROC AUC for each bootstrap replicate from the number of
+    times each observation was drawn. Uses the Mann-Whitney form of the AUC
+    (ties count 1/2), which is the same area as the trapezoid rule on the
+    ROC curve.
+
+    counts: 2d array (replicates, n) of draw counts in predicted
+        probability order.
+    y_sorted: 1d array of true 1 or 0 values in predicted probability order.
+    group_starts: start index of each run of tied predicted probabilities.
+    """
+    # weighted number of positives and negatives per tied probability
+    pos = numpy.add.reduceat(counts*y_sorted, group_starts, axis=1)
+    neg = numpy.add.reduceat(counts*(1 - y_sorted), group_starts, axis=1)
+    # negatives ranked below each tie group
+    neg_below = numpy.cumsum(neg, axis=1) - neg
+    n_pos = pos.sum(axis=1)
+    n_neg = neg.sum(axis=1)
+    return (pos*(neg_below + 0.5*neg)).sum(axis=1)/(n_pos*n_neg)
+
+
+def boot_counts(rng, n, n_batch, strata=None, group_codes=None):
+    """boot_counts: Returns 2d array (n_batch, n) of the number of times
+    each row is drawn in each bootstrap replicate.
+
+    rng: numpy random generator.
+    n: number of rows.
+    n_batch: number of replicates.
+    strata: tuple of array of class offsets (e.g. [0, n_no_flare, n]) of
+        the rows ordered by outcome class and array of position of each
+        row in that order; rows are drawn within each class so every
+        replicate keeps the class counts.
+    group_codes: array of group (e.g. patient) code 0..n_groups-1 of each
+        row; groups are drawn and every row of a drawn group is counted.
+    """
+    if group_codes is not None:
+        n_groups = int(group_codes.max()) + 1
+        # number of times each group is drawn in each replicate
+        draws = rng.integers(0, n_groups, size=(n_batch, n_groups))
+        draws += numpy.arange(n_batch)[:, None]*n_groups
+        group_counts = (numpy.bincount(draws.ravel(),
+                                       minlength=n_batch*n_groups)
+                        .reshape(n_batch, n_groups))
+        # each row is counted as often as its group was drawn; take keeps
+        # the counts row major (fancy indexing gives column major arrays,
+        # which makes the auc reduceat 3 times slower)
+        return numpy.take(group_counts.astype(numpy.float64), group_codes,
+                          axis=1)
+    if strata is not None:
+        offsets, class_position = strata
+        # draw within each class in class order; each class is a slice so
+        # draws are written in place instead of gathered and concatenated
+        draws = numpy.empty((n_batch, n), dtype=numpy.int64)
+        for start, stop in zip(offsets[:-1], offsets[1:]):
+            if stop > start:
+                draws[:, start:stop] = rng.integers(
+                    start, stop, size=(n_batch, stop - start))
+    else:
+        draws = rng.integers(0, n, size=(n_batch, n))
+    draws += numpy.arange(n_batch)[:, None]*n
+    counts = (numpy.bincount(draws.ravel(), minlength=n_batch*n)
+              .reshape(n_batch, n)
+              .astype(numpy.float64))
+    if strata is not None:
+        # back from class order to the row order (row major take)
+        counts = numpy.take(counts, class_position, axis=1)
+    return counts
+
+
+def boot_batch(y_true, cells, group_starts, n_batch, seed, strata=None,
+               group_codes=None):
+    """boot_batch: Computes a batch of bootstrap replicates of sensitivity,
+    specificity, ppv, npv, accuracy and roc auc. Arrays are only read, so
+    parallel workers can be passed read only memory maps of them.
+
+    y_true: 1d array of true 1 or 0 values in predicted probability order.
+    cells: 2d array (n, 4) of true positive, false positive, true negative
+        and false negative indicator of each row, same order.
+    group_starts: start index of each run of tied predicted probabilities.
+    n_batch: number of replicates.
+    seed: numpy SeedSequence of the batch.
+    strata: row positions of each outcome class (see boot_counts).
+    group_codes: group code of each row, same order (see boot_counts).
+    """
+    rng = numpy.random.default_rng(seed)
+    counts = boot_counts(rng, len(y_true), n_batch, strata=strata,
+                         group_codes=group_codes)
+    TP, FP, TN, FN = (counts @ cells).T
+    boot_array = numpy.empty((n_batch, 6))
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        boot_array[:, 0] = TP/(TP + FN)
+        boot_array[:, 1] = TN/(TN + FP)
+        boot_array[:, 2] = TP/(TP + FP)
+        boot_array[:, 3] = TN/(TN + FN)
+        # rows drawn; varies between replicates when groups are drawn
+        boot_array[:, 4] = (TP + TN)/(TP + FP + TN + FN)
+        boot_array[:, 5] = boot_auc(counts, y_true, group_starts)
+    return boot_array
+
+
+def boot_dx_metrics(y_true, y_prob, n_boot=2000, threshold=0.5,
+                    batch_size=None, seed=0, n_jobs=1, groups=None,
+                    stratify=False):
+    """boot_dx_metrics: Bootstraps sensitivity, specificity, ppv, npv,
+    accuracy and roc auc from predictions made once on the test set.
+    Each replicate resamples row indexes instead of predicting on a new
+    sample; replicates are computed in batches with numpy. Returns a 2d
+    array with one row per replicate in the order used by boot_95.
+
+    Visits are resampled by default. With groups (e.g. patient ids) the
+    patients are resampled and all visits of a drawn patient are counted,
+    so intervals account for visits of a patient being correlated. With
+    stratify the visits are resampled within flare and no flare, so each
+    replicate has the test set number of flares.
+
+    Each batch draws from its own child of the seed sequence, so the
+    replicates are the same for any n_jobs. With n_jobs > 1 batches run in
+    parallel processes; joblib places the label and confusion cell arrays
+    in shared memory (/dev/shm) once and workers read them memory mapped,
+    so neither the model nor the test features are sent to the workers.
+
+    y_true: 1d array/series of the true 1 or 0 values.
+    y_prob: 1d array of predicted probabilities of y=1 on the same rows.
+    n_boot: number of bootstrap replicates.
+    threshold: predicted probability above which class is 1.
+    batch_size: replicates computed at once; defaults to keep about
+        20 million draw counts in memory. Replicates depend on it.
+    seed: int or numpy SeedSequence of the bootstrap; None draws fresh
+        entropy (not reproducible).
+    n_jobs: number of processes computing batches.
+    groups: 1d array/series of cluster (e.g. patient id) of each row;
+        None resamples rows. A replicate can then draw no flares or no
+        visits without flare, and metrics it leaves undefined are NaN
+        (counted and excluded by boot_95).
+    stratify: if True, resamples rows within each outcome class.
+    """
+    if groups is not None and stratify:
+        raise ValueError('boot_dx_metrics resamples either groups or ' +
+                         'rows within outcome classes, not both')
+    y_true = numpy.asarray(y_true).astype(numpy.float64)
+    y_prob = numpy.asarray(y_prob, dtype=numpy.float64)
+    n = len(y_true)
+    if batch_size is None:
+        batch_size = max(1, int(2e7 // max(n, 1)))
+    if not isinstance(seed, numpy.random.SeedSequence):
+        seed = numpy.random.SeedSequence(seed)
+
+    # sort once by predicted probability for the auc; rows are drawn from
+    # the sorted arrays so draw counts are already in auc order
+    order = numpy.argsort(y_prob, kind='mergesort')
+    y_true = y_true[order]
+    y_prob = y_prob[order]
+    group_starts = numpy.flatnonzero(
+        numpy.r_[True, y_prob[1:] != y_prob[:-1]])
+
+    # group code of each row in the sorted order
+    group_codes = None
+    if groups is not None:
+        group_codes = pandas.factorize(numpy.asarray(groups)[order])[0]
+    # class offsets of the rows ordered by class and position of each row
+    # in that order
+    strata = None
+    if stratify:
+        class_order = numpy.argsort(y_true, kind='mergesort')
+        class_position = numpy.empty(n, dtype=numpy.int64)
+        class_position[class_order] = numpy.arange(n)
+        offsets = numpy.array([0, numpy.sum(y_true == 0), n])
+        strata = (offsets, class_position)
+
+    # predicted class and confusion matrix cells for each row
+    pred_class = (y_prob > threshold).astype(numpy.float64)
+    cells = numpy.stack([y_true*pred_class,               # true positive
+                         (1 - y_true)*pred_class,         # false positive
+                         (1 - y_true)*(1 - pred_class),   # true negative
+                         y_true*(1 - pred_class)],        # false negative
+                        axis=1)
+
+    batches = [min(batch_size, n_boot - b)
+               for b in range(0, n_boot, batch_size)]
+    seeds = seed.spawn(len(batches))
+    if n_jobs == 1:
+        boot_list = [boot_batch(y_true, cells, group_starts, n_batch, s,
+                                strata=strata, group_codes=group_codes)
+                     for n_batch, s in zip(batches, seeds)]
+    else:
+        # arrays over 1 MB are dumped to shared memory once per call and
+        # passed to workers as read only memory maps
+        boot_list = Parallel(n_jobs=n_jobs, max_nbytes='1M',
+                             mmap_mode='r')(
+            delayed(boot_batch)(y_true, cells, group_starts, n_batch, s,
+                                strata=strata, group_codes=group_codes)
+            for n_batch, s in zip(batches, seeds))
+    boot_array = numpy.concatenate(boot_list, axis=0)
+    # same rounding as model_metrics_boot
+    return boot_array.round(3)
+
+
 def boot_95(boot_list):
     """boot_95: Calculating median and 95% confidence interval
-    of bootstraped estimates
+    of bootstraped estimates. Replicates where a metric is undefined (e.g.
+    a replicate of resampled patients without a flare has no sensitivity
+    or auc) are excluded from the percentiles of that metric; the number
+    excluded is printed and returned in the n_excluded column.
     
     boot_list: Bootstrapped list created using model_metric_boot
-    function. 
+    function or 2d array created using boot_dx_metrics function.
     """
-    # empty sensitivity list to bind stuff to
-    sn_list = []
-    sp_list = []
-    ppv_list = []
-    npv_list = []
-    acc_list = []
-    roc_auc_list = []
-
-    for i in range(len(boot_list)):
-        sn_list.append(boot_list[i][0])
-        sp_list.append(boot_list[i][1])
-        ppv_list.append(boot_list[i][2])
-        npv_list.append(boot_list[i][3])
-        acc_list.append(boot_list[i][4])
-        roc_auc_list.append(boot_list[i][5])
-    
-    # create list of lists
-    dx_list = [sn_list, sp_list, ppv_list, 
-               npv_list, acc_list, roc_auc_list]
+    # one row per bootstrap, one column per metric
+    boot_array = numpy.asarray(boot_list, dtype=numpy.float64)
 
     name_list = ['sensitivity', 'specificity', 'ppv', 
                  'npv', 'accuracy', 'roc_auc']
-    # create empty dictionary
-    dx_95ci_dict = {}
 
-    # bind results list
-    for i in range(0, len(dx_list)):
-        median = numpy.quantile(dx_list[i], q=0.5).round(3) 
-        lower95 = numpy.quantile(dx_list[i], q=0.025).round(3) 
-        upper95 = numpy.quantile(dx_list[i], q=0.975).round(3) 
+    # degenerate replicates of each metric
+    n_excluded = numpy.isnan(boot_array).sum(axis=0)
+    if n_excluded.any():
+        print('Bootstrap replicates excluded as undefined (of',
+              len(boot_array), '):',
+              dict(zip(name_list, n_excluded.tolist())))
 
-        dx_95ci_dict.update({name_list[i]: [median, lower95, upper95]})
+    # median, lower and upper percentile of each metric without the
+    # undefined replicates
+    quantiles = numpy.nanpercentile(boot_array, q=[50, 2.5, 97.5],
+                                    axis=0).round(3)
 
     # create dataframe of accuracy 95% CIs
-    dx_intervals = pandas.DataFrame.from_dict(
-        dx_95ci_dict, 
-        orient='index',
+    dx_intervals = pandas.DataFrame(
+        quantiles.T,
+        index=name_list,
         columns=['median', 'lower95', 'upper95'])
+    dx_intervals['n_excluded'] = n_excluded
     # return dx intervals dataframe
     return dx_intervals 
 
@@ -232,6 +433,30 @@ def readable_variables(feature_list):
 
 """
     
+def threshold_counts(true_class, model_pred_prob, pt_vals):
+    """threshold_counts: Number of true positives and false positives
+    when class is 1 for predicted probability >= each threshold. The
+    predictions are sorted once and counts at every threshold are read
+    from cumulative sums.
+
+    true_class: 1d array/vector of the true 1 or 0 values.
+    model_pred_prob: predicted probabilities from the trained model.
+    pt_vals: 1d array of probability thresholds.
+    """
+    true_class = numpy.asarray(true_class)
+    model_pred_prob = numpy.asarray(model_pred_prob)
+    order = numpy.argsort(model_pred_prob, kind='mergesort')
+    prob_sorted = model_pred_prob[order]
+    # number of positives and negatives among the k lowest predictions
+    cum_pos = numpy.r_[0, numpy.cumsum(true_class[order] == 1)]
+    cum_neg = numpy.r_[0, numpy.cumsum(true_class[order] != 1)]
+    # rows below each threshold are predicted 0
+    n_below = numpy.searchsorted(prob_sorted, pt_vals, side='left')
+    true_pos = cum_pos[-1] - cum_pos[n_below]
+    false_pos = cum_neg[-1] - cum_neg[n_below]
+    return true_pos, false_pos, cum_pos[-1], cum_neg[-1]
+
+
 def dca(true_class, model_pred_prob, n_thresholds = 100):
     """dca: Decision curve net benefit analysis function (DCA)
 
@@ -239,54 +464,45 @@ def dca(true_class, model_pred_prob, n_thresholds = 100):
     
         odds_pt = ( probability threshold / (1 - probability threshold) )
     
-        Net benefit = (true positive / n) - ((false negative / n) * odds_pt)
+        Net benefit = (true positive / n) - ((false positive / n) * odds_pt)
 
-    true_class: Takes a 1d array/vector of the true 1 or 0 values.
+    true_class: Takes a 1d array/vector of the true 1 or 0 values, or a
+        dictionary of them with the same keys as model_pred_prob.
     
     model_pred_prob: Takes the predicted probabilities from the trained 
-        model.
+        model, or a dictionary of model name to predicted probabilities to
+        run several models at once. A dictionary returns a dictionary of
+        dataframes with the same keys.
         
     n_thresholds: Number of thresholds to create from 0.01 to 0.99.
     """
-    
+    # run each model in a dictionary of models
+    if isinstance(model_pred_prob, dict):
+        return {
+            name: dca(true_class[name] if isinstance(true_class, dict)
+                      else true_class,
+                      pred_prob, n_thresholds)
+            for name, pred_prob in model_pred_prob.items()}
+
     # probability thresholds to calculate
     # (note goes from 0.01 to 0.99 to avoid division by 0)
     pt_vals = numpy.linspace(0.01, 0.99, n_thresholds)
-    
-    # lists to append values to for a given threshold
-    net_benefit = []
-    sensitivity = []
-    specificity = []
-    
-    for pt in pt_vals:
-        pred_class = numpy.where(model_pred_prob >= pt, 1, 0 )
-
-        # crosstabulation / confusion matrix 
-        cm = confusion_matrix(true_class, pred_class)
-        
-        # sensitivity value for a given threshold
-        sn = cm[1][1] / cm[1].sum()
-        # specificity value for a given threshold
-        sp = cm[0][0] / cm[0].sum()
 
-        # true positives number from confusion matrix
-        true_pos = cm[1][1]
-        # false positives number from confusion matrix
-        false_pos = cm[0][1]
+    # true and false positives at every threshold in one pass
+    true_pos, false_pos, n_pos, n_neg = threshold_counts(
+        true_class, model_pred_prob, pt_vals)
 
-        # sample size number
-        samp_n = cm.sum()
+    # sample size number
+    samp_n = n_pos + n_neg
 
-        # threshold ratio
-        thresh_odds = ( pt / (1 - pt) )
+    # threshold ratio
+    thresh_odds = ( pt_vals / (1 - pt_vals) )
 
-        # net benefit formula
-        net_ben = ( true_pos / samp_n ) - ( ( false_pos / samp_n ) * thresh_odds )
-        
-        # append to list
-        net_benefit.append(net_ben)
-        sensitivity.append(sn)
-        specificity.append(sp)
+    # net benefit formula
+    net_benefit = ( true_pos / samp_n ) - ( ( false_pos / samp_n ) * thresh_odds )
+    # sensitivity and specificity for each threshold
+    sensitivity = true_pos / n_pos
+    specificity = (n_neg - false_pos) / n_neg
     
     # create dataframe of threshold values and net benefit
     df = pandas.DataFrame(
@@ -299,4 +515,4 @@ def dca(true_class, model_pred_prob, n_thresholds = 100):
     )
     
     # return pandas dataframe
-    return( df )
\ No newline at end of file
+    return( df )
@@ -0,0 +1,144 @@
+"""
+Columnar cache for analysis tables
+
+Parsing the raw analysis csv (and the train/test csv files) with pandas
+takes minutes on the full Optum extract. The functions below convert a csv
+once in to an uncompressed Feather (Arrow IPC) file keyed by the hash of
+the source csv. Later reads memory map the Feather file and only load the
+columns a script asks for.
+
+Hashing a multi GB csv also takes time, so the size and modification time
+of the csv are recorded with its hash in a json file next to the Feather
+file. The csv is only hashed again when its size or modification time
+changed. When a new cache is written the caches of older versions of the
+same csv are deleted, so only one copy per csv stays on disk.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+import pandas
+import pyarrow.feather as feather
+
+# dtypes used for every read of the analysis csv in the analysis scripts
+ANALYSIS_DTYPES = {'birth_yr': str, 'date_of_death': str}
+
+
+def file_hash(path, block_size=2**20):
+    """file_hash: Returns the sha1 hex digest of a file read in blocks
+    so large csv files are never held in memory.
+
+    path: path to file to hash.
+    block_size: number of bytes read at a time.
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def csv_hash(csv_path, key_file):
+    """csv_hash: Returns the sha1 hex digest of a csv file. The digest is
+    read from key_file when the size and modification time of the csv are
+    the ones recorded there; otherwise the csv is hashed and key_file is
+    rewritten.
+
+    csv_path: path to source csv file.
+    key_file: json file recording size, mtime_ns and sha1 of the csv.
+    """
+    stat = os.stat(csv_path)
+    key = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if os.path.exists(key_file):
+        with open(key_file) as f:
+            recorded = json.load(f)
+        if {k: recorded.get(k) for k in key} == key:
+            return recorded['sha1']
+    key['sha1'] = file_hash(csv_path)
+    os.makedirs(os.path.dirname(key_file), exist_ok=True)
+    # write to temp file first so a killed run never leaves a partial key
+    tmp_file = key_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(key, f)
+    os.replace(tmp_file, key_file)
+    return key['sha1']
+
+
+def cache_path(csv_path, cache_dir=None):
+    """cache_path: Returns the path of the Feather cache for a csv file.
+    The name contains the csv file name and the hash of its content, so a
+    new data cut never reuses a stale cache. The hash is only recomputed
+    when the size or modification time of the csv changed (see csv_hash).
+
+    csv_path: path to source csv file.
+    cache_dir: folder to hold cache files; defaults to a 'cache' folder
+        next to the folder that contains the csv (e.g. data/cache/).
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(csv_path))),
+            'cache')
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    sha1 = csv_hash(csv_path, os.path.join(cache_dir, name + '_key.json'))
+    return os.path.join(cache_dir, name + '_' + sha1 + '.feather')
+
+
+def build_cache(csv_path, cache_file, dtype=ANALYSIS_DTYPES):
+    """build_cache: Parses the csv once with pandas and writes it to an
+    uncompressed Feather file. Uncompressed files can be memory mapped
+    without decompressing on read.
+
+    csv_path: path to source csv file.
+    cache_file: path of Feather file to write.
+    dtype: dictionary of column dtypes passed to pandas read_csv.
+    """
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    df = pandas.read_csv(csv_path, dtype=dtype)
+    # write to temp file first so a killed run never leaves a partial cache
+    tmp_file = cache_file + '.tmp'
+    feather.write_feather(df, tmp_file, compression='uncompressed')
+    os.replace(tmp_file, cache_file)
+
+
+def remove_stale_caches(cache_file):
+    """remove_stale_caches: Deletes the Feather caches of other versions of
+    the csv a cache file was built from (same csv name, other hash).
+    Returns list of deleted files.
+
+    cache_file: path of the current Feather cache (see cache_path).
+    """
+    cache_dir, file_name = os.path.split(cache_file)
+    name = file_name[:-len('_' + 40*'0' + '.feather')]
+    # exact name and a sha1 so caches of csv files sharing a prefix are kept
+    pattern = re.compile(re.escape(name) + r'_[0-9a-f]{40}\.feather$')
+    removed = []
+    for other in os.listdir(cache_dir):
+        if other != file_name and pattern.match(other):
+            os.remove(os.path.join(cache_dir, other))
+            removed.append(os.path.join(cache_dir, other))
+    return removed
+
+
+def read_analysis_table(csv_path, columns=None, dtype=ANALYSIS_DTYPES,
+                        cache_dir=None):
+    """read_analysis_table: Reads a csv file through the columnar cache and
+    returns a pandas dataframe. The first read of a csv builds the cache
+    and removes the caches of its older versions, later reads memory map
+    it.
+
+    csv_path: path to source csv file (e.g. data/raw/ibd_flare_analysis.csv).
+    columns: list of columns to load; None loads all columns.
+    dtype: dictionary of column dtypes used when the cache is built.
+    cache_dir: folder to hold cache files; see cache_path.
+    """
+    cache_file = cache_path(csv_path, cache_dir)
+    if not os.path.exists(cache_file):
+        print('Building columnar cache:', cache_file)
+        build_cache(csv_path, cache_file, dtype=dtype)
+        for stale_file in remove_stale_caches(cache_file):
+            print('Removed stale columnar cache:', stale_file)
+    # memory map the file and only read the requested columns
+    table = feather.read_table(cache_file, columns=columns, memory_map=True)
+    return table.to_pandas()
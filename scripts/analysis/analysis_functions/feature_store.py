@@ -0,0 +1,196 @@
+"""
+Feature matrix store shared by the models
+
+The model features (labs, age, immuno_med, male_v_female and
+prev_flare_v1_sum) are built once from the config by 02_train_test.py and
+saved as float32 numpy arrays with a json file of column metadata. The
+models and the SHAP script load the arrays memory mapped instead of
+reading the train/test csv files and deriving the features again.
+
+Layout of the store folder (data/features/ by default):
+    meta.json: version, config feature spec, columns, splits
+    <split>_x.npy: float32 features (column order in meta.json)
+    <split>_y.npy: int8 outcome
+    <split>_disease_category.npy: int8 codes of disease_category
+    <split>_index.npy: int64 row index of the analysis dataframe
+    <split>_patient.npy: int64 code of the patient id (same code in every
+        split), used to resample patients in the bootstrap
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy
+import pandas
+
+# bump when the layout or the derived features change
+FEATURE_STORE_VERSION = 2
+
+# features that are passed as is in the model pipelines
+OTHER_COLS = ['immuno_med', 'male_v_female', 'prev_flare_v1_sum']
+
+
+def male_v_female(gender):
+    """male_v_female: Binary variable of 1 for 'Male' and 0 otherwise.
+
+    gender: Pandas series or array of gender strings.
+    """
+    return numpy.where(numpy.asarray(gender) == 'Male', 1, 0)
+
+
+def model_columns(config, labs=True):
+    """model_columns: Returns the numeric and other feature lists used by
+    the models in the order fed in to the pipelines.
+
+    config: dictionary of analysis_config.yaml.
+    labs: if False, only returns patient characteristics (benchmark model).
+    """
+    num_cols = []
+    if labs:
+        num_cols = (config['features']['labs']['labs_base'] +
+                    config['features']['labs']['labs_mean'] +
+                    config['features']['labs']['labs_max'])
+    num_cols = num_cols + config['features']['patient_indicator']['numeric']
+    return num_cols, list(OTHER_COLS)
+
+
+def feature_spec(config):
+    """feature_spec: Dictionary of the config entries the store is built
+    from and its version string.
+    """
+    num_cols, other_cols = model_columns(config)
+    spec = {'store_version': FEATURE_STORE_VERSION,
+            'columns': num_cols + other_cols,
+            'outcome': config['outcome']['flare_v1']}
+    spec_hash = hashlib.sha1(
+        json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()
+    spec['version'] = str(FEATURE_STORE_VERSION) + '-' + spec_hash[:12]
+    return spec
+
+
+def build_feature_store(splits, config, store_dir):
+    """build_feature_store: Writes the feature matrix of each split to the
+    store folder. The store is written to a temporary folder first and
+    moved in place so readers never see a partial store.
+
+    splits: dictionary of split name (e.g. 'train') to Pandas dataframe
+        that contains the features, gender, outcome, disease_category and
+        patient id.
+    config: dictionary of analysis_config.yaml.
+    store_dir: folder of the store (e.g. data/features/).
+    """
+    spec = feature_spec(config)
+    columns = spec['columns']
+    outcome = spec['outcome']
+    # same category codes in every split
+    categories = sorted(set().union(
+        *[df['disease_category'].dropna().unique() for df in splits.values()]))
+    # same patient codes in every split
+    patients = pandas.Index(pandas.unique(pandas.concat(
+        [df['id'] for df in splits.values()], ignore_index=True)))
+
+    store_dir = os.path.normpath(store_dir)
+    tmp_dir = store_dir + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    meta = dict(spec, disease_categories=categories, splits={})
+    for split, df in splits.items():
+        x = numpy.empty((df.shape[0], len(columns)), dtype=numpy.float32,
+                        order='F')
+        for j, col in enumerate(columns):
+            if col == 'male_v_female':
+                x[:, j] = male_v_female(df['gender'])
+            else:
+                x[:, j] = df[col].to_numpy(dtype=numpy.float32)
+        # column major so a run of columns loads as a view
+        numpy.save(os.path.join(tmp_dir, split + '_x.npy'), x)
+        numpy.save(os.path.join(tmp_dir, split + '_y.npy'),
+                   df[outcome].to_numpy(dtype=numpy.int8))
+        numpy.save(os.path.join(tmp_dir, split + '_disease_category.npy'),
+                   pandas.Categorical(df['disease_category'],
+                                      categories=categories)
+                   .codes.astype(numpy.int8))
+        numpy.save(os.path.join(tmp_dir, split + '_index.npy'),
+                   df.index.to_numpy(dtype=numpy.int64))
+        numpy.save(os.path.join(tmp_dir, split + '_patient.npy'),
+                   patients.get_indexer(df['id']).astype(numpy.int64))
+        meta['splits'][split] = int(df.shape[0])
+
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    os.rename(tmp_dir, store_dir)
+    print('Feature store', meta['version'], 'saved here:', store_dir)
+    return meta
+
+
+def read_meta(store_dir, config=None):
+    """read_meta: Reads the metadata of the store. If a config is given,
+    raises ValueError when the store was built from other features.
+    """
+    meta_file = os.path.join(store_dir, 'meta.json')
+    if not os.path.exists(meta_file):
+        raise FileNotFoundError('No feature store in ' + store_dir +
+                                '; run 02_train_test.py to build it')
+    with open(meta_file, 'r') as f:
+        meta = json.load(f)
+    if config is not None and meta['version'] != feature_spec(config)['version']:
+        raise ValueError('Feature store ' + meta['version'] + ' does not ' +
+                         'match analysis_config.yaml; run 02_train_test.py ' +
+                         'to rebuild it')
+    return meta
+
+
+def load_features(store_dir, split, columns=None, config=None):
+    """load_features: Loads one split of the store memory mapped. Returns
+    a dataframe of features, a series of the outcome and a series of
+    disease_category, all with the row index of the analysis dataframe.
+    Columns that are next to each other in the store are returned without
+    a copy.
+
+    store_dir: folder of the store.
+    split: name of split (e.g. 'train' or 'test').
+    columns: list of features in the order wanted; None returns all.
+    config: dictionary of analysis_config.yaml to check the store version.
+    """
+    meta = read_meta(store_dir, config)
+    x = numpy.load(os.path.join(store_dir, split + '_x.npy'), mmap_mode='r')
+    index = pandas.Index(
+        numpy.load(os.path.join(store_dir, split + '_index.npy')))
+
+    if columns is None:
+        columns = meta['columns']
+    positions = numpy.array([meta['columns'].index(c) for c in columns])
+    # a run of store columns is a slice (view); otherwise copy the columns
+    if len(positions) > 0 and numpy.all(numpy.diff(positions) == 1):
+        x = x[:, positions[0]:positions[-1] + 1]
+    else:
+        x = x[:, positions]
+    X = pandas.DataFrame(x, index=index, columns=list(columns), copy=False)
+
+    y = pandas.Series(
+        numpy.load(os.path.join(store_dir, split + '_y.npy')),
+        index=index, name=meta['outcome'])
+    disease_category = pandas.Series(
+        pandas.Categorical.from_codes(
+            numpy.load(os.path.join(store_dir,
+                                    split + '_disease_category.npy')),
+            categories=meta['disease_categories']),
+        index=index, name='disease_category')
+    return X, y, disease_category
+
+
+def load_patients(store_dir, split):
+    """load_patients: Loads the patient codes of one split of the store,
+    memory mapped, in the row order of load_features.
+
+    store_dir: folder of the store.
+    split: name of split (e.g. 'test').
+    """
+    return numpy.load(os.path.join(store_dir, split + '_patient.npy'),
+                      mmap_mode='r')
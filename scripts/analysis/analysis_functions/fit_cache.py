@@ -0,0 +1,50 @@
+"""
+Cache of fitted preprocessing shared by the model pipelines
+
+The model scripts fit the same transformation pipes (selectors, median or
+MICE imputation, past median labs) on the same training features before
+each estimator. Passing the joblib Memory below as the memory argument of
+a sklearn or imblearn Pipeline caches every step but the last: the fitted
+transformer and its transformed training output are saved under
+data/cache/preprocessing/, keyed by the hash of the unfitted transformer
+parameters and of the X and y the step is fit on. A later fit of an equal
+step on equal data (a rerun of a script, a script whose pipeline only
+changes the model) loads the fitted step instead of refitting it. Changing
+a parameter, a feature list or a row of the data gives a new key, so a
+stale fit is never reused.
+
+The transformers in transformers.py keep only their parameters as
+attributes before fit, so equal pipes hash equal across scripts.
+
+Scripts only open the cache; its size is reduced once by
+00_run_analyses.py after the steps finish (clean_preprocessing_cache),
+never while a script that may be using an entry is running.
+"""
+
+import os
+
+from joblib import Memory
+
+# least recently used entries above this size are dropped
+CACHE_BYTES_LIMIT = '20G'
+
+
+def preprocessing_memory(root_dir):
+    """preprocessing_memory: Returns joblib Memory of the fitted
+    preprocessing cache in data/cache/preprocessing/ of the project.
+
+    root_dir: project root directory.
+    """
+    return Memory(os.path.join(root_dir, 'data', 'cache', 'preprocessing'),
+                  verbose=0)
+
+
+def clean_preprocessing_cache(root_dir, bytes_limit=CACHE_BYTES_LIMIT):
+    """clean_preprocessing_cache: Removes least recently used entries of
+    the preprocessing cache above bytes_limit. Run when no script uses the
+    cache (00_run_analyses.py runs it after the steps).
+
+    root_dir: project root directory.
+    bytes_limit: cache size kept.
+    """
+    preprocessing_memory(root_dir).reduce_size(bytes_limit=bytes_limit)
@@ -0,0 +1,190 @@
+"""
+Hyperparameter search with cached cross validation folds
+
+The transformation pipe of the model pipelines (selectors, median
+imputation, scaling) does not depend on the model hyperparameters, so it
+is fit once on the training rows of each cross validation fold. The
+fitted pipe and its output for the training and validation rows are saved
+in a cache folder (FoldCache); a later search on the same data, pipe and
+folds reuses them. Each (candidate, fold) fit then runs as its own task in
+a process pool, loading the fold arrays memory mapped, so only the
+undersampler and model are refit. Every new data cut or pipe change adds a
+fold cache, so clean_fold_caches keeps only the most recently used ones
+(00_run_analyses.py runs it after the steps).
+
+halving_search runs successive halving: every candidate is first fit with
+a small resource (e.g. rf__n_estimators=20); the best 1/factor candidates
+are kept and fit again with factor times the resource, until one candidate
+is left or the resource reaches max_resources.
+"""
+
+import math
+import os
+import shutil
+
+import numpy
+import pandas
+from joblib import Parallel, delayed, dump, hash as joblib_hash
+from sklearn.base import clone
+from sklearn.metrics import get_scorer
+from sklearn.model_selection import ParameterSampler
+
+# number of fold caches kept by clean_fold_caches; one per tuned model
+FOLD_CACHES_KEPT = 2
+
+
+class FoldCache(object):
+    """FoldCache: Fitted transformation pipe and transformed train and
+    validation arrays of each cross validation fold, saved in a sub folder
+    of cache_dir named by the hash of the data, pipe and splitter.
+
+    cache_dir: folder holding fold caches (e.g. data/cache/tuning_folds/).
+    transform_pipe: unfitted transformation pipe; a clone is fit on the
+        training rows of each fold.
+    X: Pandas dataframe of training features.
+    y: Pandas series or array of outcome.
+    cv: sklearn splitter with a fixed random_state (e.g. StratifiedKFold).
+    groups: array of groups passed to group splitters; None otherwise.
+    """
+    def __init__(self, cache_dir, transform_pipe, X, y, cv, groups=None):
+        key = joblib_hash((transform_pipe, cv, X, numpy.asarray(y), groups))
+        self.fold_dir = os.path.join(cache_dir, key)
+        self.n_folds = cv.get_n_splits(X, y, groups)
+        if os.path.exists(self.fold_dir):
+            print('Using cached cv folds:', self.fold_dir)
+            # mark as recently used for clean_fold_caches
+            os.utime(self.fold_dir)
+            return
+
+        print('Fitting transformation pipe on', self.n_folds, 'cv folds')
+        # write to temp folder first so a killed run never leaves a partial
+        # fold cache that later searches would trust
+        tmp_dir = self.fold_dir + '.tmp'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        y = numpy.asarray(y)
+        for fold, (train, valid) in enumerate(cv.split(X, y, groups)):
+            fitted = clone(transform_pipe).fit(X.iloc[train], y[train])
+            arrays = {'x_train': fitted.transform(X.iloc[train]),
+                      'y_train': y[train],
+                      'x_valid': fitted.transform(X.iloc[valid]),
+                      'y_valid': y[valid]}
+            for name, array in arrays.items():
+                numpy.save(os.path.join(tmp_dir, 'fold%d_%s.npy' %
+                                        (fold, name)),
+                           numpy.asarray(array))
+            dump(fitted, os.path.join(tmp_dir, 'fold%d_transform.joblib' %
+                                      fold))
+        os.replace(tmp_dir, self.fold_dir)
+        print('Saved cv folds here:', self.fold_dir)
+
+    def load(self, fold):
+        """load: Returns tuple of x_train, y_train, x_valid and y_valid
+        arrays of a fold, memory mapped.
+        """
+        return tuple(numpy.load(os.path.join(self.fold_dir, 'fold%d_%s.npy'
+                                             % (fold, name)), mmap_mode='r')
+                     for name in ['x_train', 'y_train', 'x_valid', 'y_valid'])
+
+
+def clean_fold_caches(cache_dir, n_keep=FOLD_CACHES_KEPT):
+    """clean_fold_caches: Removes fold caches other than the n_keep most
+    recently used ones, and partial caches of killed runs. Run when no
+    search uses the cache. Returns list of removed folders.
+
+    cache_dir: folder holding fold caches (e.g. data/cache/tuning_folds/).
+    n_keep: number of fold caches kept.
+    """
+    if not os.path.exists(cache_dir):
+        return []
+    fold_dirs = [os.path.join(cache_dir, name)
+                 for name in os.listdir(cache_dir)]
+    fold_dirs = [path for path in fold_dirs if os.path.isdir(path)]
+    partial = [path for path in fold_dirs if path.endswith('.tmp')]
+    complete = sorted([path for path in fold_dirs if path not in partial],
+                      key=os.path.getmtime, reverse=True)
+    removed = partial + complete[n_keep:]
+    for path in removed:
+        shutil.rmtree(path)
+    return removed
+
+
+def _fit_score(model, params, folds, fold, scoring):
+    """_fit_score: Fits a clone of the model with params on the cached
+    training rows of a fold and returns its score on the validation rows.
+    """
+    x_train, y_train, x_valid, y_valid = folds.load(fold)
+    estimator = clone(model).set_params(**params)
+    estimator.fit(x_train, y_train)
+    return get_scorer(scoring)(estimator, x_valid, y_valid)
+
+
+def halving_search(model, param_distributions, folds, n_candidates=27,
+                   resource='rf__n_estimators', min_resources=20,
+                   max_resources=500, factor=3, scoring='roc_auc',
+                   n_jobs=4, random_state=0):
+    """halving_search: Successive halving search over candidates sampled
+    from param_distributions, scored on cached cv folds. Returns tuple of
+    results dataframe (one row per candidate and iteration with the mean,
+    std and fold scores) and dictionary of the best parameters.
+
+    model: unfitted estimator applied after the transformation pipe (e.g.
+        undersampler and random forest pipeline from rf_trainer.rf_model)
+        with n_jobs=1; tasks run in parallel instead.
+    param_distributions: dictionary of parameter name to list or scipy
+        distribution, as in sklearn RandomizedSearchCV.
+    folds: FoldCache of the training data.
+    n_candidates: number of candidates sampled.
+    resource: parameter increased each iteration (e.g.
+        'rf__n_estimators'); None fits every candidate once with the
+        parameters as sampled (random search).
+    min_resources: resource of the first iteration.
+    max_resources: largest resource used.
+    factor: proportion of candidates dropped and growth of the resource
+        at each iteration.
+    scoring: sklearn scorer name.
+    n_jobs: number of processes fitting (candidate, fold) tasks.
+    random_state: seed of the candidate sampler.
+    """
+    candidates = list(ParameterSampler(param_distributions, n_candidates,
+                                       random_state=random_state))
+    n_resources = min_resources
+    results = []
+    iteration = 0
+    with Parallel(n_jobs=n_jobs) as parallel:
+        while True:
+            params = [dict(c, **{resource: n_resources})
+                      if resource is not None else dict(c)
+                      for c in candidates]
+            print('Iteration', iteration, ':', len(candidates),
+                  'candidates' + ('' if resource is None else
+                                  ' with ' + resource + '=' +
+                                  str(n_resources)))
+            scores = numpy.array(parallel(
+                delayed(_fit_score)(model, p, folds, fold, scoring)
+                for p in params for fold in range(folds.n_folds))) \
+                .reshape(len(candidates), folds.n_folds)
+            for p, fold_scores in zip(params, scores):
+                row = {'iteration': iteration,
+                       'n_resources': n_resources if resource else None,
+                       'mean_score': fold_scores.mean(),
+                       'std_score': fold_scores.std()}
+                row.update({'param_' + k: v for k, v in p.items()})
+                row.update({'fold%d_score' % k: s
+                            for k, s in enumerate(fold_scores)})
+                results.append(row)
+
+            # order of candidates by mean score; ties keep sampled order
+            ranked = numpy.argsort(-scores.mean(axis=1), kind='stable')
+            if (resource is None or len(candidates) == 1 or
+                    n_resources >= max_resources):
+                best = params[ranked[0]]
+                break
+            keep = max(1, int(math.ceil(len(candidates) / factor)))
+            candidates = [candidates[i] for i in ranked[:keep]]
+            n_resources = min(n_resources * factor, max_resources)
+            iteration += 1
+
+    print('Best parameters:', best)
+    return pandas.DataFrame(results), best
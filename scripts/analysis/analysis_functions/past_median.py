@@ -0,0 +1,134 @@
+"""
+Per patient past median imputation of labs
+
+Rows are sorted once by patient and visit date so each patient is a
+contiguous segment. For every visit the previous labs of the same patient
+(up to the window size, current visit included) are gathered in to an
+array and the median of the non-missing values is taken. Missing labs are
+replaced with that median; measured labs are kept as is. Patient segments
+are split in to shards that can be run in parallel.
+"""
+
+import numpy
+import pandas
+from joblib import Parallel, delayed
+
+
+def segment_starts(ids):
+    """segment_starts: Returns the row index where each patient segment
+    starts in an array of patient ids sorted by patient.
+
+    ids: 1d array of patient ids sorted so each patient is contiguous.
+    """
+    ids = numpy.asarray(ids)
+    if len(ids) == 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+    return numpy.flatnonzero(numpy.r_[True, ids[1:] != ids[:-1]])
+
+
+def trailing_median(values, starts, window=20, block_size=10000):
+    """trailing_median: Median of the non-missing values in the trailing
+    window of rows of each patient segment (current row included). Returns
+    array with the same shape as values; NaN where the window has no values.
+
+    values: 2d float array of labs, rows sorted by patient and visit date.
+    starts: row index where each patient segment starts.
+    window: number of rows in the trailing window.
+    block_size: number of rows gathered at once to bound memory.
+    """
+    n = values.shape[0]
+    medians = numpy.full(values.shape, numpy.nan)
+    # first row of the patient segment for each row
+    sizes = numpy.diff(numpy.append(starts, n))
+    row_start = numpy.repeat(starts, sizes)
+    # only rows with a missing lab need a median
+    need = numpy.flatnonzero(numpy.isnan(values).any(axis=1))
+    offsets = numpy.arange(-(window - 1), 1)
+    for b in range(0, len(need), block_size):
+        rows = need[b:b + block_size]
+        # window of row indexes; rows before the segment start are masked
+        idx = rows[:, None] + offsets[None, :]
+        outside = idx < row_start[rows][:, None]
+        win = values[numpy.where(outside, rows[:, None], idx)]
+        win[outside] = numpy.nan
+        medians[rows] = window_median(win)
+    return medians
+
+
+def window_median(win):
+    """window_median: Median over axis 1 of a 3d array ignoring NaN. Each
+    window is sorted once (NaN sort to the end) and the middle values are
+    taken by count of measured values; NaN where a window has no values.
+
+    win: 3d float array of shape (rows, window, labs).
+    """
+    n_obs = (~numpy.isnan(win)).sum(axis=1)
+    win = numpy.sort(win, axis=1)
+    lo = numpy.maximum((n_obs - 1)//2, 0)[:, None, :]
+    hi = (n_obs//2)[:, None, :]
+    median = (numpy.take_along_axis(win, lo, axis=1) +
+              numpy.take_along_axis(win, hi, axis=1))[:, 0, :]/2
+    median[n_obs == 0] = numpy.nan
+    return median
+
+
+def _impute_shard(values, starts, window):
+    """_impute_shard: Imputes one shard of contiguous patient segments."""
+    medians = trailing_median(values, starts, window=window)
+    return numpy.where(numpy.isnan(values), medians, values)
+
+
+def past_median_impute(X, lab_vars, id_var='id', date_var='vis_date',
+                       window=20, n_jobs=1):
+    """past_median_impute: Imputes missing labs with the median of the
+    patient's labs over the trailing window of visits. Returns a dataframe
+    of imputed labs with the same index and row order as X and a Series of
+    the proportion of patients with at least one value for each lab after
+    imputation. X is not modified.
+
+    X: Pandas dataframe with patient id, visit date and lab columns.
+    lab_vars: list of lab columns to impute.
+    id_var: name of patient id column.
+    date_var: name of visit date column.
+    window: number of visits in the trailing window (current visit included).
+    n_jobs: number of patient shards to impute in parallel.
+    """
+    # sort by patient and visit date; positions map back to X rows
+    order = (X.loc[:, [id_var, date_var]]
+             .reset_index(drop=True)
+             .sort_values(by=[id_var, date_var])
+             .index.to_numpy())
+    ids = X[id_var].to_numpy()[order]
+    values = X.loc[:, lab_vars].to_numpy(dtype=numpy.float64)[order]
+    starts = segment_starts(ids)
+
+    # split patient segments in to shards of about the same number of rows
+    n_shards = max(1, min(n_jobs, len(starts)))
+    shard_bounds = numpy.unique(numpy.append(
+        starts[numpy.searchsorted(starts,
+                                  numpy.linspace(0, len(ids), n_shards,
+                                                 endpoint=False))],
+        len(ids)))
+    shards = list(zip(shard_bounds[:-1], shard_bounds[1:]))
+    imputed_shards = Parallel(n_jobs=n_jobs)(
+        delayed(_impute_shard)(
+            values[lo:hi],
+            starts[(starts >= lo) & (starts < hi)] - lo,
+            window)
+        for lo, hi in shards)
+    imputed = (numpy.concatenate(imputed_shards) if imputed_shards
+               else values)
+
+    # proportion of patients with at least one lab value after imputation
+    if len(starts) > 0:
+        has_value = numpy.logical_or.reduceat(~numpy.isnan(imputed), starts,
+                                              axis=0)
+        completeness = has_value.sum(axis=0)/len(starts)
+    else:
+        completeness = numpy.zeros(len(lab_vars))
+
+    # put rows back in the order of X
+    labs_impute = numpy.empty_like(imputed)
+    labs_impute[order] = imputed
+    return (pandas.DataFrame(labs_impute, index=X.index, columns=lab_vars),
+            pandas.Series(completeness, index=lab_vars))
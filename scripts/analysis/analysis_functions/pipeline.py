@@ -0,0 +1,248 @@
+"""
+Dependency aware runner for the analysis scripts
+
+Each analysis script is declared as a Step with the files it reads (inputs)
+and the files it writes (outputs). Steps are linked through those files:
+a step runs after every step that produces one of its inputs. Each step
+runs in its own python process so scripts no longer share one global
+namespace, and steps that do not depend on each other run at the same time.
+
+A step is skipped when the hashes of its script, its inputs and the
+analysis_functions modules match the last successful run and all of its
+outputs exist. The shared modules are part of every signature since the
+scripts do most of their work through them. Inputs (multi GB csv files,
+feature arrays, models) are only hashed again when their size or
+modification time changed (see data_cache.csv_hash).
+
+Steps that run at the same time split the cores: run_steps gives each step
+n_cores // workers cores in the ANALYSIS_N_JOBS environment variable, and
+the scripts size their process pools with step_n_jobs.
+"""
+
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from analysis_functions.data_cache import file_hash, csv_hash
+
+# environment variable with the number of cores a step may use
+N_JOBS_ENV = 'ANALYSIS_N_JOBS'
+
+
+def step_n_jobs(default=11):
+    """step_n_jobs: Returns number of cores the running script may use: the
+    core budget set by run_steps, or default when the script is run on its
+    own.
+
+    default: number of cores used outside of run_steps.
+    """
+    return max(1, int(os.environ.get(N_JOBS_ENV, default)))
+
+
+class Step(object):
+    """Step: Analysis script with the files it reads and writes. Paths are
+    relative to the project root directory.
+
+    name: short name of step used in logs and the state file (e.g. '05').
+    script: file name of script in the analysis folder.
+    inputs: list of files the script reads.
+    outputs: list of files the script writes.
+    message: description printed when the step starts.
+    """
+    def __init__(self, name, script, inputs=None, outputs=None, message=''):
+        self.name = name
+        self.script = script
+        self.inputs = inputs or []
+        self.outputs = outputs or []
+        self.message = message
+
+
+def step_dependencies(steps):
+    """step_dependencies: Returns dictionary of step name to the set of
+    step names that produce its inputs. Raises ValueError if two steps
+    write the same file or if the steps contain a cycle.
+
+    steps: list of Step objects.
+    """
+    producers = {}
+    for step in steps:
+        for path in step.outputs:
+            if path in producers:
+                raise ValueError(path + ' is written by steps ' +
+                                 producers[path] + ' and ' + step.name)
+            producers[path] = step.name
+
+    deps = {step.name: set(producers[p] for p in step.inputs
+                           if p in producers and producers[p] != step.name)
+            for step in steps}
+
+    # check for cycles by removing steps with no remaining dependencies
+    remaining = {k: set(v) for k, v in deps.items()}
+    while remaining:
+        free = [k for k, v in remaining.items() if not v]
+        if not free:
+            raise ValueError('Steps contain a dependency cycle: ' +
+                             ', '.join(sorted(remaining)))
+        for k in free:
+            del remaining[k]
+        for v in remaining.values():
+            v.difference_update(free)
+    return deps
+
+
+def step_signature(step, root_dir, analysis_dir, key_dir=None):
+    """step_signature: Returns dictionary of hashes for the script, the
+    analysis_functions modules and inputs of a step. Missing inputs are
+    recorded as None.
+
+    key_dir: folder of the json files recording size, modification time
+        and hash of each input; defaults to data/logs/input_keys/ of
+        root_dir.
+    """
+    if key_dir is None:
+        key_dir = os.path.join(root_dir, 'data', 'logs', 'input_keys')
+    signature = {step.script: file_hash(os.path.join(analysis_dir, step.script))}
+    # shared modules the scripts call (trainers, metrics, transformers, ...)
+    for path in sorted(glob.glob(os.path.join(analysis_dir,
+                                              'analysis_functions', '*.py'))):
+        signature[os.path.relpath(path, analysis_dir)] = file_hash(path)
+    for path in step.inputs:
+        full_path = os.path.join(root_dir, path)
+        # one key file per input, named after its path from the root
+        key_file = os.path.join(key_dir,
+                                path.replace('/', '__') + '_key.json')
+        signature[path] = (csv_hash(full_path, key_file)
+                           if os.path.exists(full_path) else None)
+    return signature
+
+
+def read_state(state_file):
+    """read_state: Reads the json state file of the last successful runs."""
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file, 'r') as f:
+        return json.load(f)
+
+
+def write_state(state, state_file):
+    """write_state: Writes the json state file through a temporary file so
+    a killed run never leaves a partial state file.
+    """
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_file, state_file)
+
+
+def run_script(script, analysis_dir, log_file, n_jobs=None):
+    """run_script: Runs one analysis script in a new python process from
+    the analysis folder and writes its output to a log file. Returns the
+    process return code.
+
+    n_jobs: number of cores the script may use (see step_n_jobs); None
+        leaves the script defaults.
+    """
+    os.makedirs(os.path.dirname(log_file), exist_ok=True)
+    env = dict(os.environ)
+    if n_jobs is not None:
+        env[N_JOBS_ENV] = str(n_jobs)
+    with open(log_file, 'w') as log:
+        process = subprocess.run([sys.executable, script], cwd=analysis_dir,
+                                 stdout=log, stderr=subprocess.STDOUT,
+                                 env=env)
+    return process.returncode
+
+
+def run_steps(steps, root_dir, analysis_dir, state_file, log_dir,
+              workers=4, force=False, only=None, n_cores=11):
+    """run_steps: Runs analysis steps in dependency order. Steps whose
+    dependencies are done run in parallel, up to the number of workers.
+    Returns dictionary of step name to status ('ran', 'skipped', 'failed',
+    'blocked', or 'not selected').
+
+    steps: list of Step objects.
+    root_dir: project root directory that step paths are relative to.
+    analysis_dir: folder that contains the analysis scripts.
+    state_file: json file that stores signatures of successful runs.
+    log_dir: folder to write one log file per step.
+    workers: number of steps to run at the same time.
+    force: if True, run steps even if their inputs have not changed.
+    only: list of step names to run; other steps are treated as done.
+    n_cores: total number of cores; each step gets n_cores // workers.
+    """
+    deps = step_dependencies(steps)
+    steps_by_name = {step.name: step for step in steps}
+    state = read_state(state_file)
+    status = {}
+    if only is not None:
+        for name in steps_by_name:
+            if name not in only:
+                status[name] = 'not selected'
+
+    # cores of each step so parallel steps do not oversubscribe the machine
+    step_cores = max(1, n_cores // workers)
+    print('Running up to', workers, 'steps at once with', step_cores,
+          'cores each')
+    done = ('ran', 'skipped', 'not selected')
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while len(status) < len(steps):
+            # mark steps downstream of a failure as blocked
+            for name, step_deps in deps.items():
+                if name in status or name in running.values():
+                    continue
+                if any(status.get(d) in ('failed', 'blocked') for d in step_deps):
+                    print('\n', name, ': blocked by failed dependency')
+                    status[name] = 'blocked'
+
+            # submit steps with all dependencies done
+            for step in steps:
+                if step.name in status or step.name in running.values():
+                    continue
+                if not all(status.get(d) in done for d in deps[step.name]):
+                    continue
+                signature = step_signature(
+                    step, root_dir, analysis_dir,
+                    key_dir=os.path.join(os.path.dirname(state_file),
+                                         'input_keys'))
+                outputs_exist = all(os.path.exists(os.path.join(root_dir, p))
+                                    for p in step.outputs)
+                if (not force and outputs_exist and
+                    state.get(step.name) == signature):
+                    print('\n', step.name, ': inputs unchanged; skipping')
+                    status[step.name] = 'skipped'
+                    continue
+                print('\n', step.name, ':', step.message)
+                log_file = os.path.join(log_dir, step.name + '.log')
+                future = pool.submit(run_script, step.script,
+                                     analysis_dir, log_file, step_cores)
+                future.start_time = time.time()
+                future.signature = signature
+                running[future] = step.name
+
+            if not running:
+                continue
+
+            # wait for at least one running step to finish
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                minutes = (time.time() - future.start_time)/60
+                if future.result() == 0:
+                    print('\n', name, ': finished in %.1f minutes' % minutes)
+                    status[name] = 'ran'
+                    state[name] = future.signature
+                    write_state(state, state_file)
+                else:
+                    print('\n', name, ': failed; see log',
+                          os.path.join(log_dir, name + '.log'))
+                    status[name] = 'failed'
+                    # drop old signature so the step reruns next time
+                    state.pop(name, None)
+                    write_state(state, state_file)
+    return status
@@ -0,0 +1,363 @@
+"""
+Random forest trainer for the main model and IBD subgroup models
+
+The main random forest model and the Crohn's disease, ulcerative colitis
+and indeterminate colitis sensitivity models share the same features,
+pipeline and results. Each model is described by a SubgroupSpec (filter on
+disease_category, results folder, file names). Each model loads the train
+and test features memory mapped from the feature store (feature_store.py);
+fit_subgroups fits the models in parallel and splits a fixed number of
+cores between them.
+"""
+
+import os
+
+import numpy
+import pandas
+import matplotlib.pyplot as plt
+import seaborn as sns; sns.set_style('whitegrid')
+from joblib import dump, Parallel, delayed
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.impute import SimpleImputer
+from sklearn.pipeline import FeatureUnion
+from sklearn.metrics import confusion_matrix
+from sklearn.metrics import classification_report
+from sklearn.metrics import roc_curve, auc
+from sklearn.metrics import brier_score_loss
+from imblearn.under_sampling import RandomUnderSampler
+from imblearn.pipeline import Pipeline
+
+from analysis_functions.transformers import FeatureSelector
+from analysis_functions.transformers import OtherTransformer
+from analysis_functions.custom_metrics import dx_accuracy
+from analysis_functions.custom_metrics import boot_dx_metrics
+from analysis_functions.custom_metrics import boot_95
+from analysis_functions.custom_metrics import roc_plot
+from analysis_functions.custom_metrics import bayes
+from analysis_functions.feature_store import load_features, load_patients
+from analysis_functions.fit_cache import preprocessing_memory
+
+
+class SubgroupSpec(object):
+    """SubgroupSpec: Random forest model to fit on all or part of the
+    train and test data.
+
+    name: short name of model used in file names (e.g. 'rf_cd').
+    results_folder: folder in results/ to save results (e.g. 'rf_cd').
+    disease_category: disease_category to subset train and test data
+        (e.g. 'crohns disease'); None uses all rows.
+    brier_label: label written in front of the brier score.
+    intervals_file: file name of bootstrapped intervals.
+    model_file: path relative to project root to save the fitted model;
+        None does not save the model.
+    """
+    def __init__(self, name, results_folder, disease_category=None,
+                 brier_label='', intervals_file=None, model_file=None):
+        self.name = name
+        self.results_folder = results_folder
+        self.disease_category = disease_category
+        self.brier_label = brier_label
+        self.intervals_file = intervals_file or name + '_dx_intervals.csv'
+        self.model_file = model_file
+
+
+# main model and ibd subgroup sensitivity models from the manuscript
+RF_SPECS = [
+    SubgroupSpec('rf', 'rf',
+                 brier_label='RF Clinical + Labs Features Benchmark',
+                 intervals_file='dx_intervals.csv',
+                 model_file='models/rf.joblib'),
+    SubgroupSpec('rf_cd', 'rf_cd',
+                 disease_category='crohns disease',
+                 brier_label='Chrons Disease RF Clinical + Labs Features ' +
+                             'Benchmark'),
+    SubgroupSpec('rf_uc', 'rf_uc',
+                 disease_category='ulcerative colitis',
+                 brier_label='Ulcerative Colitis RF Clinical + Labs ' +
+                             'Features Benchmark'),
+    SubgroupSpec('rf_ic', 'rf_ic',
+                 disease_category='indeterminate colitis',
+                 brier_label='indeterminate colitis RF Clinical + Labs ' +
+                             'Features Benchmark'),
+]
+
+
+def rf_transform_pipe(num_cols, other_cols):
+    """rf_transform_pipe: Returns the transformation pipe of the random
+    forest pipeline. Numeric features are imputed with the median and other
+    features are passed as is.
+
+    num_cols: list of numeric features to impute.
+    other_cols: list of features passed as is.
+    """
+    # numeric transformation pipeline to impute median
+    num_pipe = Pipeline(
+        [('num_selector', FeatureSelector(feature_names = num_cols)),
+         ('median_impute', SimpleImputer(missing_values = numpy.nan,
+                                         strategy = 'median'))
+        ])
+
+    # pipe for values that I don't want to transform
+    other_pipe = Pipeline(
+        [('other_selector', FeatureSelector(feature_names = other_cols)),
+         ('other_transformer', OtherTransformer())
+        ])
+
+    # define transformation pipe
+    return FeatureUnion(
+        [('numeric_pipeline', num_pipe),
+         ('other_pipeline', other_pipe)
+        ])
+
+
+def rf_model(n_jobs=1, **rf_params):
+    """rf_model: Returns the steps of the random forest pipeline after the
+    transformation pipe: random undersampling of the training data and the
+    random forest.
+
+    n_jobs: number of cores used by the random forest.
+    rf_params: random forest parameters replacing the defaults
+        (n_estimators=500), e.g. from 10_model_tuning.py.
+    """
+    # using random undersampler; default option for replacement is false
+    rand_undersamp = RandomUnderSampler(random_state=0,
+                                        sampling_strategy='auto')
+
+    # define RF model
+    rf = RandomForestClassifier(n_jobs = n_jobs,
+                                **dict({'n_estimators': 500}, **rf_params))
+
+    return Pipeline([
+        ('random_undersample', rand_undersamp),
+        ('rf', rf)
+    ])
+
+
+def rf_pipeline(num_cols, other_cols, n_jobs=1, memory=None, **rf_params):
+    """rf_pipeline: Returns the random forest pipeline. Numeric features
+    are imputed with the median, other features are passed as is, and the
+    training data is randomly undersampled before the forest is fit.
+
+    num_cols: list of numeric features to impute.
+    other_cols: list of features passed as is.
+    n_jobs: number of cores used by the random forest.
+    memory: joblib Memory caching the fitted transformation pipe and
+        undersampler (fit_cache.preprocessing_memory); None refits them.
+    rf_params: random forest parameters replacing the defaults.
+    """
+    return Pipeline([('transform_pipe', rf_transform_pipe(num_cols,
+                                                          other_cols))] +
+                    rf_model(n_jobs, **rf_params).steps,
+                    memory=memory)
+
+
+def save_rf_results(model_pipe, x_test, y_test, spec, results_folder,
+                    feature_list, n_boot=2000, n_jobs=1, patients=None):
+    """save_rf_results: Evaluates a fitted random forest pipeline on the
+    test set and saves predictions, classification report, brier score,
+    roc, variable importance and bootstrapped intervals.
+
+    model_pipe: fitted random forest pipeline.
+    x_test: Pandas dataframe of features of test set.
+    y_test: Pandas series of outcome.
+    spec: SubgroupSpec of model.
+    results_folder: full path of folder to save results.
+    feature_list: list of features in the order of the pipeline output.
+    n_boot: number of bootstrap replicates.
+    n_jobs: number of processes computing bootstrap replicates.
+    patients: array of patient of each test row; if given, intervals from
+        resampling patients are also saved (intervals file + '_patient').
+    """
+    name = spec.name
+    os.makedirs(results_folder, exist_ok=True)
+
+    # predicted probability and class based on 0.5 threshold
+    y_pred = model_pipe.predict_proba(x_test)
+    y_pred_class = numpy.where(y_pred[:, 1] > 0.5, 1, 0)
+
+    # corrected probability based on risk proportion for flare in
+    # next 6 months using bayes theorem
+    pop_prop_flare = y_test.sum()/y_test.count()
+    bayes_prob = bayes(obs_pred=y_pred[:, 1], pop_prop=pop_prop_flare)
+
+    # creating dataset to save for future use
+    preds_df = pandas.DataFrame(
+        numpy.stack((y_pred[:,1], y_pred_class, bayes_prob, y_test), axis = 1),
+        columns = ['flare_pred_prob', 'flare_predict', 'bayes_prob',
+                   'flare_true'])
+    preds_df.to_csv(results_folder + name + "_pred.csv")
+
+    """
+    1. Classification report and summary statistics
+    """
+    class_report = classification_report(y_test, y_pred_class)
+    print(class_report)
+    with open(results_folder + name + "_classification_report.txt", "w") as f:
+        print(class_report, file=f)
+
+    # run accuracy summary on confusion matrix
+    cm = confusion_matrix(y_test, y_pred_class)
+    dx_summary = dx_accuracy(cm)
+    print(dx_summary)
+    dx_summary.to_csv(results_folder + name + "_dx_summary.csv")
+
+    """
+    2. Brier score
+    """
+    brier_score = numpy.round(brier_score_loss(y_test, y_pred[:,1]),3)
+    with open(results_folder + 'brier_score.txt', 'w') as f:
+        print(spec.brier_label, '\nBrier Score:', brier_score, file=f)
+
+    """
+    3. ROC
+    """
+    # roc for prediction of y=1 (2nd part of 2d array)
+    fpr, tpr, thresholds = roc_curve(y_test, y_pred[:,1])
+    roc_auc = auc(fpr, tpr)
+
+    roc_df = pandas.DataFrame({'fpr': fpr, 'tpr': tpr,
+                               'thresholds': thresholds})
+    roc_df.to_csv(results_folder + name + "_roc.csv")
+    for auc_file in ["roc_auc.txt", name + "_roc_auc.txt"]:
+        with open(results_folder + auc_file, "w") as f:
+            print(roc_auc, file=f)
+
+    # roc plot
+    roc_plot(fpr,
+             tpr,
+             roc_auc,
+             model_name='Random Forest: Clinical & Labs')
+    plt.savefig(results_folder + name + "_roc.pdf", facecolor = 'white')
+
+    # ROC plot without model name
+    plt.figure(figsize=(10,10))
+    lw = 2
+    plt.plot(fpr, tpr, color='darkblue',
+             lw=lw, label='RF (area = %0.2f)' % roc_auc)
+    plt.plot([0, 1], [0, 1], color='grey', lw=lw, linestyle='--')
+    plt.xlim([0.0, 1.0])
+    plt.ylim([0.0, 1.05])
+    plt.xlabel('1-Specificity')
+    plt.ylabel('Sensitivity')
+    plt.title('ROC')
+    plt.legend(loc="lower right")
+    plt.savefig(results_folder + name + "_roc_plot.pdf",
+                facecolor = 'white')
+
+    """
+    4. Variable Importance Plots
+    """
+    vif = model_pipe.named_steps['rf'].feature_importances_
+    assert(len(feature_list) == len(vif))
+
+    vif_df = (
+        pandas.DataFrame({'Features': feature_list, 'VIF': vif})
+        .sort_values('VIF', ascending=False)
+        .reset_index()
+    )
+    vif_df.to_csv(results_folder + name + '_vif.csv')
+
+    plt.subplots(figsize=(15,15))
+    sns.set_color_codes('muted')
+    sns.barplot(x='VIF', y='Features', data = vif_df.iloc[:10, :], color='b')
+    plt.title('Random Forest Variable Importance to Predict Flare')
+    plt.xlabel('Variable Importance')
+    plt.ylabel('Top 10 Features')
+    plt.tight_layout(pad=2, w_pad=2, h_pad=2)
+    plt.savefig(results_folder + name + "_vif_plot.pdf",
+                facecolor = 'white')
+    plt.close('all')
+
+    """
+    5. Bootstrapped estimates of confidence intervals
+    """
+    boot_list = boot_dx_metrics(y_true=y_test,
+                                y_prob=y_pred[:, 1],
+                                n_boot=n_boot, seed=0, n_jobs=n_jobs)
+    dx_intervals = boot_95(boot_list)
+    dx_intervals.to_csv(results_folder + spec.intervals_file)
+
+    # patients have many correlated visits; resampling patients gives wider
+    # intervals than resampling visits
+    if patients is not None:
+        boot_list = boot_dx_metrics(y_true=y_test,
+                                    y_prob=y_pred[:, 1],
+                                    n_boot=n_boot, seed=0, n_jobs=n_jobs,
+                                    groups=patients)
+        boot_95(boot_list).to_csv(
+            results_folder +
+            spec.intervals_file.replace('.csv', '_patient.csv'))
+
+
+def fit_subgroup(spec, store_dir, num_cols, other_cols, root_dir,
+                 n_jobs=1, n_boot=2000):
+    """fit_subgroup: Fits the random forest pipeline on the train rows
+    selected by the spec and saves the model and test set results.
+
+    spec: SubgroupSpec of model.
+    store_dir: folder of the feature store with train and test splits.
+    num_cols: list of numeric features.
+    other_cols: list of features passed as is.
+    root_dir: project root directory.
+    n_jobs: number of cores used by the random forest.
+    n_boot: number of bootstrap replicates.
+    """
+    # load features memory mapped in this process
+    x_train, y_train, dx_train = load_features(store_dir, 'train',
+                                               columns=num_cols + other_cols)
+    x_test, y_test, dx_test = load_features(store_dir, 'test',
+                                            columns=num_cols + other_cols)
+    patients_test = numpy.asarray(load_patients(store_dir, 'test'))
+    if spec.disease_category is not None:
+        keep_train = (dx_train == spec.disease_category).to_numpy()
+        keep_test = (dx_test == spec.disease_category).to_numpy()
+        x_train, y_train = x_train.loc[keep_train], y_train.loc[keep_train]
+        x_test, y_test = x_test.loc[keep_test], y_test.loc[keep_test]
+        patients_test = patients_test[keep_test]
+    # make sure the subgroup has data in both sets
+    assert(x_train.shape[0] > 0 and x_test.shape[0] > 0)
+    print(spec.name, ': train', x_train.shape, 'test', x_test.shape)
+
+    print(spec.name, ': fitting RF pipeline on x_train, y_train')
+    # fitted transformation pipe reused from the preprocessing cache when
+    # the same subgroup rows were fit before
+    model_pipe = rf_pipeline(num_cols, other_cols, n_jobs=n_jobs,
+                             memory=preprocessing_memory(root_dir))
+    model_pipe.fit(x_train, y_train)
+
+    if spec.model_file is not None:
+        model_filename = os.path.join(root_dir, spec.model_file)
+        dump(model_pipe, model_filename)
+        print('Saving final model here:', model_filename)
+
+    results_folder = root_dir + '/results/' + spec.results_folder + '/'
+    save_rf_results(model_pipe, x_test, y_test, spec, results_folder,
+                    feature_list=num_cols + other_cols, n_boot=n_boot,
+                    n_jobs=n_jobs, patients=patients_test)
+    print(spec.name, ': done')
+    return spec.name
+
+
+def fit_subgroups(specs, store_dir, num_cols, other_cols, root_dir,
+                  n_cores=11, n_boot=2000):
+    """fit_subgroups: Fits the random forest models of a list of specs
+    in parallel. The cores are split between the models so the total
+    stays within n_cores.
+
+    specs: list of SubgroupSpec.
+    store_dir: folder of the feature store with train and test splits.
+    num_cols: list of numeric features.
+    other_cols: list of features passed as is.
+    root_dir: project root directory.
+    n_cores: total number of cores to use.
+    n_boot: number of bootstrap replicates.
+    """
+    n_models = max(1, min(len(specs), n_cores))
+    # cores for each random forest
+    n_jobs = max(1, n_cores // n_models)
+    print('Fitting', len(specs), 'models;', n_models, 'at a time with',
+          n_jobs, 'cores each')
+    return Parallel(n_jobs=n_models)(
+        delayed(fit_subgroup)
+        (spec, store_dir, num_cols, other_cols, root_dir,
+         n_jobs=n_jobs, n_boot=n_boot) for spec in specs)
@@ -0,0 +1,129 @@
+"""
+Batch scoring with saved model pipelines
+
+Saved pipelines (models/rf.joblib, models/logreg_*.joblib) are loaded once
+and a visits file is read in fixed size chunks. Each chunk is passed
+through the pipeline's predict_proba and the predicted probability of flare
+and the bayes corrected probability are appended to the output file, so
+memory use depends on the chunk size and not on the size of the file.
+"""
+
+import os
+
+import pandas
+from joblib import load
+
+from analysis_functions.custom_metrics import bayes
+from analysis_functions.feature_store import male_v_female
+from analysis_functions.transformers import FeatureSelector
+
+# proportion of flare in the population used for bayes corrected probability
+# when the cohort summary is not available; 0.115 is the value used in the
+# manuscript analyses (09_rf_mice.py). The proportion of visits with flare
+# of the current cohort is in results/query_metrics/flare_events_summary.csv
+# (02_train_test.py) and is read by read_pop_prop.
+POP_PROP_FLARE = 0.115
+
+
+def read_pop_prop(root_dir):
+    """read_pop_prop: Returns the proportion of visits with flare of the
+    cohort from results/query_metrics/flare_events_summary.csv, or
+    POP_PROP_FLARE if 02_train_test.py has not written the file.
+
+    root_dir: project root directory.
+    """
+    path = os.path.join(root_dir, 'results', 'query_metrics',
+                        'flare_events_summary.csv')
+    if not os.path.exists(path):
+        print('No flare events summary; using population proportion of',
+              POP_PROP_FLARE)
+        return POP_PROP_FLARE
+    summary = pandas.read_csv(path, index_col=0)
+    return float(summary.loc[summary['flare_v1'] == 1, 'prop_visits'].iloc[0])
+
+
+def model_input_columns(model):
+    """model_input_columns: Returns the list of columns a saved pipeline
+    selects from its input dataframe, in the order of the FeatureSelector
+    steps of the transformation pipe. Columns must be passed in this order
+    because FeatureSelector keeps the column order of its input.
+
+    model: fitted sklearn/imblearn pipeline with a 'transform_pipe' step.
+    """
+    steps = dict(model.steps)
+    if 'past_median_labs' in steps:
+        raise ValueError('Pipelines with past median imputation need the ' +
+                         'visit history of each patient and are not ' +
+                         'supported by batch scoring')
+    columns = []
+    for name, pipe in steps['transform_pipe'].transformer_list:
+        for step_name, step in pipe.steps:
+            if isinstance(step, FeatureSelector):
+                columns += list(step.feature_names)
+    return columns
+
+
+def score_chunk(model, chunk, columns, id_cols=[], pop_prop=POP_PROP_FLARE):
+    """score_chunk: Returns a dataframe of id columns, predicted probability
+    of flare and bayes corrected probability for one chunk of visits.
+
+    model: fitted pipeline.
+    chunk: Pandas dataframe of visits.
+    columns: list of model input columns (see model_input_columns).
+    id_cols: list of columns copied to the output to identify visits.
+    pop_prop: proportion of flare in population for bayes probability.
+    """
+    # derive male_v_female from gender if the file has raw gender
+    if 'male_v_female' in columns and 'male_v_female' not in chunk.columns:
+        chunk = chunk.assign(male_v_female=male_v_female(chunk['gender']))
+    flare_pred_prob = model.predict_proba(chunk.loc[:, columns])[:, 1]
+    scores = chunk.loc[:, id_cols].copy()
+    scores['flare_pred_prob'] = flare_pred_prob
+    scores['bayes_prob'] = bayes(obs_pred=flare_pred_prob, pop_prop=pop_prop)
+    return scores
+
+
+def score_file(model_file, input_file, output_file, chunk_size=50000,
+               id_cols=['id', 'vis_date'], pop_prop=POP_PROP_FLARE):
+    """score_file: Scores every visit in a csv file with a saved pipeline
+    and writes scores to a csv file chunk by chunk. Returns the number of
+    visits scored.
+
+    model_file: path of saved joblib pipeline (e.g. models/rf.joblib).
+    input_file: csv file of visits with the model features (or gender
+        in place of male_v_female).
+    output_file: csv file of scores to write.
+    chunk_size: number of visits read and scored at a time.
+    id_cols: columns copied to the output; columns not in the file are
+        skipped.
+    pop_prop: proportion of flare in population for bayes probability.
+    """
+    model = load(model_file)
+    columns = model_input_columns(model)
+
+    # only read the columns needed for scoring
+    header = pandas.read_csv(input_file, nrows=0).columns
+    id_cols = [c for c in id_cols if c in header]
+    read_cols = [c for c in columns if c in header] + id_cols
+    if 'male_v_female' in columns and 'male_v_female' not in header:
+        read_cols.append('gender')
+    missing = [c for c in columns if c not in header and c != 'male_v_female']
+    if missing:
+        raise ValueError('Input file is missing model columns: ' +
+                         ', '.join(missing))
+
+    if os.path.dirname(output_file):
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    # write to temp file first so a killed run never leaves partial scores
+    tmp_file = output_file + '.tmp'
+    n_scored = 0
+    reader = pandas.read_csv(input_file, usecols=list(dict.fromkeys(read_cols)),
+                             chunksize=chunk_size)
+    with open(tmp_file, 'w', newline='') as f:
+        for i, chunk in enumerate(reader):
+            scores = score_chunk(model, chunk, columns, id_cols, pop_prop)
+            scores.to_csv(f, header=(i == 0), index=False)
+            n_scored += scores.shape[0]
+            print('Scored', n_scored, 'visits')
+    os.replace(tmp_file, output_file)
+    return n_scored
@@ -0,0 +1,142 @@
+"""
+Chunked and cached TreeSHAP values
+
+SHAP values of a saved random forest pipeline are computed on chunks of
+rows in parallel processes. Each chunk is saved as a .npy file named by
+the hash of the model file and the hash of the chunk rows, so a rerun only
+computes chunks that are missing (e.g. after a killed run or new rows).
+The chunks are then copied in to one .npy file that is read memory mapped.
+Chunk folders of other model files are deleted, since a retrained model
+never reuses them.
+
+Only SHAP values of the positive class (flare) are kept; for a binary
+forest the values of the other class are the negative of these.
+"""
+
+import hashlib
+import os
+import shutil
+
+import numpy
+from joblib import Parallel, delayed, load
+
+from analysis_functions.data_cache import file_hash
+
+# tree explainers loaded in each worker process, keyed by model file hash
+_EXPLAINERS = {}
+
+
+def positive_class_shap(shap_vals):
+    """positive_class_shap: Returns the SHAP values of class 1 from the
+    output of TreeExplainer.shap_values, which is a list of one array per
+    class in older versions of shap and a 3d array in newer versions.
+    """
+    if isinstance(shap_vals, list):
+        return shap_vals[1]
+    shap_vals = numpy.asarray(shap_vals)
+    if shap_vals.ndim == 3:
+        return shap_vals[:, :, 1]
+    return shap_vals
+
+
+def tree_explainer(model_file, model_key):
+    """tree_explainer: Loads the random forest of a saved pipeline once per
+    process and returns its shap TreeExplainer.
+
+    model_file: path of saved joblib model or pipeline.
+    model_key: hash of model file used as cache key.
+    """
+    import shap
+    if model_key not in _EXPLAINERS:
+        model = load(model_file)
+        # use forest step of a pipeline
+        if hasattr(model, 'named_steps'):
+            model = model.named_steps['rf']
+        _EXPLAINERS[model_key] = shap.TreeExplainer(model)
+    return _EXPLAINERS[model_key]
+
+
+def _chunk_shap(model_file, model_key, x_chunk, chunk_file, approximate):
+    """_chunk_shap: Computes SHAP values for one chunk and saves them."""
+    explainer = tree_explainer(model_file, model_key)
+    shap_vals = positive_class_shap(
+        explainer.shap_values(x_chunk, approximate=approximate))
+    # write to temp file first so a killed run never leaves a partial chunk
+    tmp_file = chunk_file + '.tmp.npy'
+    numpy.save(tmp_file, numpy.asarray(shap_vals, dtype=numpy.float64))
+    os.replace(tmp_file, chunk_file)
+    return chunk_file
+
+
+def remove_stale_models(cache_dir, model_key):
+    """remove_stale_models: Deletes the chunk folders of model files other
+    than the one hashed to model_key; exact and approximate folders of the
+    model are kept. Returns list of deleted folders.
+
+    cache_dir: folder of the model chunk folders.
+    model_key: hash of the current model file.
+    """
+    removed = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if os.path.isdir(path) and not name.startswith(model_key[:16]):
+            shutil.rmtree(path)
+            removed.append(path)
+    return removed
+
+
+def cached_shap_values(model_file, x, cache_dir, chunk_size=1000, n_jobs=4,
+                       approximate=True):
+    """cached_shap_values: Returns SHAP values of class 1 for every row of
+    x as a read only memory mapped array of shape (rows, features). Chunks
+    already in the cache are not computed again; chunks of other model
+    files are deleted.
+
+    model_file: path of saved joblib model or pipeline (e.g. models/rf.joblib).
+    x: 2d numpy array of transformed features fed to the forest.
+    cache_dir: folder to save chunk and assembled SHAP files.
+    chunk_size: number of rows per chunk.
+    n_jobs: number of chunks computed at the same time.
+    approximate: passed to TreeExplainer.shap_values.
+    """
+    x = numpy.ascontiguousarray(x)
+    model_key = file_hash(model_file)
+    model_dir = os.path.join(cache_dir, model_key[:16] +
+                             ('_approx' if approximate else ''))
+    os.makedirs(model_dir, exist_ok=True)
+    for stale_dir in remove_stale_models(cache_dir, model_key):
+        print('Removed SHAP chunks of old model:', stale_dir)
+
+    # name chunks by position and content of rows
+    chunks = []
+    data_hash = hashlib.sha1()
+    for start in range(0, x.shape[0], chunk_size):
+        x_chunk = x[start:start + chunk_size]
+        chunk_hash = hashlib.sha1(x_chunk.tobytes()).hexdigest()
+        data_hash.update(chunk_hash.encode('utf-8'))
+        chunk_file = os.path.join(
+            model_dir, 'chunk_%d_%s.npy' % (start, chunk_hash[:16]))
+        chunks.append((start, x_chunk, chunk_file))
+
+    missing = [c for c in chunks if not os.path.exists(c[2])]
+    print('SHAP chunks:', len(chunks), 'cached:', len(chunks) - len(missing),
+          'to compute:', len(missing))
+    Parallel(n_jobs=n_jobs)(
+        delayed(_chunk_shap)
+        (model_file, model_key, x_chunk, chunk_file, approximate)
+        for start, x_chunk, chunk_file in missing)
+
+    # assemble chunks in one file read memory mapped
+    shap_file = os.path.join(
+        model_dir, 'shap_values_' + data_hash.hexdigest()[:16] + '.npy')
+    if not os.path.exists(shap_file):
+        tmp_file = shap_file + '.tmp.npy'
+        shap_vals = numpy.lib.format.open_memmap(
+            tmp_file, mode='w+', dtype=numpy.float64, shape=x.shape)
+        for start, x_chunk, chunk_file in chunks:
+            shap_vals[start:start + x_chunk.shape[0]] = numpy.load(
+                chunk_file, mmap_mode='r')
+        shap_vals.flush()
+        del shap_vals
+        os.replace(tmp_file, shap_file)
+    return numpy.load(shap_file, mmap_mode='r')
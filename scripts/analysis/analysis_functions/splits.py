@@ -0,0 +1,112 @@
+"""
+Train and test splits stored as row indexes
+
+A split is saved as two int64 numpy arrays of row index labels of the
+analysis dataframe (the row number in the raw analysis csv), instead of
+full train and test csv copies of the data. Scripts rebuild train and test
+by reading the columns they need through the columnar cache and selecting
+rows with .loc.
+
+Layout of the split folder (data/splits/ by default):
+    <name>_train.npy: int64 row index of the training rows
+    <name>_test.npy: int64 row index of the testing rows
+
+Three kinds of split are built here:
+    random: rows shuffled with sklearn train_test_split (visits of a
+        patient may be in both sets).
+    grouped: patients shuffled with GroupShuffleSplit, so all visits of a
+        patient are in one set.
+    temporal: the last 30% of visits of each patient are held out for
+        testing, as in Waljee et al. 2017.
+"""
+
+import os
+
+import numpy
+import pandas
+from sklearn.model_selection import GroupShuffleSplit, train_test_split
+
+
+def random_split(index, test_size=0.3, random_state=12):
+    """random_split: Returns tuple of train and test row indexes. Gives the
+    same rows in the same order as train_test_split on the dataframe.
+
+    index: array or Pandas index of row labels.
+    test_size: proportion of rows held out for testing.
+    random_state: seed of the shuffle.
+    """
+    train, test = train_test_split(numpy.asarray(index, dtype=numpy.int64),
+                                   test_size=test_size,
+                                   random_state=random_state)
+    return train, test
+
+
+def grouped_split(index, groups, test_size=0.3, random_state=12):
+    """grouped_split: Returns tuple of train and test row indexes where the
+    rows of a group (e.g. patient id) are all in the same set.
+
+    index: array or Pandas index of row labels.
+    groups: array of group of each row.
+    test_size: proportion of groups held out for testing.
+    random_state: seed of the shuffle.
+    """
+    index = numpy.asarray(index, dtype=numpy.int64)
+    splitter = GroupShuffleSplit(n_splits=1, test_size=test_size,
+                                 random_state=random_state)
+    train, test = next(splitter.split(index, groups=numpy.asarray(groups)))
+    return index[train], index[test]
+
+
+def temporal_split(index, ids, dates, test_size=0.3):
+    """temporal_split: Returns tuple of train and test row indexes, sorted by
+    id and date, where the last floor(n_visits * test_size) visits of each
+    patient are held out for testing. Visit numbers come from groupby
+    cumcount, so no per patient python function is run.
+
+    index: array or Pandas index of row labels.
+    ids: array of patient id of each row.
+    dates: array of visit date of each row (any sortable type).
+    test_size: proportion of each patient's visits held out.
+    """
+    index = numpy.asarray(index, dtype=numpy.int64)
+    ids = numpy.asarray(ids)
+    # stable sort by id then date, as sort_values(['id', 'vis_date'])
+    order = numpy.lexsort((numpy.asarray(dates), ids))
+    sorted_ids = pandas.Series(ids[order])
+    visit = sorted_ids.groupby(sorted_ids, sort=False).cumcount().to_numpy()
+    n_visits = sorted_ids.map(sorted_ids.value_counts()).to_numpy()
+    n_test = numpy.floor(n_visits * test_size).astype(numpy.int64)
+    is_test = visit >= n_visits - n_test
+    return index[order][~is_test], index[order][is_test]
+
+
+def save_split(split_dir, name, train_index, test_index):
+    """save_split: Saves the train and test row indexes of a split.
+
+    split_dir: folder of split files.
+    name: name of split (e.g. 'random').
+    train_index: array of train row indexes.
+    test_index: array of test row indexes.
+    """
+    os.makedirs(split_dir, exist_ok=True)
+    for part, rows in [('train', train_index), ('test', test_index)]:
+        path = os.path.join(split_dir, name + '_' + part + '.npy')
+        # write to temp file first so a killed run never leaves half a split
+        tmp_path = path + '.tmp.npy'
+        numpy.save(tmp_path, numpy.asarray(rows, dtype=numpy.int64))
+        os.replace(tmp_path, path)
+    print('Split', name, 'saved here:', split_dir,
+          '(train: %d rows, test: %d rows)' % (len(train_index),
+                                               len(test_index)))
+
+
+def load_split(split_dir, name):
+    """load_split: Returns tuple of train and test row indexes of a saved
+    split, memory mapped.
+
+    split_dir: folder of split files.
+    name: name of split (e.g. 'random').
+    """
+    return tuple(numpy.load(os.path.join(split_dir, name + '_' + part +
+                                         '.npy'), mmap_mode='r')
+                 for part in ['train', 'test'])
@@ -7,143 +7,226 @@ Date Created: 2019-06-26
 from sklearn.base import BaseEstimator, TransformerMixin
 import numpy 
 import pandas
+from scipy import sparse
+
+from analysis_functions.past_median import past_median_impute
 
 """
 Custom sklearn class
+
+Constructor arguments are stored under their own names so sklearn can
+read them with get_params and clone the transformers (e.g. in
+cross validation and hyperparameter searches). Models saved before this
+stored them with a leading underscore; __setstate__ renames them on load.
 """
 
+def _rename_params(state, params):
+    """_rename_params: Renames '_<param>' keys of a pickled state to
+    '<param>' for the given list of params.
+    """
+    for param, old in params:
+        if old in state and param not in state:
+            state[param] = state.pop(old)
+    return state
+
+
+def _column_positions(columns, names):
+    """_column_positions: Returns positions of the columns in names, in the
+    order of columns, as a slice when they are next to each other (so
+    selecting them with iloc or numpy indexing is a view) or an array.
+
+    columns: Pandas index of columns of X.
+    names: list of column names to select.
+    """
+    positions = numpy.flatnonzero(columns.isin(names))
+    if len(positions) > 0 and numpy.all(numpy.diff(positions) == 1):
+        return slice(positions[0], positions[-1] + 1)
+    return positions
+
+
 class FeatureSelector(BaseEstimator, TransformerMixin):
-    """Custom category transformer that selects features.
+    """Custom category transformer that selects features. Column positions
+    are found once at fit; transform selects them with iloc, which is a
+    view of X when the features are next to each other (e.g. the feature
+    store) instead of a label lookup and copy on every call.
     """    
     # class constructor
     def __init__(self, feature_names):
-        self._feature_names = feature_names
-        self._variables = []
-    # return self
+        self.feature_names = feature_names
+    # models saved with the old attribute names
+    def __setstate__(self, state):
+        state.pop('_variables', None)
+        super().__setstate__(_rename_params(
+            state, [('feature_names', '_feature_names')]))
+    # positions of selected features in the columns of X
     def fit(self, X, y = None):
+        self.columns_ = X.columns
+        self.positions_ = _column_positions(X.columns, self.feature_names)
         return self
     # method to describe what transformer does
     def transform(self, X, y = None):
-        var_subset = []
-        for i in X.columns:
-            if i in self._feature_names:
-                var_subset.append(i)
-        # save variables selected
-        self._variables = var_subset
-        return X.loc[:, var_subset]
+        # positions from fit unless X has other columns (or the model was
+        # saved before positions were kept)
+        columns = getattr(self, 'columns_', None)
+        if columns is not None and X.columns.equals(columns):
+            positions = self.positions_
+        else:
+            positions = _column_positions(X.columns, self.feature_names)
+        return X.iloc[:, positions]
     
 
 class CategoricalTransformer(BaseEstimator, TransformerMixin):
-    """CategoricalTransformer: Selects catogrical variable and if it's numeric, 
-    it turns 0/1 values in to yes or no. If a string, it returns an array that will
-    be transformed later on using onehot encoding. 
+    """CategoricalTransformer: One hot encodes categorical variables (e.g.
+    gender, race, region, disease_category) in to an integer array. The
+    categories of each variable are learned at fit (sorted, missing left
+    out) and each value is mapped to its category position with a Pandas
+    index lookup, so no strings are created. Values not seen at fit and
+    missing values are all zero. Binary 0/1 variables in binary_vars give
+    one column that is 0 for 0 and 1 otherwise (the 'Yes' of the old
+    yes/no encoding).
+
+    binary_vars: list of 0/1 variables encoded as one column (column
+        positions if X is an array).
+    sparse: if True, returns a scipy CSR matrix instead of a dense array.
+    dtype: dtype of the output (e.g. numpy.uint8 or numpy.float32).
     """  
     # class constructor with empty list for 0 or 1 binary vars
-    def __init__(self, binary_vars=[]):
-        self._binary_vars = binary_vars
-    # no object fit; fit returns self
+    def __init__(self, binary_vars=[], sparse=False, dtype=numpy.uint8):
+        self.binary_vars = binary_vars
+        self.sparse = sparse
+        self.dtype = dtype
+    # models saved with the old attribute names
+    def __setstate__(self, state):
+        super().__setstate__(_rename_params(
+            state, [('binary_vars', '_binary_vars')]))
+    # column names and values of a dataframe or 2d array
+    def _columns(self, X):
+        if isinstance(X, pandas.DataFrame):
+            return [(name, X.iloc[:, j]) for j, name in enumerate(X.columns)]
+        X = numpy.asarray(X)
+        return [(j, X[:, j]) for j in range(X.shape[1])]
+    # learn categories of each variable
     def fit(self, X, y = None):
-        return self 
-    # create simple transformer of yes or no
-    def create_binary(self, obj):
-        if obj == 0:
-            return 'No'
-        else:
-            return 'Yes'
-    # more complicated codes later
+        self.columns_ = []
+        self.categories_ = []
+        for name, values in self._columns(X):
+            self.columns_.append(name)
+            if name in self.binary_vars:
+                # one indicator column; no categories to learn
+                self.categories_.append(None)
+            else:
+                self.categories_.append(
+                    pandas.Index(pandas.unique(pandas.Series(values)
+                                               .dropna())).sort_values())
+        return self
+    # names of the one hot columns (e.g. 'race_Asian')
+    def get_feature_names_out(self, input_features=None):
+        names = []
+        for name, categories in zip(self.columns_, self.categories_):
+            if categories is None:
+                names.append(str(name))
+            else:
+                names.extend(str(name) + '_' + str(c) for c in categories)
+        return numpy.array(names, dtype=object)
     def transform(self, X, y=None):
-        for i in X.columns:
-            if i in self._binary_vars:
-                X.loc[:, i] = X.loc[:, i].apply(self.create_binary)
-        else:
-            X.loc[:, i] = X.loc[:, i]
-        return X.values
+        columns = self._columns(X)
+        if [name for name, _ in columns] != self.columns_:
+            raise ValueError('CategoricalTransformer was fit on columns ' +
+                             str(self.columns_))
+        n_rows = len(columns[0][1]) if columns else 0
+        # (row, output column) of each 1 in the one hot block
+        rows, cols = [], []
+        offset = 0
+        for (name, values), categories in zip(columns, self.categories_):
+            if categories is None:
+                # 0 is 0; anything else (including missing) is 1
+                rows.append(numpy.flatnonzero(numpy.asarray(values) != 0))
+                cols.append(numpy.full(len(rows[-1]), offset))
+                offset += 1
+            else:
+                # category position; -1 for missing or unseen values
+                codes = categories.get_indexer(values)
+                hit = codes >= 0
+                rows.append(numpy.flatnonzero(hit))
+                cols.append(offset + codes[hit])
+                offset += len(categories)
+        rows = numpy.concatenate(rows) if rows else numpy.empty(0, int)
+        cols = numpy.concatenate(cols) if cols else numpy.empty(0, int)
+        if self.sparse:
+            return sparse.csr_matrix(
+                (numpy.ones(len(rows), dtype=self.dtype), (rows, cols)),
+                shape=(n_rows, offset))
+        X_out = numpy.zeros((n_rows, offset), dtype=self.dtype)
+        X_out[rows, cols] = 1
+        return X_out
     
     
 class OtherTransformer(BaseEstimator, TransformerMixin):
     """OtherTransformer: Selects variables that I don't want to go through 
-    the normalization/imputation pipeline or onehot pipeline
+    the normalization/imputation pipeline or onehot pipeline. Returns the
+    values of X as an array; a view when X has one dtype.
     """
-    # class constructor
+    # class constructor; no parameters
     def __init__(self):
-        self
+        pass
     # no object fit; fit returns self
     def fit(self, X, y = None):
         return self 
-    # more complicated codes later
+    # dataframe or array to array without copying columns
     def transform(self, X, y=None):
-        for i in X.columns:
-            X.loc[:, i] = X.loc[:, i]
-        return X.values
+        if isinstance(X, pandas.DataFrame):
+            return X.to_numpy()
+        return numpy.asarray(X)
 
 
 class PastMedianLabs(BaseEstimator, TransformerMixin):
     """PastMedianLabs: Function that imputes missing lab data by
-    calculating per patient past median lab values.
+    calculating per patient past median lab values over the last
+    window visits. See past_median.past_median_impute.
     """
     # class constructor with empty list of labs to impute
-    def __init__(self, lab_vars=[], variables=[]):
-        self._labs = lab_vars 
-        self._variables = variables
-        self._new_labs = []
+    def __init__(self, lab_vars=[], variables=[], window=20, n_jobs=1):
+        self.lab_vars = lab_vars
+        self.variables = variables
+        self.window = window
+        self.n_jobs = n_jobs
+    # models saved with the old attribute names
+    def __setstate__(self, state):
+        state.pop('_new_labs', None)
+        super().__setstate__(_rename_params(
+            state, [('lab_vars', '_labs'), ('variables', '_variables')]))
+        # models saved before window and n_jobs were parameters used a 20
+        # visit window on one core
+        self.__dict__.setdefault('window', 20)
+        self.__dict__.setdefault('n_jobs', 1)
     # no object fit; fit returns self
     def fit(self, X, y=None):
         return self
     def transform(self, X, y=None):
-        # turn index in to variable
-        X.reset_index(inplace = True)
-        if 'index' in X.columns:
-            print('Index set as column')
-            
         print(X.shape)
-        print('Sorting dataframe of both x and setting index as variable')
-        sorted_X = X.sort_values(by=['id', 'vis_date'])
         print('Starting past median imputation')
-        # imputing X based on median of past value if missing
-        labs_impute = (sorted_X.loc[:, ['index', 'id', 'vis_date'] + self._labs]
-                       .set_index(['vis_date', 'index'])
-                       .groupby('id')
-                       .rolling(window=20, min_periods=1)
-                       .median()
-                       .reset_index())
-        
-        print('Replacing missing values with past median imputation')
-        labs_impute.update(sorted_X.reset_index())
-        
-        print('Past median imputed')
-        # find lab completeness after imputation
-        lab_completeness = (labs_impute.groupby('id')
-                            .count()
-                            .apply(lambda x: numpy.where(x > 0, 1, 0))
-                            .sum()/labs_impute['id'].nunique())
+        # imputing X based on median of past value if missing; X is not
+        # modified and rows stay in the order of X
+        labs_impute, lab_completeness = past_median_impute(
+            X, self.lab_vars, window=self.window, n_jobs=self.n_jobs)
         
         print('Finding labs greater than 50%')
         # subset lab values
-        labs_to_keep = []
-        for k in dict(lab_completeness[lambda x: x > 0.50]):
-            if k not in ['vis_date', 'index']:
-                labs_to_keep.append(k)
+        labs_to_keep = list(lab_completeness[lambda x: x > 0.50].index)
         
-        print('Assigning labs that were kept as a new object list')
-        print(labs_to_keep)
-        self._new_labs = labs_to_keep
+        print('Labs kept:', len(labs_to_keep), 'of', len(self.lab_vars))
         
-        # keep other labs not in self._labs
+        # keep other labs not in self.lab_vars
         other_vars = []
-        for i in self._variables:
-            if i not in self._labs:
+        for i in self.variables:
+            if i not in self.lab_vars:
                 other_vars.append(i)
         print("Other vars", other_vars)
         
         print('Joining imputed lab values back in with dataframe')
-        # using concat so I don't duplicate rows
-        X_impute = pandas.merge(
-            X.loc[:, ['index'] + other_vars],
-            labs_impute.loc[:, ['index'] + labs_to_keep], 
-            how = 'left', on = 'index').set_index('index')
-        
-        # drop index column from X
-        if 'index' in X.columns:
-            del(X['index'])
-        # return new sorted imputed x and sorted y
+        # both frames share the index of X so columns line up by row
+        X_impute = pandas.concat(
+            [X.loc[:, other_vars], labs_impute.loc[:, labs_to_keep]], axis=1)
+        X_impute.index.name = 'index'
+        # return imputed x in the row order of x
         return X_impute
@@ -0,0 +1,138 @@
+"""
+Title: Benchmark of the feature selection transformers
+Date Created: 2026-10-18
+
+Purpose: Times FeatureSelector and FeatureSelector + OtherTransformer of
+analysis_functions/transformers.py against the previous versions, which
+looked up the selected columns by label on every transform and assigned
+each column to itself before returning X.values. The features are a
+random float32 frame laid out like the feature store (one block of
+columns); the mixed dtype case adds an integer column to the block.
+
+For each case the best time of the runs, the peak memory allocated by a
+transform (tracemalloc) and whether the output is a view of the input
+are printed. Outputs of the old and new transformers are checked to be
+equal.
+
+Run from the analysis folder:
+
+'python3 benchmark_transformers.py'
+
+Options:
+'--rows 1000000' number of rows of the feature frame.
+'--runs 5' number of timed runs of each transform.
+"""
+
+import argparse
+import timeit
+import tracemalloc
+
+import numpy
+import pandas
+
+from analysis_functions.transformers import FeatureSelector, OtherTransformer
+
+
+class OldFeatureSelector(FeatureSelector):
+    """OldFeatureSelector: FeatureSelector before column positions were
+    found at fit; selects the features by label on every transform.
+    """
+    def transform(self, X, y = None):
+        var_subset = []
+        for i in X.columns:
+            if i in self.feature_names:
+                var_subset.append(i)
+        return X.loc[:, var_subset]
+
+
+class OldOtherTransformer(OtherTransformer):
+    """OldOtherTransformer: OtherTransformer before the copy was removed;
+    assigns each column to itself and returns X.values.
+    """
+    def transform(self, X, y = None):
+        for i in X.columns:
+            X.loc[:, i] = X.loc[:, i]
+        return X.values
+
+
+def feature_frame(n_rows, n_cols=40, mixed=False, seed=0):
+    """feature_frame: Returns a frame of random float32 features in one
+    block, as loaded from the feature store; with mixed an int64 column
+    is added so the frame has two dtypes.
+    """
+    rng = numpy.random.default_rng(seed)
+    X = pandas.DataFrame(rng.random((n_rows, n_cols), dtype=numpy.float32),
+                         columns=['x' + str(j) for j in range(n_cols)])
+    if mixed:
+        X['visit_n'] = rng.integers(1, 50, n_rows)
+    return X
+
+
+def source_array(X, name):
+    """source_array: Returns the values of column name of X, used to check
+    if a transform output shares memory with X.
+    """
+    return X[name].to_numpy()
+
+
+def measure(transform, X, n_runs):
+    """measure: Returns tuple of best time in milliseconds, peak memory in
+    MB of one transform and its output.
+    """
+    times = timeit.repeat(lambda: transform(X), number=1, repeat=n_runs)
+    tracemalloc.start()
+    output = transform(X)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times)*1000, peak/2**20, output
+
+
+def compare(name, old, new, X, selected, n_runs):
+    """compare: Prints time, peak memory and view of the old and new
+    transforms of X and checks that their outputs are equal.
+
+    selected: list of the columns the transforms select.
+    """
+    old_ms, old_mb, old_out = measure(old, X, n_runs)
+    new_ms, new_mb, new_out = measure(new, X, n_runs)
+    numpy.testing.assert_array_equal(numpy.asarray(old_out),
+                                     numpy.asarray(new_out))
+    source = source_array(X, selected[0])
+    old_view = numpy.shares_memory(numpy.asarray(old_out), source)
+    new_view = numpy.shares_memory(numpy.asarray(new_out), source)
+    print('%-45s %8.1f ms %7.0f MB view %-5s -> %8.1f ms %7.0f MB view %s' %
+          (name, old_ms, old_mb, old_view, new_ms, new_mb, new_view))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark of the feature selection transformers.')
+    parser.add_argument('--rows', type=int, default=1000000,
+                        help='number of rows of the feature frame')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='number of timed runs of each transform')
+    args = parser.parse_args()
+
+    X = feature_frame(args.rows)
+    # 30 numeric features and 10 passed as is, as in the rf transform pipe
+    num_vars = list(X.columns[:30])
+    other_vars = list(X.columns[30:])
+    print('Feature frame:', X.shape, '; best of', args.runs, 'runs',
+          '(old -> new)')
+
+    old = OldFeatureSelector(num_vars).fit(X)
+    new = FeatureSelector(num_vars).fit(X)
+    compare('FeatureSelector (30 columns)',
+            old.transform, new.transform, X, num_vars, args.runs)
+
+    for label, frame, names in [
+            ('FeatureSelector + OtherTransformer (10)', X, other_vars),
+            ('same on a mixed dtype frame (11)',
+             feature_frame(args.rows, mixed=True), other_vars + ['visit_n'])]:
+        old = OldFeatureSelector(names).fit(frame)
+        new = FeatureSelector(names).fit(frame)
+        # selector then other transformer, as in the steps of a pipeline
+        compare(label,
+                lambda X: OldOtherTransformer().transform(old.transform(X)),
+                lambda X: OtherTransformer().transform(new.transform(X)),
+                frame, names, args.runs)
@@ -0,0 +1,102 @@
+"""
+Title: Flare risk scoring service
+Date Created: 2026-10-18
+
+Local HTTP service stub that scores single visits with the saved random
+forest. The pipeline is compiled once at start up (see
+analysis_functions/compiled_forest.py) so each request only imputes the
+visit's features and walks the flat tree arrays.
+
+Endpoints:
+GET  /columns  list of model features in model order
+POST /score    json object of feature name to value for one visit, or a
+               list of them; missing or null labs are imputed with the
+               training medians. Returns flare_pred_prob and bayes_prob
+               for each visit.
+
+Example from the scripts/analysis folder:
+
+'python3 flare_risk_service.py --port 8080'
+'curl -X POST localhost:8080/score -d @visit.json'
+"""
+
+import argparse
+import json
+import os
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from joblib import load
+
+from analysis_functions.compiled_forest import CompiledForest
+from analysis_functions.scoring import read_pop_prop
+
+# define project root directory based on project structure
+analysis_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(os.path.dirname(analysis_dir))
+
+
+class FlareRiskHandler(BaseHTTPRequestHandler):
+    """FlareRiskHandler: Handles requests with the compiled forest set on
+    the server (server.forest, server.pop_prop).
+    """
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == '/columns':
+            self._send_json(200, {'columns': self.server.forest.columns})
+        else:
+            self._send_json(404, {'error': 'unknown path ' + self.path})
+
+    def do_POST(self):
+        if self.path != '/score':
+            self._send_json(404, {'error': 'unknown path ' + self.path})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            visits = json.loads(self.rfile.read(length))
+            single = isinstance(visits, dict)
+            if single:
+                visits = [visits]
+            scores = [self.server.forest.score_visit(
+                          visit, pop_prop=self.server.pop_prop)
+                      for visit in visits]
+        except (ValueError, TypeError, AttributeError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        self._send_json(200, scores[0] if single else scores)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Local HTTP service scoring flare risk of visits.')
+    parser.add_argument('--model', default=root_dir + '/models/rf.joblib',
+                        help='saved joblib random forest pipeline')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='host to listen on')
+    parser.add_argument('--port', type=int, default=8080,
+                        help='port to listen on')
+    parser.add_argument('--pop-prop', type=float, default=None,
+                        help='proportion of flare in population for ' +
+                             'bayes corrected probability; defaults to ' +
+                             'the proportion of visits with flare in ' +
+                             'results/query_metrics/flare_events_summary.csv')
+    args = parser.parse_args()
+    if args.pop_prop is None:
+        args.pop_prop = read_pop_prop(root_dir)
+    print('Population proportion of flare:', round(args.pop_prop, 4))
+
+    print('Compiling model:', args.model)
+    server = HTTPServer((args.host, args.port), FlareRiskHandler)
+    server.forest = CompiledForest(load(args.model))
+    server.pop_prop = args.pop_prop
+    print('Serving flare risk on http://%s:%d' % (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,60 @@
+"""
+Title: Score visits with a saved model
+Date Created: 2026-10-18
+
+Scores a csv file of visits with a saved model pipeline without refitting
+the model. The file is read in chunks and scores are written as each chunk
+is scored, so memory use stays the same for any size of file.
+
+The visits file needs the model features from analysis_config.yaml;
+male_v_female is derived from gender if it is not in the file. Output has
+the id columns found in the file (id, vis_date), flare_pred_prob and
+bayes_prob. bayes_prob uses the proportion of visits with flare of the
+cohort (results/query_metrics/flare_events_summary.csv) unless --pop-prop
+is given.
+
+Example from the scripts/analysis folder:
+
+'python3 score_visits.py ../../data/raw/new_visits.csv ../../data/scores/new_visits_scores.csv'
+'python3 score_visits.py visits.csv scores.csv --model ../../models/logreg_regularization.joblib'
+"""
+
+import argparse
+import os
+import time
+
+from analysis_functions.scoring import score_file, read_pop_prop
+
+# define project root directory based on project structure
+analysis_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(os.path.dirname(analysis_dir))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Score a csv file of visits with a saved model.')
+    parser.add_argument('input_file', help='csv file of visits to score')
+    parser.add_argument('output_file', help='csv file to write scores')
+    parser.add_argument('--model', default=root_dir + '/models/rf.joblib',
+                        help='saved joblib model pipeline')
+    parser.add_argument('--chunk-size', type=int, default=50000,
+                        help='number of visits scored at a time')
+    parser.add_argument('--pop-prop', type=float, default=None,
+                        help='proportion of flare in population for ' +
+                             'bayes corrected probability; defaults to ' +
+                             'the proportion of visits with flare in ' +
+                             'results/query_metrics/flare_events_summary.csv')
+    args = parser.parse_args()
+    if args.pop_prop is None:
+        args.pop_prop = read_pop_prop(root_dir)
+    print('Population proportion of flare:', round(args.pop_prop, 4))
+
+    start_time = time.time()
+    n_scored = score_file(args.model,
+                          args.input_file,
+                          args.output_file,
+                          chunk_size=args.chunk_size,
+                          pop_prop=args.pop_prop)
+    print('Scored', n_scored, 'visits in %s seconds' %
+          round(time.time() - start_time, 1))
+    print('Scores saved here:', args.output_file)
@@ -5,28 +5,20 @@ Date Created: 2019-06-28
 
 This script will calculate table one statistics of interest
 """
-# load teradatasql to establish connection to teradata
-import teradatasql
 # load pandas
 import pandas as pd
 # os 
 # import os functions
 import os
+import sys
 import timeit
 
-# read hidden login info; not the best way to do this but it works
-login = [line.rstrip('\n') for line in open('../sql_query/login.txt')]
+# shared teradata session layer of the sql_query scripts
+sys.path.append('../sql_query')
+from query_functions.db_session import TeradataBackend
 
-# new connection info for teradatasql client
-usertd = login[2]
-passwordtd = login[3]
-host = login[4]
-
-# create connection to teradata
-con = teradatasql.connect('{"host": "' + host + '",' + \
-                          '"user": "' + usertd + '",' + \
-                          '"password": "' + passwordtd + '",' + \
-                          '"logmech":"LDAP"}')
+# create connection to teradata from the hidden login info
+con = TeradataBackend('../sql_query/login.txt').connect()
 
 # create cursor to submit scripts
 cur = con.cursor()
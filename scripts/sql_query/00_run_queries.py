@@ -0,0 +1,82 @@
+"""
+Title: Run queries
+Date Created: 2026-10-18
+
+Purpose: 00_run_queries.py builds every table of the query scripts 01 to 07
+in dependency order. The tables each sql template creates and reads are
+parsed from the templates in sql_templates/, so a stage runs after the
+stages that create the permanent tables it reads, and stages that do not
+depend on each other (e.g. labs, categorical labs, flares and fecal cal once
+the cohort exists) run at the same time, each on its own connection. The
+stages are declared in query_functions/query_stages.py.
+
+Run from the sql_query folder:
+
+'python3 00_run_queries.py'
+
+Options:
+'python3 00_run_queries.py --connections 2' uses at most 2 connections.
+'python3 00_run_queries.py labs analysis' only runs the labs and analysis
+    stages; the tables of other stages must already exist.
+'python3 00_run_queries.py --graph' prints the stage dependencies and exits.
+'python3 00_run_queries.py --duckdb local.duckdb' runs the stages against a
+    local duckdb file standing in for Teradata (see db_session.py).
+'python3 00_run_queries.py --refresh-batch "OPTUM EHR IBD 2019 Jul" labs'
+    adds the labs of a new batch to ibd_flare.labs_wide from the running
+    state in ibd_flare.lab_state instead of rebuilding every lab.
+"""
+
+import argparse
+import sys
+
+from query_functions.db_session import DuckDBBackend, TeradataBackend
+from query_functions.query_graph import run_stages, stage_dependencies
+from query_functions.query_stages import QUERY_STAGES, LABS, labs_stage
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run sql template stages in dependency order.')
+    parser.add_argument('stages', nargs='*',
+                        help='names of stages to run (default: all stages)')
+    parser.add_argument('--connections', type=int, default=4,
+                        help='number of connections and stages run at once')
+    parser.add_argument('--login', default='login.txt',
+                        help='hidden login file')
+    parser.add_argument('--duckdb', default=None,
+                        help='local duckdb file used in place of teradata')
+    parser.add_argument('--graph', action='store_true',
+                        help='print stage dependencies and exit')
+    parser.add_argument('--refresh-batch', default=None,
+                        help='batch_title of new labs added to the labs ' +
+                             'tables incrementally')
+    args = parser.parse_args()
+
+    stages = QUERY_STAGES
+    if args.refresh_batch is not None:
+        # swap the full labs build for the incremental refresh
+        refresh = labs_stage(args.refresh_batch)
+        stages = [refresh if stage is LABS else stage for stage in stages]
+
+    if args.graph:
+        deps = stage_dependencies(stages, './sql_templates/')
+        for stage in stages:
+            print(stage.name, '<-', ', '.join(sorted(deps[stage.name])))
+        sys.exit(0)
+
+    if args.duckdb is not None:
+        backend = DuckDBBackend(args.duckdb)
+    else:
+        backend = TeradataBackend(args.login)
+
+    status = run_stages(stages,
+                        backend,
+                        template_dir='./sql_templates/',
+                        n_connections=args.connections,
+                        only=args.stages or None)
+
+    print('\nSummary of stages')
+    for stage in stages:
+        print(stage.name, ':', status[stage.name])
+    if any(s in ('failed', 'blocked') for s in status.values()):
+        sys.exit(1)
@@ -0,0 +1,74 @@
+"""
+Title: Local build of longitudinal numeric lab features
+Date Created: 2026-10-18
+This script builds the labs_wide table (the _base, _mean, _max, _mean_acc
+and _max_acc columns of each lab) from a long labs extract without
+Teradata, using query_functions/lab_features.py. The extract holds one row
+per lab with ptid, test_name, result_date and test_result, already limited
+to the cohort (csv or parquet). Labs and variable names come from the
+lab_catalog.csv saved by the labs stage, or from the committed
+labs_extract.csv when no catalog has been saved.
+
+Run from the sql_query folder:
+
+'python3 03a_local_labs_features.py labs_long.parquet'
+
+Options:
+'--out labs_wide_local.parquet' file to save the wide table to.
+'--extract labs_extract.csv' labs extract the lab catalog is built from
+    when lab_catalog.csv has not been saved.
+'--reference labs_wide.csv' compares the local table to an export of
+    ibd_flare.labs_wide and prints the max difference of each column.
+--------------------------------------------------------------------------------
+"""
+
+import argparse
+import timeit
+
+import pandas as pd
+
+from query_functions.lab_features import build_labs_wide, compare_wide
+from query_functions.lab_catalog import LabCatalog
+
+
+def read_table(path):
+    """read_table: Reads a csv or parquet file."""
+    if path.endswith('.csv'):
+        return pd.read_csv(path)
+    return pd.read_parquet(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Build labs_wide from a long labs extract.')
+    parser.add_argument('labs', help='long labs extract (csv or parquet)')
+    parser.add_argument('--catalog',
+                        default='../../results/query_metrics/lab_catalog.csv',
+                        help='lab catalog saved by the labs stage')
+    parser.add_argument('--extract',
+                        default='../../results/query_metrics/labs_extract.csv',
+                        help='labs extract used when there is no catalog')
+    parser.add_argument('--out', default='../../data/labs_wide_local.parquet',
+                        help='parquet file to save the wide table to')
+    parser.add_argument('--reference', default=None,
+                        help='export of ibd_flare.labs_wide to compare to')
+    args = parser.parse_args()
+
+    labs_zip = LabCatalog.read_or_extract(args.catalog, args.extract).labs_zip
+    labs = read_table(args.labs)
+    labs.columns = labs.columns.str.lower()
+    print('Labs in extract:', len(labs))
+
+    start_time = timeit.default_timer()
+    labs_wide = build_labs_wide(labs, labs_zip)
+    print('Time to build labs_wide (seconds):',
+          timeit.default_timer() - start_time)
+    print('Shape of labs_wide:', labs_wide.shape)
+    labs_wide.to_parquet(args.out, index=False)
+    print('Saved', args.out)
+
+    if args.reference is not None:
+        comparison = compare_wide(labs_wide, read_table(args.reference))
+        print(comparison.to_string(index=False))
+
+    print("Script done running.")
@@ -0,0 +1,259 @@
+"""
+Title: Check the query stage graph
+Date Created: 2026-10-18
+
+Purpose: Checks the stage graph of query_functions/query_graph.py without
+the Optum database. The stand-in templates in check_templates/ build a
+small cohort, events, labs and analysis table on SQLite: a file database
+attached as ibd_flare holds the permanent tables and temp tables act as
+volatile tables, so each connection only sees its own temp tables as in
+Teradata. The checks cover the tables parsed from templates, the stage
+dependencies, volatile tables dropped after a stage, failed and blocked
+stages, independent stages running at the same time and the drop and
+retry path of a rerun.
+
+Run from the sql_query folder:
+
+'python3 check_query_graph.py'
+
+Exits with an AssertionError naming the failed check.
+"""
+
+import os
+import re
+import sqlite3
+import tempfile
+import time
+
+import pandas
+
+from query_functions.query_graph import SqlStage, parse_tables
+from query_functions.query_graph import stage_tables, stage_dependencies
+from query_functions.query_graph import run_stage, run_stages
+
+TEMPLATE_DIR = './check_templates/'
+
+
+class SQLiteBackend(object):
+    """SQLiteBackend: Opens SQLite connections on a source database with
+    the ibd_flare database attached; stands in for Teradata in the checks.
+
+    folder: folder of the source.db and ibd_flare.db files.
+    """
+    def __init__(self, folder):
+        self._source = os.path.join(folder, 'source.db')
+        self._ibd_flare = os.path.join(folder, 'ibd_flare.db')
+        self.n_connections = 0
+
+    def connect(self):
+        """connect: Returns a new connection usable from any thread."""
+        con = sqlite3.connect(self._source, timeout=30,
+                              check_same_thread=False)
+        con.execute("ATTACH DATABASE '" + self._ibd_flare + "' AS ibd_flare")
+        self.n_connections += 1
+        return con
+
+    def is_transient(self, error):
+        """is_transient: True if the database was locked by another
+        connection.
+        """
+        return 'locked' in str(error)
+
+    def is_table_exists(self, error):
+        """is_table_exists: True if error was raised because the table
+        created already exists.
+        """
+        return re.search(r'already exists', str(error)) is not None
+
+    def translate(self, sql):
+        """translate: Returns sql to submit; check templates are SQLite."""
+        return sql
+
+
+def seed_source(folder):
+    """seed_source: Writes the source tables read by the check templates:
+    three patients with diagnoses, two of them with events and labs.
+    """
+    con = sqlite3.connect(os.path.join(folder, 'source.db'))
+    pandas.DataFrame({'ptid': ['p1', 'p2', 'p3', 'p3'],
+                      'diag_date': ['2010-01-01', '2011-05-01',
+                                    '2012-03-01', '2012-01-01'],
+                      'diagnosis_cd': ['K50', 'K51', 'K51', 'J45']}) \
+        .to_sql('source_diagnosis', con, index=False)
+    pandas.DataFrame({'ptid': ['p1', 'p1', 'p2', 'p2', 'p4'],
+                      'event_date': ['2009-01-01', '2010-06-01',
+                                     '2011-06-01', '2012-06-01',
+                                     '2012-06-01']}) \
+        .to_sql('source_events', con, index=False)
+    pandas.DataFrame({'ptid': ['p1', 'p1', 'p2', 'p4'],
+                      'test_name': ['crp', 'wbc', 'crp', 'crp'],
+                      'test_result': [5.0, 7.5, 2.0, 9.0]}) \
+        .to_sql('source_labs', con, index=False)
+    con.close()
+
+
+def temp_tables(con):
+    """temp_tables: Returns set of temp tables of a connection."""
+    return set(row[0] for row in con.execute(
+        "SELECT name FROM temp.sqlite_master WHERE type = 'table'"))
+
+
+def timed(intervals, name):
+    """timed: Returns a params function recording when a stage started
+    and waiting long enough for another stage to start too.
+    """
+    def params(con):
+        start = time.time()
+        time.sleep(0.5)
+        intervals[name] = (start, time.time())
+        return {'labs': ['crp', 'wbc']}
+    return params
+
+
+def check_stages(intervals):
+    """check_stages: Returns the stand-in stages. broken fails on its
+    first template and after_broken reads the table broken would create.
+    """
+    return [
+        SqlStage('cohort', 'cohort', ['cohort_pos', 'ibd_flare.cohort']),
+        SqlStage('events', 'events', ['event_dates', 'ibd_flare.events'],
+                 params=timed(intervals, 'events')),
+        SqlStage('labs', 'labs', ['lab_values', 'ibd_flare.labs_wide'],
+                 params=timed(intervals, 'labs')),
+        SqlStage('analysis', 'analysis', ['ibd_flare.analysis']),
+        SqlStage('broken', 'broken', ['broken_tmp', 'ibd_flare.broken']),
+        SqlStage('after_broken', 'broken', ['ibd_flare.after_broken']),
+    ]
+
+
+def check_parse():
+    """check_parse: Tables created and read are parsed without comments;
+    temp and volatile tables are told apart from permanent tables.
+    """
+    with open(TEMPLATE_DIR + 'cohort/cohort_pos.sql') as f:
+        creates, volatile, reads = parse_tables(f.read())
+    assert creates == ['cohort_pos'], creates
+    assert volatile == {'cohort_pos'}, volatile
+    assert reads == {'source_diagnosis'}, reads
+
+    creates, volatile, reads = parse_tables(
+        'CREATE MULTISET VOLATILE TABLE a AS (SELECT * FROM b) WITH DATA; ' +
+        'CREATE TABLE ibd_flare.c AS (SELECT x FROM a JOIN ibd_flare.d ' +
+        'ON a.y = d.y WHERE EXTRACT(YEAR FROM x) > 2010) WITH DATA;')
+    assert creates == ['a', 'ibd_flare.c'], creates
+    assert volatile == {'a'}, volatile
+    assert reads == {'b', 'ibd_flare.d', 'x'}, reads
+
+
+def check_dependencies(stages):
+    """check_dependencies: Stages depend on the stages creating the
+    permanent tables they read; duplicates and cycles raise ValueError.
+    """
+    deps = stage_dependencies(stages, TEMPLATE_DIR)
+    assert deps == {'cohort': set(),
+                    'events': {'cohort'},
+                    'labs': {'cohort'},
+                    'analysis': {'events', 'labs'},
+                    'broken': {'cohort'},
+                    'after_broken': {'broken'}}, deps
+
+    duplicate = stages + [SqlStage('cohort_again', 'cohort',
+                                   ['ibd_flare.cohort'])]
+    try:
+        stage_dependencies(duplicate, TEMPLATE_DIR)
+        raise AssertionError('duplicate producer not raised')
+    except ValueError as e:
+        assert 'ibd_flare.cohort' in str(e), e
+
+    # cohort also reading the events built from it is a cycle
+    cycle = [SqlStage('a', 'cohort', ['cohort_pos', 'ibd_flare.cohort'],
+                      reads=['ibd_flare.events']),
+             SqlStage('b', 'events', ['event_dates', 'ibd_flare.events'])]
+    try:
+        stage_dependencies(cycle, TEMPLATE_DIR)
+        raise AssertionError('cycle not raised')
+    except ValueError as e:
+        assert 'cycle' in str(e), e
+
+
+def check_override():
+    """check_override: Declared permanent tables replace the parsed ones
+    and the parsed volatile tables are kept (and dropped after the stage).
+    """
+    stage = SqlStage('override', 'override', ['work_file'],
+                     creates={'work_file': ['ibd_flare.worked']})
+    tables = stage_tables(stage, TEMPLATE_DIR)
+    assert tables['volatile'] == {'work_a'}, tables
+    assert tables['creates'] == {'ibd_flare.worked'}, tables
+    assert tables['templates']['work_file'] == ['ibd_flare.worked',
+                                                'work_a'], tables
+    return stage
+
+
+def check_run(backend, stages, intervals):
+    """check_run: Stages run in dependency order, a failed stage blocks
+    the stages reading its tables and independent stages overlap.
+    """
+    status = run_stages(stages, backend, template_dir=TEMPLATE_DIR,
+                        n_connections=3)
+    assert status == {'cohort': 'ran', 'events': 'ran', 'labs': 'ran',
+                      'analysis': 'ran', 'broken': 'failed',
+                      'after_broken': 'blocked'}, status
+    assert backend.n_connections <= 3, backend.n_connections
+
+    # events and labs only depend on cohort, so they ran at the same time
+    (start_1, end_1), (start_2, end_2) = intervals['events'], intervals['labs']
+    assert start_1 < end_2 and start_2 < end_1, intervals
+
+    con = backend.connect()
+    analysis = pandas.read_sql_query(
+        'SELECT * FROM ibd_flare.analysis ORDER BY ptid', con)
+    con.close()
+    # p1 event before the first ibd date and p4 outside the cohort dropped
+    assert analysis['ptid'].tolist() == ['p1', 'p2'], analysis
+    assert analysis['n_events'].tolist() == [1, 2], analysis
+    assert analysis['crp'].tolist() == [5.0, 2.0], analysis
+
+
+def check_volatile_dropped(backend, stage):
+    """check_volatile_dropped: Temp tables of a stage are gone from its
+    connection after the stage, also when a template fails.
+    """
+    con = backend.connect()
+    run_stage(stage, con, backend, TEMPLATE_DIR)
+    assert temp_tables(con) == set(), temp_tables(con)
+
+    broken = SqlStage('broken', 'broken', ['broken_tmp'])
+    try:
+        run_stage(broken, con, backend, TEMPLATE_DIR)
+        raise AssertionError('broken stage did not raise')
+    except sqlite3.OperationalError:
+        pass
+    assert temp_tables(con) == set(), temp_tables(con)
+    con.close()
+
+
+def check_rerun(backend, stages):
+    """check_rerun: A rerun replaces the permanent tables that already
+    exist (drop and retry) instead of failing.
+    """
+    status = run_stages(stages, backend, template_dir=TEMPLATE_DIR,
+                        n_connections=2, only=['cohort', 'events'])
+    assert status['cohort'] == 'ran' and status['events'] == 'ran', status
+    assert status['labs'] == 'not selected', status
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as folder:
+        seed_source(folder)
+        backend = SQLiteBackend(folder)
+        intervals = {}
+        stages = check_stages(intervals)
+
+        check_parse()
+        check_dependencies(stages)
+        override = check_override()
+        check_run(backend, stages, intervals)
+        check_volatile_dropped(backend, override)
+        check_rerun(backend, stages)
+    print('\nAll query graph checks passed')
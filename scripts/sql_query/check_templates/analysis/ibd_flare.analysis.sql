@@ -0,0 +1,5 @@
+CREATE TABLE ibd_flare.analysis AS
+    SELECT a.ptid, a.n_events, b.crp, b.wbc
+    FROM ibd_flare.events AS a
+    LEFT JOIN ibd_flare.labs_wide AS b
+    ON a.ptid = b.ptid;
@@ -0,0 +1,4 @@
+/* reads a column that does not exist, so the stage fails */
+CREATE TEMP TABLE broken_tmp AS
+    SELECT ptid, no_such_column
+    FROM ibd_flare.cohort;
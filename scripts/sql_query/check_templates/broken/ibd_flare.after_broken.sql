@@ -0,0 +1,3 @@
+CREATE TABLE ibd_flare.after_broken AS
+    SELECT *
+    FROM ibd_flare.broken;
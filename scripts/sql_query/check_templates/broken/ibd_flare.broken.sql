@@ -0,0 +1,3 @@
+CREATE TABLE ibd_flare.broken AS
+    SELECT *
+    FROM broken_tmp;
@@ -0,0 +1,8 @@
+/* Stand-in for the cohort templates: patients with an ibd diagnosis.
+FROM not_a_table in a comment is not read */
+CREATE TEMP TABLE cohort_pos AS
+    SELECT ptid, MIN(diag_date) AS first_ibd_date
+    FROM source_diagnosis
+    -- JOIN also_not_a_table
+    WHERE diagnosis_cd LIKE 'K5%'
+    GROUP BY ptid;
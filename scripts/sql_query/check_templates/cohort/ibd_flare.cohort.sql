@@ -0,0 +1,3 @@
+CREATE TABLE ibd_flare.cohort AS
+    SELECT ptid, first_ibd_date
+    FROM cohort_pos;
@@ -0,0 +1,5 @@
+CREATE TEMP TABLE event_dates AS
+    SELECT a.ptid, a.event_date
+    FROM source_events AS a
+    INNER JOIN ibd_flare.cohort AS b
+    ON a.ptid = b.ptid AND a.event_date >= b.first_ibd_date;
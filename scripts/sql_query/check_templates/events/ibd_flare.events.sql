@@ -0,0 +1,4 @@
+CREATE TABLE ibd_flare.events AS
+    SELECT ptid, COUNT(*) AS n_events
+    FROM event_dates
+    GROUP BY ptid;
@@ -0,0 +1,3 @@
+CREATE TABLE ibd_flare.labs_wide AS
+    SELECT *
+    FROM lab_values;
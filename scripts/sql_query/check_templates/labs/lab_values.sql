@@ -0,0 +1,6 @@
+CREATE TEMP TABLE lab_values AS
+    SELECT a.ptid, {% for lab in labs %}{% if loop.first == False %}, {% endif %}MAX(CASE WHEN a.test_name = '{{ lab }}' THEN a.test_result END) AS {{ lab }}{% endfor %}
+    FROM source_labs AS a
+    INNER JOIN ibd_flare.cohort AS b
+    ON a.ptid = b.ptid
+    GROUP BY a.ptid;
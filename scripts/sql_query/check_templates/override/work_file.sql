@@ -0,0 +1,4 @@
+/* Stand-in for a working file that does not create its permanent table by
+name (see the flare stage): only volatile tables are parsed */
+CREATE TEMP TABLE work_a AS
+    SELECT ptid FROM ibd_flare.cohort;
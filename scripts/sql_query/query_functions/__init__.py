@@ -0,0 +1,11 @@
+"""
+__init__.py file
+
+Initializes modules used in custom utility functions for the sql queries.
+"""
+# define custom functions
+from query_functions import export
+from query_functions import query_graph
+from query_functions import query_stages
+from query_functions import lab_features
+from query_functions import lab_catalog
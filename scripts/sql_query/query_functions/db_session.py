@@ -0,0 +1,355 @@
+"""
+Database sessions for the query scripts
+
+Connections are opened through a backend object, so the query stage does
+not depend on how a connection is made:
+
+TeradataBackend reads the hidden login file once and opens teradatasql
+LDAP connections. DuckDBBackend opens sessions on a local duckdb file, with
+a light translation of Teradata table DDL, so the stage graph can run and
+be checked without the Optum database.
+
+ConnectionPool opens connections when first needed and hands them out to
+one user at a time. retry reruns a call after transient errors (deadlocks,
+busy sessions, dropped connections) with exponential backoff.
+execute_create submits a CREATE TABLE template and only replaces the table
+when the database reports that it already exists; any other error is
+raised, so a failed query is not silently dropped and rebuilt.
+"""
+
+import json
+import queue
+import re
+import threading
+import time
+
+
+class TeradataBackend(object):
+    """TeradataBackend: Opens teradatasql connections with LDAP login.
+
+    login_file: hidden login file with user, password and host on lines 3
+        to 5.
+    """
+    # error codes of transient failures worth retrying: transaction aborted
+    # due to deadlock, dispatcher timed out the transaction, concurrent
+    # change conflict on database and all virtual circuits in use
+    TRANSIENT_CODES = (2631, 3111, 3598, 8024)
+    # error code of creating a table that already exists
+    EXISTS_CODE = 3803
+
+    def __init__(self, login_file='login.txt'):
+        login = [line.rstrip('\n') for line in open(login_file)]
+        self._params = {'host': login[4],
+                        'user': login[2],
+                        'password': login[3],
+                        'logmech': 'LDAP'}
+
+    def connect(self):
+        """connect: Returns a new teradatasql connection."""
+        import teradatasql
+        return teradatasql.connect(json.dumps(self._params))
+
+    def error_code(self, error):
+        """error_code: Returns Teradata error code of an exception or None."""
+        code = re.search(r'\[Error (\d+)\]', str(error))
+        return int(code.group(1)) if code else None
+
+    def is_transient(self, error):
+        """is_transient: True if a query that raised error may succeed when
+        submitted again.
+        """
+        if self.error_code(error) in self.TRANSIENT_CODES:
+            return True
+        return re.search(r'socket|connection (reset|refused|closed)',
+                         str(error), re.IGNORECASE) is not None
+
+    def is_table_exists(self, error):
+        """is_table_exists: True if error was raised because the table
+        created already exists.
+        """
+        return self.error_code(error) == self.EXISTS_CODE
+
+    def translate(self, sql):
+        """translate: Returns sql to submit; templates are Teradata sql."""
+        return sql
+
+
+class _DuckDBCursor(object):
+    """_DuckDBCursor: Cursor sharing the session of its duckdb connection.
+    duckdb cursors are new sessions that can not see temporary tables, so
+    every cursor of a connection runs on the same session.
+    """
+    def __init__(self, con, backend):
+        self._con = con
+        self._backend = backend
+
+    def execute(self, sql, parameters=None):
+        sql = self._backend.translate(sql)
+        if parameters:
+            self._con.execute(sql, parameters)
+        else:
+            self._con.execute(sql)
+        return self
+
+    @property
+    def description(self):
+        return self._con.description
+
+    def fetchone(self):
+        return self._con.fetchone()
+
+    def fetchmany(self, size=1):
+        return self._con.fetchmany(size)
+
+    def fetchall(self):
+        return self._con.fetchall()
+
+    def close(self):
+        pass
+
+
+class _DuckDBConnection(object):
+    """_DuckDBConnection: DB-API connection of one duckdb session."""
+    def __init__(self, con, backend):
+        self._con = con
+        self._backend = backend
+
+    def cursor(self):
+        return _DuckDBCursor(self._con, self._backend)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self._con.close()
+
+
+# Teradata date format elements and their strptime codes
+DATE_FORMAT_CODES = [('YYYY', '%Y'), ('MM', '%m'), ('DD', '%d')]
+
+
+def _split_args(text):
+    """_split_args: Returns list of the comma separated arguments of a
+    function call, ignoring commas in brackets and quotes.
+    """
+    args, depth, quoted, start = [], 0, False, 0
+    for i, char in enumerate(text):
+        if char == "'":
+            quoted = not quoted
+        elif quoted:
+            continue
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            args.append(text[start:i])
+            start = i + 1
+    args.append(text[start:])
+    return args
+
+
+def _replace_calls(sql, name, rewrite):
+    """_replace_calls: Returns sql with every call of function name
+    replaced by rewrite(list of arguments); calls where rewrite returns
+    None are kept. Inner calls are rewritten before the calls holding them.
+
+    sql: sql text.
+    name: function name (e.g. 'CAST').
+    rewrite: function of the list of argument strings.
+    """
+    starts = [m for m in re.finditer(r'\b' + name + r'\s*\(', sql,
+                                     flags=re.IGNORECASE)]
+    for match in reversed(starts):
+        depth, quoted = 0, False
+        for end in range(match.end() - 1, len(sql)):
+            char = sql[end]
+            if char == "'":
+                quoted = not quoted
+            elif quoted:
+                continue
+            elif char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+                if depth == 0:
+                    break
+        new = rewrite(_split_args(sql[match.end():end]))
+        if new is not None:
+            sql = sql[:match.start()] + new + sql[end + 1:]
+    return sql
+
+
+def _cast_date_format(args):
+    """_cast_date_format: CAST(x AS DATE FORMAT 'fmt') as duckdb strptime
+    of x as text; other casts are kept.
+    """
+    cast = re.match(r"(.*)\sAS\s+DATE\s+FORMAT\s+'([^']*)'\s*$", args[0],
+                    flags=re.IGNORECASE | re.DOTALL)
+    if len(args) != 1 or cast is None:
+        return None
+    date_format = cast.group(2).upper()
+    for element, code in DATE_FORMAT_CODES:
+        date_format = date_format.replace(element, code)
+    return ('CAST(strptime(CAST(' + cast.group(1).strip() + " AS VARCHAR), '" +
+            date_format + "') AS DATE)")
+
+
+def _trunc_month(args):
+    """_trunc_month: TRUNC(date, 'RM') (first day of month) as duckdb
+    date_trunc; other TRUNC calls (e.g. of numbers) are kept.
+    """
+    if len(args) != 2 or args[1].strip().upper() not in ("'RM'", "'MM'",
+                                                         "'MON'"):
+        return None
+    return "CAST(date_trunc('month', " + args[0].strip() + ') AS DATE)'
+
+
+class DuckDBBackend(object):
+    """DuckDBBackend: Opens sessions on a local duckdb database standing in
+    for Teradata. Schemas (e.g. ibd_flare) are created if missing.
+
+    Volatile tables become temporary tables, 'WITH DATA', 'ON COMMIT
+    PRESERVE ROWS' and 'PRIMARY INDEX (...)' are removed and 'SELECT TOP n'
+    becomes 'LIMIT n'. The Teradata functions used by the templates are
+    rewritten: TRYCAST to TRY_CAST, CAST(x AS DATE FORMAT 'YYYYMM') to
+    strptime, TRUNC(date, 'RM') to date_trunc, STRTOK to split_part and
+    the NUMBER type to DOUBLE. Other Teradata sql is submitted as is, so
+    templates must otherwise stick to sql both databases accept.
+    seed_duckdb.py writes synthetic RWD_VDM_OPTUM_EHRIBD source tables.
+
+    database: path of duckdb file; every session shares it.
+    schemas: list of schemas to create.
+    """
+    def __init__(self, database, schemas=['ibd_flare']):
+        import duckdb
+        self._db = duckdb.connect(database)
+        for schema in schemas:
+            self._db.execute('CREATE SCHEMA IF NOT EXISTS ' + schema)
+        self._lock = threading.Lock()
+
+    def connect(self):
+        """connect: Returns a new session on the database."""
+        with self._lock:
+            return _DuckDBConnection(self._db.cursor(), self)
+
+    def is_transient(self, error):
+        """is_transient: True for write conflicts between sessions."""
+        return 'conflict' in str(error).lower()
+
+    def is_table_exists(self, error):
+        """is_table_exists: True if error was raised because the table
+        created already exists.
+        """
+        return re.search(r'already exists', str(error)) is not None
+
+    def translate(self, sql):
+        """translate: Returns Teradata table DDL and functions rewritten
+        for duckdb.
+        """
+        sql = re.sub(r'\bCREATE\s+(?:MULTISET\s+|SET\s+)?VOLATILE\s+' +
+                      r'(?:MULTISET\s+|SET\s+)?TABLE\b',
+                      'CREATE TEMPORARY TABLE', sql, flags=re.IGNORECASE)
+        sql = re.sub(r'\bWITH\s+DATA\b', '', sql, flags=re.IGNORECASE)
+        sql = re.sub(r'\bON\s+COMMIT\s+PRESERVE\s+ROWS\b', '', sql,
+                     flags=re.IGNORECASE)
+        sql = re.sub(r'\bPRIMARY\s+INDEX\s*\([^)]*\)', '', sql,
+                     flags=re.IGNORECASE)
+        sql = re.sub(r'\bTRYCAST\s*\(', 'TRY_CAST(', sql, flags=re.IGNORECASE)
+        sql = re.sub(r'\bSTRTOK\s*\(', 'split_part(', sql,
+                     flags=re.IGNORECASE)
+        sql = re.sub(r'\bAS\s+NUMBER\b', 'AS DOUBLE', sql, flags=re.IGNORECASE)
+        sql = _replace_calls(sql, 'CAST', _cast_date_format)
+        sql = _replace_calls(sql, 'TRUNC', _trunc_month)
+        # SELECT TOP n ... ; to SELECT ... LIMIT n;
+        top = re.match(r'\s*SELECT\s+TOP\s+(\d+)\s+(.*?)\s*;?\s*$', sql,
+                       flags=re.IGNORECASE | re.DOTALL)
+        if top:
+            sql = 'SELECT ' + top.group(2) + ' LIMIT ' + top.group(1)
+        return sql
+
+
+class ConnectionPool(object):
+    """ConnectionPool: Connections of a backend opened when first needed,
+    up to max_size, and reused. Each connection is used by one caller at
+    a time.
+
+    backend: backend object with a connect method.
+    max_size: maximum number of open connections.
+    """
+    def __init__(self, backend, max_size=4):
+        self._backend = backend
+        self._max_size = max_size
+        self._idle = queue.Queue()
+        self._opened = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        """get: Returns an idle connection, opening a new one if none is
+        idle and the pool is not full; otherwise waits for one.
+        """
+        with self._lock:
+            if self._idle.empty() and len(self._opened) < self._max_size:
+                con = retry(self._backend.connect, self._backend)
+                self._opened.append(con)
+                return con
+        return self._idle.get()
+
+    def put(self, con):
+        """put: Returns a connection to the pool."""
+        self._idle.put(con)
+
+    def close(self):
+        """close: Closes every connection opened by the pool."""
+        for con in self._opened:
+            try:
+                con.close()
+            except Exception:
+                pass
+        self._opened = []
+
+
+def retry(func, backend, attempts=3, backoff=30):
+    """retry: Returns func() and calls it again after transient errors,
+    waiting backoff, 2*backoff, ... seconds. Other errors, and the last
+    transient error, are raised.
+
+    func: function with no arguments.
+    backend: backend object that decides which errors are transient.
+    attempts: maximum number of calls.
+    backoff: seconds to wait after the first failure.
+    """
+    for attempt in range(attempts):
+        try:
+            return func()
+        except Exception as e:
+            if attempt == attempts - 1 or not backend.is_transient(e):
+                raise
+            wait = backoff * 2**attempt
+            print('Transient error; retrying in', wait, 'seconds:', e)
+            time.sleep(wait)
+
+
+def execute_create(cur, sql, tables, backend):
+    """execute_create: Submits a template that creates tables. If the
+    database reports that a table already exists, the tables are dropped
+    and the template is submitted again (create or replace). Transient
+    errors are retried; other errors are raised.
+
+    cur: database cursor.
+    sql: rendered sql.
+    tables: list of tables the template creates.
+    backend: backend object of the connection.
+    """
+    try:
+        retry(lambda: cur.execute(sql), backend)
+    except Exception as e:
+        if not tables or not backend.is_table_exists(e):
+            raise
+        print('Table already exists; replacing', ', '.join(tables))
+        for table in tables:
+            retry(lambda: cur.execute('DROP TABLE ' + table), backend)
+        retry(lambda: cur.execute(sql), backend)
@@ -0,0 +1,212 @@
+"""
+Streaming export of Teradata tables
+
+Analysis tables are read from Teradata in chunks with pandas
+read_sql_query. Each chunk is written as soon as it arrives: as one part
+file of a parquet dataset and appended to the csv used by the analysis
+scripts. Visits per patient are counted chunk by chunk, so the visit
+summary is computed without the full table and memory stays bounded by the
+chunk size (plus one count per patient). Column statistics (non missing
+count, completeness, min, max and mean) are gathered in the same pass and
+saved as a small csv next to the export, so summaries such as the 70%
+completeness rule of the lab selector read the statistics rather than the
+table.
+
+Part files are written with their own schema; a column that is all null in
+one chunk has null type in that part. The schema of all parts combined is
+saved in '_common_metadata' to pass when reading the dataset, e.g.
+pyarrow.dataset.dataset(path, schema=pyarrow.parquet.read_schema(
+path + '/_common_metadata')).
+"""
+
+import os
+import shutil
+
+import pandas
+import pyarrow
+import pyarrow.parquet as pq
+
+
+class VisitCounter(object):
+    """VisitCounter: Counts visits (non missing vis_date) of each patient
+    over chunks of a table.
+
+    id_var: name of patient id column.
+    date_var: name of visit date column.
+    """
+    def __init__(self, id_var='id', date_var='vis_date'):
+        self._id_var = id_var
+        self._date_var = date_var
+        self.counts = pandas.Series(dtype='int64')
+
+    def update(self, chunk):
+        """update: Adds the visits of one chunk to the counts."""
+        chunk_counts = chunk.groupby(self._id_var)[self._date_var].count()
+        self.counts = self.counts.add(chunk_counts, fill_value=0) \
+            .astype('int64')
+
+
+def visit_summary(counts, column='post_lab_exclusion'):
+    """visit_summary: Returns dataframe of number of patients, number of
+    visits and summary of visits per patient from counts of visits per
+    patient.
+
+    counts: Pandas series of number of visits of each patient.
+    column: name of the summary column.
+    """
+    # function to find quantile
+    def q1(x):
+        return x.quantile(0.25)
+    def q2(x):
+        return x.quantile(0.75)
+    return counts.rename('vis_date').to_frame() \
+        .agg({'vis_date': ['count', 'sum', 'mean', 'std',
+                           'median', q1, q2, 'min', 'max']}) \
+        .round(1) \
+        .rename(columns = {'vis_date': column},
+                index = {'count':'n_ptid', 'sum':'n_visits',
+                         'mean':'mean_vis', 'std':'std_vis',
+                         'median':'median_vis',
+                         'q1': 'perc_25',
+                         'q2': 'perc_75',
+                         'min':'min_vis',
+                         'max':'max_vis'})
+
+
+class ColumnStats(object):
+    """ColumnStats: Non missing count, min, max and sum of every column over
+    chunks of a table. Min, max and mean are only kept for numeric columns.
+    """
+    def __init__(self):
+        self.n_rows = 0
+        self.columns = []
+        self.non_null = pandas.Series(dtype='int64')
+        self.mins = pandas.Series(dtype='float64')
+        self.maxs = pandas.Series(dtype='float64')
+        self.sums = pandas.Series(dtype='float64')
+
+    def update(self, chunk):
+        """update: Adds the values of one chunk to the statistics."""
+        self.n_rows += chunk.shape[0]
+        self.columns += [c for c in chunk.columns if c not in self.columns]
+        self.non_null = self.non_null.add(chunk.notna().sum(), fill_value=0) \
+            .astype('int64')
+        numeric = chunk.select_dtypes('number')
+        self.sums = self.sums.add(numeric.sum(), fill_value=0)
+        self.mins = pandas.concat([self.mins, numeric.min()], axis=1).min(axis=1)
+        self.maxs = pandas.concat([self.maxs, numeric.max()], axis=1).max(axis=1)
+
+    def table(self):
+        """table: Returns dataframe indexed by column name with n_rows,
+        non_null, null_count, completeness, min, max and mean.
+        """
+        # statistics in column order of the table
+        stats = pandas.DataFrame({'n_rows': self.n_rows,
+                                  'non_null': self.non_null},
+                                 index=self.columns)
+        stats['null_count'] = stats['n_rows'] - stats['non_null']
+        stats['completeness'] = stats['non_null'] / max(self.n_rows, 1)
+        stats['min'] = self.mins
+        stats['max'] = self.maxs
+        # numeric columns that were all missing have no mean
+        stats['mean'] = self.sums / stats['non_null'].where(
+            stats['non_null'] > 0)
+        stats.index.name = 'variable'
+        return stats
+
+    def save(self, path):
+        """save: Writes the statistics table to a csv file."""
+        tmp_path = path + '.tmp'
+        self.table().to_csv(tmp_path)
+        os.replace(tmp_path, path)
+
+
+def column_stats_path(csv_path):
+    """column_stats_path: Returns path of the column statistics saved next
+    to an exported csv file (e.g. ibd_flare_analysis_column_stats.csv).
+    """
+    return os.path.splitext(csv_path)[0] + '_column_stats.csv'
+
+
+def read_column_stats(csv_path, chunksize=100000, dtype=None):
+    """read_column_stats: Returns the column statistics of an exported csv
+    file. Statistics saved by the export are read; if they are missing or
+    older than the csv (e.g. the csv was copied on its own) they are
+    computed by streaming the csv in chunks and saved.
+
+    csv_path: path to exported csv file.
+    chunksize: number of rows read at a time when computing statistics.
+    dtype: dictionary of column dtypes passed to pandas read_csv.
+    """
+    stats_path = column_stats_path(csv_path)
+    if not os.path.exists(stats_path) or \
+            os.path.getmtime(stats_path) < os.path.getmtime(csv_path):
+        print('Computing column statistics:', stats_path)
+        column_stats = ColumnStats()
+        for chunk in pandas.read_csv(csv_path, chunksize=chunksize,
+                                     dtype=dtype):
+            column_stats.update(chunk)
+        column_stats.save(stats_path)
+    return pandas.read_csv(stats_path, index_col='variable')
+
+
+def export_table(con, query, parquet_dir, csv_path=None, chunksize=100000,
+                 visit_counter=None, column_stats=None):
+    """export_table: Streams the result of a query to a parquet dataset
+    (one part file per chunk) and optionally a csv file. Returns the
+    number of rows and columns written.
+
+    con: database connection passed to pandas read_sql_query.
+    query: sql query to export (e.g. 'SELECT * FROM ibd_flare.analysis').
+    parquet_dir: folder of parquet part files to write.
+    csv_path: csv file to write; None skips the csv. Each chunk keeps the
+        index pandas gives it, as the csv written from the concatenated
+        chunks did.
+    chunksize: number of rows read and written at a time.
+    visit_counter: VisitCounter updated with every chunk; None skips it.
+    column_stats: ColumnStats updated with every chunk; None skips it.
+    """
+    # write to temp locations first so a killed run never leaves a partial
+    # export in place of the last complete one
+    tmp_dir = parquet_dir.rstrip('/') + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    tmp_csv = None if csv_path is None else csv_path + '.tmp'
+    csv_file = None if tmp_csv is None else open(tmp_csv, 'w', newline='')
+
+    n_rows = 0
+    n_cols = 0
+    schema = None
+    try:
+        for count, chunk in enumerate(
+                pandas.read_sql_query(query, con, chunksize=chunksize)):
+            print('Chunk', count + 1)
+            table = pyarrow.Table.from_pandas(chunk, preserve_index=False)
+            pq.write_table(table, os.path.join(
+                tmp_dir, 'part-%05d.parquet' % count))
+            # combined schema; null columns take the type of other parts
+            schema = table.schema if schema is None else \
+                pyarrow.unify_schemas([schema, table.schema],
+                                      promote_options='permissive')
+            if csv_file is not None:
+                chunk.to_csv(csv_file, header=(count == 0))
+            if visit_counter is not None:
+                visit_counter.update(chunk)
+            if column_stats is not None:
+                column_stats.update(chunk)
+            n_rows += chunk.shape[0]
+            n_cols = chunk.shape[1]
+    finally:
+        if csv_file is not None:
+            csv_file.close()
+
+    if schema is not None:
+        pq.write_metadata(schema.remove_metadata(),
+                          os.path.join(tmp_dir, '_common_metadata'))
+    if os.path.exists(parquet_dir):
+        shutil.rmtree(parquet_dir)
+    os.replace(tmp_dir, parquet_dir)
+    if tmp_csv is not None:
+        os.replace(tmp_csv, csv_path)
+    return n_rows, n_cols
@@ -0,0 +1,143 @@
+"""
+Catalog of the numeric labs
+
+One row per lab extracted by the labs stage: Optum test name, result
+unit, the variable name used in the sql templates (lab name and unit
+without special characters) and whether the lab is a white blood cell
+subset. Names are built once with vectorized string operations when the
+labs are found and saved to results/query_metrics/lab_catalog.csv. The
+labs templates (labs and labs_zip jinja variables), the local labs engine
+and the analysis config of 01_lab_selector.py all read the same catalog
+rather than deriving names again.
+
+Each lab gives five columns of ibd_flare.labs_wide, one per suffix
+(_base, _mean, _max, _mean_acc, _max_acc); the analysis config groups
+columns by suffix (labs_base, labs_mean, ...).
+"""
+
+import os
+
+import pandas
+
+# suffixes of the wide lab columns, in template order
+SUFFIXES = ['base', 'mean', 'max', 'mean_acc', 'max_acc']
+# white blood cell subsets are not used as features as wbc covers them
+WBC_SUBSETS = ['monocyte', 'lymphocyte', 'eosinophil', 'neutrophil',
+               'basophil']
+
+
+def lab_var_names(test_names, units):
+    """lab_var_names: Returns Pandas series of variable names: lab name in
+    lower case with spaces, dots and dashes as underscores and without the
+    part in brackets, followed by the unit without '/' and '^'; units with
+    '%' are left off. Double underscores become single.
+
+    test_names: Pandas series of Optum lab test names.
+    units: Pandas series of result units.
+    """
+    lab_name = (test_names.str.lower()
+                .str.replace(r'[ .\-]', '_', regex=True)
+                .str.split('(', n=1).str[0])
+    unit = units.str.replace(r'[/^]', '', regex=True)
+    with_unit = lab_name + '_' + unit
+    names = with_unit.where(~unit.str.contains('%', regex=False), lab_name)
+    return names.str.replace('__', '_', regex=False)
+
+
+class LabCatalog(object):
+    """LabCatalog: Registry of the numeric labs and their variable names.
+
+    labs: Pandas dataframe with test_name, result_unit, var_name and
+        wbc_subset columns; use from_extract or read to build one.
+    """
+    def __init__(self, labs):
+        self.labs = labs.reset_index(drop=True)
+
+    @classmethod
+    def from_extract(cls, labs_to_extract):
+        """from_extract: Returns catalog of the labs found by the
+        id_labs_of_interest template.
+
+        labs_to_extract: Pandas dataframe with TEST_NAME and RESULT_UNIT
+            columns.
+        """
+        test_names = labs_to_extract['TEST_NAME'].astype(str)
+        units = labs_to_extract['RESULT_UNIT'].astype(str)
+        var_names = lab_var_names(test_names, units)
+        wbc_subset = var_names.str.lower().str.contains('|'.join(WBC_SUBSETS))
+        return cls(pandas.DataFrame({'test_name': test_names.to_numpy(),
+                                     'result_unit': units.to_numpy(),
+                                     'var_name': var_names.to_numpy(),
+                                     'wbc_subset': wbc_subset.to_numpy()}))
+
+    @classmethod
+    def read(cls, path='../../results/query_metrics/lab_catalog.csv'):
+        """read: Returns catalog saved by save."""
+        return cls(pandas.read_csv(path, dtype={'test_name': str,
+                                                'result_unit': str,
+                                                'var_name': str,
+                                                'wbc_subset': bool}))
+
+    @classmethod
+    def read_or_extract(cls,
+                        path='../../results/query_metrics/lab_catalog.csv',
+                        extract_path=('../../results/query_metrics/' +
+                                      'labs_extract.csv')):
+        """read_or_extract: Returns catalog saved by save, or builds it from
+        the labs extracted table (labs_extract.csv) when the catalog has
+        not been saved, e.g. results from before the catalog existed.
+        """
+        if os.path.exists(path):
+            return cls.read(path)
+        print('No lab catalog at', path, '; building it from', extract_path)
+        return cls.from_extract(pandas.read_csv(extract_path, index_col=0))
+
+    def save(self, path='../../results/query_metrics/lab_catalog.csv'):
+        """save: Saves the catalog as csv."""
+        self.labs.to_csv(path, index=False)
+
+    @property
+    def labs_zip(self):
+        """labs_zip: List of tuples of test name and variable name used by
+        the labs templates.
+        """
+        return list(zip(self.labs['test_name'], self.labs['var_name']))
+
+    def params(self):
+        """params: Returns dictionary of jinja variables of the labs
+        templates ('labs' and 'labs_zip').
+        """
+        return {'labs': self.labs['test_name'].tolist(),
+                'labs_zip': self.labs_zip}
+
+    def columns(self):
+        """columns: Returns dataframe with one row per wide lab column:
+        column name as in the analysis table (lower case), var_name,
+        suffix, config group (e.g. 'labs_mean') and wbc_subset.
+        """
+        n_labs = len(self.labs)
+        suffixes = pandas.Series(SUFFIXES).repeat(n_labs).to_numpy()
+        labs = pandas.concat([self.labs] * len(SUFFIXES), ignore_index=True)
+        return pandas.DataFrame({
+            'column': (labs['var_name'].str.lower() + '_' + suffixes)
+                .to_numpy(),
+            'var_name': labs['var_name'].to_numpy(),
+            'suffix': suffixes,
+            'group': 'labs_' + suffixes,
+            'wbc_subset': labs['wbc_subset'].to_numpy()})
+
+    def config_labs(self, completeness, threshold=0.7):
+        """config_labs: Returns dictionary of config group (labs_base,
+        labs_mean, ...) to the sorted list of lab columns that are at least
+        threshold complete, without white blood cell subsets.
+
+        completeness: Pandas series of proportion of non missing values
+            indexed by column name.
+        threshold: minimum proportion complete.
+        """
+        columns = self.columns()
+        complete = columns['column'].map(completeness).fillna(0) >= threshold
+        keep = columns[complete & ~columns['wbc_subset']]
+        return {'labs_' + suffix:
+                    sorted(keep.loc[keep['suffix'] == suffix, 'column'])
+                for suffix in SUFFIXES}
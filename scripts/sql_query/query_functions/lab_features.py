@@ -0,0 +1,194 @@
+"""
+Local engine for the numeric lab features
+
+Builds the same rolling lab features and wide table as the
+longitudinal_labs and ibd_flare.labs_wide templates from a long labs
+extract (ptid, test_name, result_date, test_result), without Teradata.
+Features are grouped cumulative operations over labs sorted by patient,
+test and date, so new cohorts can be featurized locally and the result
+checked against the sql tables.
+
+Matches the sql windows: mean and max over the current and 1000 preceding
+labs of a patient and test, nulls ignored; acceleration is the change from
+the previous lab divided by the days since it, null for labs on the same
+day as the previous lab. As in sql, the order of labs of the same test on
+the same date is not defined; here they keep the order of the extract.
+"""
+
+import numpy
+import pandas
+
+# suffixes of the wide columns and the long column each one pivots
+WIDE_SUFFIXES = [('base', 'test_result'),
+                 ('mean', 'rolling_mean'),
+                 ('max', 'rolling_max'),
+                 ('mean_acc', 'rolling_mean_acc'),
+                 ('max_acc', 'rolling_max_acc')]
+
+
+def _group_starts(codes):
+    """_group_starts: Returns the position of the first row of the group of
+    each row of sorted group codes.
+    """
+    new_group = numpy.r_[True, codes[1:] != codes[:-1]]
+    return numpy.maximum.accumulate(numpy.where(new_group,
+                                                numpy.arange(len(codes)), 0))
+
+
+def rolling_mean(values, codes, starts, window=1000):
+    """rolling_mean: Returns mean of non missing values over each row and
+    up to window preceding rows of the same group; missing if all are.
+
+    values: numpy array of float values sorted by group.
+    codes: numpy array of group code of each row.
+    starts: numpy array of position of the first row of each row's group.
+    window: number of preceding rows in the window.
+    """
+    filled = pandas.Series(numpy.nan_to_num(values, nan=0.0))
+    counts = pandas.Series((~numpy.isnan(values)).astype('int64'))
+    sums = filled.groupby(codes).cumsum().to_numpy()
+    n = counts.groupby(codes).cumsum().to_numpy()
+    # remove the rows that fell out of the window
+    position = numpy.arange(len(values))
+    out = position - window - 1
+    drop = out >= starts
+    sums = sums - numpy.where(drop, sums[numpy.maximum(out, 0)], 0.0)
+    n = n - numpy.where(drop, n[numpy.maximum(out, 0)], 0)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return numpy.where(n > 0, sums / n, numpy.nan)
+
+
+def rolling_max(values, codes, starts, window=1000):
+    """rolling_max: Returns max of non missing values over each row and up
+    to window preceding rows of the same group; missing if all are.
+
+    values: numpy array of float values sorted by group.
+    codes: numpy array of group code of each row.
+    starts: numpy array of position of the first row of each row's group.
+    window: number of preceding rows in the window.
+    """
+    filled = pandas.Series(numpy.where(numpy.isnan(values), -numpy.inf,
+                                       values))
+    result = filled.groupby(codes).cummax().to_numpy()
+    # groups longer than the window; a cumulative max is exact otherwise
+    position = numpy.arange(len(values))
+    long_rows = position - starts > window
+    if long_rows.any():
+        long_groups = numpy.isin(codes, numpy.unique(codes[long_rows]))
+        windowed = filled[long_groups].groupby(codes[long_groups]) \
+            .rolling(window + 1, min_periods=1).max()
+        result = result.copy()
+        result[long_groups] = windowed.to_numpy()
+    return numpy.where(numpy.isinf(result) & (result < 0), numpy.nan, result)
+
+
+def longitudinal_labs(labs, window=1000):
+    """longitudinal_labs: Returns dataframe of labs sorted by ptid,
+    test_name and result_date with test_result as float and the columns
+    rolling_mean, rolling_max, acc_value, rolling_mean_acc and
+    rolling_max_acc of the longitudinal_labs template.
+
+    labs: Pandas dataframe with ptid, test_name, result_date and
+        test_result columns (extra columns are kept); labs without
+        result_date are dropped.
+    window: number of preceding labs in the rolling windows.
+    """
+    labs = labs[labs['result_date'].notna()].copy()
+    labs['result_date'] = pandas.to_datetime(labs['result_date'])
+    # TRYCAST: results that are not numbers are missing
+    labs['test_result'] = pandas.to_numeric(labs['test_result'],
+                                            errors='coerce').astype('float64')
+    labs = labs.sort_values(['ptid', 'test_name', 'result_date'],
+                            kind='stable').reset_index(drop=True)
+
+    codes = labs.groupby(['ptid', 'test_name'], sort=False).ngroup().to_numpy()
+    starts = _group_starts(codes)
+    first = starts == numpy.arange(len(labs))
+    values = labs['test_result'].to_numpy()
+    days = labs['result_date'].to_numpy().astype('datetime64[D]') \
+        .astype('int64')
+
+    labs['rolling_mean'] = rolling_mean(values, codes, starts, window)
+    labs['rolling_max'] = rolling_max(values, codes, starts, window)
+
+    # change since previous lab over days since previous lab
+    time_diff = numpy.r_[numpy.nan, numpy.diff(days)].astype('float64')
+    lag_value = numpy.r_[numpy.nan, values[:-1]]
+    time_diff[first] = numpy.nan
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        acc_value = numpy.where(time_diff != 0,
+                                (values - lag_value) / time_diff, numpy.nan)
+    labs['acc_value'] = acc_value
+    labs['rolling_mean_acc'] = rolling_mean(acc_value, codes, starts, window)
+    labs['rolling_max_acc'] = rolling_max(acc_value, codes, starts, window)
+    return labs
+
+
+def labs_wide(longitudinal, labs_zip):
+    """labs_wide: Returns dataframe with one row per ptid and visit_date and
+    the columns <var>_base, _mean, _max, _mean_acc and _max_acc of each
+    lab, taking the max of labs of the same test on the same date, as the
+    ibd_flare.labs_wide template.
+
+    longitudinal: Pandas dataframe returned by longitudinal_labs.
+    labs_zip: list of tuples of lab test name and variable name.
+    """
+    sources = [source for suffix, source in WIDE_SUFFIXES]
+    by_test = longitudinal.groupby(['ptid', 'result_date', 'test_name'],
+                                   sort=True)[sources].max()
+    wide = by_test.unstack('test_name')
+    columns = {}
+    for lab, var in labs_zip:
+        for suffix, source in WIDE_SUFFIXES:
+            if (source, lab) in wide.columns:
+                columns[var + '_' + suffix] = wide[(source, lab)].to_numpy()
+            else:
+                columns[var + '_' + suffix] = numpy.full(len(wide), numpy.nan)
+    index = wide.index.rename(['ptid', 'visit_date'])
+    return pandas.DataFrame(columns, index=index).reset_index()
+
+
+def build_labs_wide(labs, labs_zip, window=1000):
+    """build_labs_wide: Returns the labs_wide dataframe of a long labs
+    extract; labs not in labs_zip are dropped.
+
+    labs: Pandas dataframe with ptid, test_name, result_date and
+        test_result columns.
+    labs_zip: list of tuples of lab test name and variable name.
+    window: number of preceding labs in the rolling windows.
+    """
+    labs = labs[labs['test_name'].isin([lab for lab, var in labs_zip])]
+    return labs_wide(longitudinal_labs(labs, window), labs_zip)
+
+
+def compare_wide(local, reference, id_var='ptid', date_var='visit_date'):
+    """compare_wide: Returns dataframe with, for each shared feature column,
+    the max absolute difference between two labs_wide tables and the number
+    of rows missing in only one of them. Rows are matched on patient and
+    date.
+
+    local: Pandas dataframe built by build_labs_wide.
+    reference: Pandas dataframe of the ibd_flare.labs_wide table.
+    """
+    # teradata may return column names in another case
+    names = {column.lower(): column for column in local.columns}
+    reference = reference.rename(columns=lambda c: names.get(c.lower(), c))
+    reference[date_var] = pandas.to_datetime(reference[date_var])
+    merged = local.merge(reference, on=[id_var, date_var], how='outer',
+                         suffixes=('', '_reference'), indicator=True)
+    print('Rows only in local table:', (merged['_merge'] == 'left_only').sum())
+    print('Rows only in reference table:',
+          (merged['_merge'] == 'right_only').sum())
+    rows = []
+    for column in local.columns.drop([id_var, date_var]):
+        if column + '_reference' not in merged.columns:
+            continue
+        a = merged[column].to_numpy(dtype='float64')
+        b = merged[column + '_reference'].to_numpy(dtype='float64')
+        both = ~numpy.isnan(a) & ~numpy.isnan(b)
+        rows.append({'column': column,
+                     'max_abs_diff': numpy.abs(a[both] - b[both]).max()
+                                     if both.any() else 0.0,
+                     'missing_mismatch': int((numpy.isnan(a) !=
+                                              numpy.isnan(b)).sum())})
+    return pandas.DataFrame(rows)
@@ -0,0 +1,269 @@
+"""
+Dependency graph for the sql template stages
+
+Each query script runs an ordered list of sql templates on one connection.
+Those lists are declared as stages. The tables each template creates and
+reads are parsed from the template text, so a stage runs after every stage
+that creates a permanent table (e.g. ibd_flare.ibd_cohort) it reads.
+Stages that do not depend on each other (e.g. labs, cdiff and fecal_cal
+once the cohort exists) run at the same time over a pool of connections.
+
+Volatile (or temporary) tables only exist in the session that created
+them, so all templates of a stage run in order on the same connection and
+the volatile tables of a stage are dropped before its connection is handed
+to the next stage.
+
+Connections come from a backend (see db_session.py), so the same stages
+can run against a local duckdb database that stands in for Teradata.
+"""
+
+import os
+import re
+import timeit
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from jinja2 import Template
+
+from query_functions.db_session import ConnectionPool, execute_create
+
+# CREATE [MULTISET|SET] [VOLATILE|TEMPORARY] [MULTISET|SET] TABLE name
+CREATE_PATTERN = re.compile(
+    r'\bcreate\s+((?:(?:multiset|set|volatile|global\s+temporary|' +
+    r'temporary|temp)\s+)*)table\s+([\w.]+)', re.IGNORECASE)
+# table names after FROM or JOIN; names that are not tables (e.g. EXTRACT
+# (YEAR FROM date)) are dropped when the graph only keeps created tables
+READ_PATTERN = re.compile(r'\b(?:from|join)\s+([\w.]+)', re.IGNORECASE)
+
+
+class SqlStage(object):
+    """SqlStage: Ordered list of sql templates run on one connection.
+
+    name: short name of stage used in logs (e.g. 'ibd_cohort').
+    folder: sql_templates sub folder holding the templates.
+    templates: list of template names (file name without .sql) in the
+        order they run.
+    params: function(con) returning dictionary of jinja variables used to
+        render the templates; runs on the stage connection before the
+        first template.
+    after: function(con) run on the stage connection after the last
+        template (e.g. query metrics read from volatile tables).
+    creates: dictionary of template name to list of permanent tables it
+        creates; overrides the permanent tables parsed from the template
+        (its volatile tables are still parsed and dropped).
+    reads: list of tables read by params or after that are not read by
+        the templates.
+    message: description printed when the stage starts.
+    """
+    def __init__(self, name, folder, templates, params=None, after=None,
+                 creates=None, reads=None, message=''):
+        self.name = name
+        self.folder = folder
+        self.templates = templates
+        self.params = params
+        self.after = after
+        self.creates = creates or {}
+        self.reads = reads or []
+        self.message = message
+
+
+def parse_tables(sql):
+    """parse_tables: Returns tuple of (list of tables created, set of
+    volatile tables created, set of tables read) from sql text. Comments
+    are removed first; names are lower case.
+
+    sql: sql or jinja template text.
+    """
+    sql = re.sub(r'/\*.*?\*/', ' ', sql, flags=re.DOTALL)
+    sql = re.sub(r'\{#.*?#\}', ' ', sql, flags=re.DOTALL)
+    sql = re.sub(r'--[^\n]*', ' ', sql)
+    creates = []
+    volatile = set()
+    for modifiers, table in CREATE_PATTERN.findall(sql):
+        table = table.lower()
+        creates.append(table)
+        if re.search(r'volatile|temp', modifiers, re.IGNORECASE):
+            volatile.add(table)
+    reads = set(t.lower() for t in READ_PATTERN.findall(sql)) - set(creates)
+    return creates, volatile, reads
+
+
+def read_template(stage, template, template_dir):
+    """read_template: Returns the text of a template of a stage."""
+    with open(os.path.join(template_dir, stage.folder, template + '.sql')) as f:
+        return f.read()
+
+
+def stage_tables(stage, template_dir):
+    """stage_tables: Returns dictionary with the tables a stage creates
+    for each template ('templates'), its volatile tables ('volatile'), the
+    permanent tables it creates ('creates') and the tables it reads from
+    outside the stage ('reads').
+    """
+    templates = {}
+    volatile = set()
+    reads = set(t.lower() for t in stage.reads)
+    for template in stage.templates:
+        creates, template_volatile, template_reads = parse_tables(
+            read_template(stage, template, template_dir))
+        if template in stage.creates:
+            # declared permanent tables replace the parsed ones; volatile
+            # tables of the template are kept so they are still dropped
+            creates = ([t.lower() for t in stage.creates[template]] +
+                       [t for t in creates if t in template_volatile])
+        templates[template] = creates
+        volatile.update(template_volatile)
+        reads.update(template_reads)
+    created = set(t for creates in templates.values() for t in creates)
+    return {'templates': templates,
+            'volatile': volatile,
+            'creates': created - volatile,
+            'reads': reads - created}
+
+
+def stage_dependencies(stages, template_dir):
+    """stage_dependencies: Returns dictionary of stage name to the set of
+    stage names that create the permanent tables it reads. Raises
+    ValueError if two stages create the same permanent table or if the
+    stages contain a cycle.
+
+    stages: list of SqlStage objects.
+    template_dir: folder that holds the template sub folders.
+    """
+    tables = {stage.name: stage_tables(stage, template_dir) for stage in stages}
+    producers = {}
+    for stage in stages:
+        for table in tables[stage.name]['creates']:
+            if table in producers:
+                raise ValueError(table + ' is created by stages ' +
+                                 producers[table] + ' and ' + stage.name)
+            producers[table] = stage.name
+
+    deps = {stage.name: set(producers[t] for t in tables[stage.name]['reads']
+                            if t in producers and producers[t] != stage.name)
+            for stage in stages}
+
+    # check for cycles by removing stages with no remaining dependencies
+    remaining = {k: set(v) for k, v in deps.items()}
+    while remaining:
+        free = [k for k, v in remaining.items() if not v]
+        if not free:
+            raise ValueError('Stages contain a dependency cycle: ' +
+                             ', '.join(sorted(remaining)))
+        for k in free:
+            del remaining[k]
+        for v in remaining.values():
+            v.difference_update(free)
+    return deps
+
+
+def run_stage(stage, con, backend, template_dir):
+    """run_stage: Renders and runs the templates of a stage in order on one
+    connection, then runs its after function. Volatile tables of the stage
+    are dropped at the end so the connection can be reused.
+
+    stage: SqlStage object.
+    con: database connection.
+    backend: backend object of the connection (see db_session.py).
+    template_dir: folder that holds the template sub folders.
+    """
+    tables = stage_tables(stage, template_dir)
+    cur = con.cursor()
+    try:
+        params = stage.params(con) if stage.params is not None else {}
+        for template in stage.templates:
+            print(stage.name, ': running template', template)
+            start_time = timeit.default_timer()
+            sql = Template(read_template(stage, template, template_dir)) \
+                .render(**params)
+            execute_create(cur, sql, tables['templates'][template], backend)
+            print(stage.name, ':', template, 'time to run (minutes):',
+                  (timeit.default_timer() - start_time)/60)
+        if stage.after is not None:
+            stage.after(con)
+    finally:
+        # volatile tables live as long as the session; drop them so the next
+        # stage on this connection can create tables with the same names
+        for table in tables['volatile']:
+            try:
+                cur.execute('DROP TABLE ' + table)
+            except Exception:
+                pass
+
+
+def _run_pooled(stage, pool, backend, template_dir):
+    """_run_pooled: Runs a stage on a connection taken from the pool."""
+    con = pool.get()
+    try:
+        run_stage(stage, con, backend, template_dir)
+    finally:
+        pool.put(con)
+
+
+def run_stages(stages, backend, template_dir='./sql_templates/',
+               n_connections=4, only=None):
+    """run_stages: Runs sql stages in dependency order. Stages whose
+    dependencies are done run in parallel, one connection each, up to the
+    number of connections. Returns dictionary of stage name to status
+    ('ran', 'failed', 'blocked' or 'not selected').
+
+    stages: list of SqlStage objects.
+    backend: backend object opening connections (e.g. TeradataBackend).
+    template_dir: folder that holds the template sub folders.
+    n_connections: number of connections, and stages run at the same time.
+    only: list of stage names to run; other stages are treated as done.
+    """
+    deps = stage_dependencies(stages, template_dir)
+    status = {}
+    if only is not None:
+        for stage in stages:
+            if stage.name not in only:
+                status[stage.name] = 'not selected'
+
+    done = ('ran', 'not selected')
+    running = {}
+    pool = ConnectionPool(backend, n_connections)
+    try:
+        with ThreadPoolExecutor(max_workers=n_connections) as executor:
+            while len(status) < len(stages):
+                # mark stages downstream of a failure as blocked
+                for name, stage_deps in deps.items():
+                    if name in status or name in running.values():
+                        continue
+                    if any(status.get(d) in ('failed', 'blocked')
+                           for d in stage_deps):
+                        print('\n', name, ': blocked by failed dependency')
+                        status[name] = 'blocked'
+
+                # submit stages with all dependencies done
+                for stage in stages:
+                    if stage.name in status or stage.name in running.values():
+                        continue
+                    if not all(status.get(d) in done for d in deps[stage.name]):
+                        continue
+                    print('\n', stage.name, ':', stage.message)
+                    future = executor.submit(_run_pooled, stage, pool,
+                                             backend, template_dir)
+                    future.start_time = timeit.default_timer()
+                    running[future] = stage.name
+
+                if not running:
+                    continue
+
+                # wait for at least one running stage to finish
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    minutes = (timeit.default_timer() - future.start_time)/60
+                    if future.exception() is None:
+                        print('\n', name, ': finished in %.1f minutes' % minutes)
+                        status[name] = 'ran'
+                    else:
+                        print('\n', name, ': failed')
+                        traceback.print_exception(
+                            type(future.exception()), future.exception(),
+                            future.exception().__traceback__)
+                        status[name] = 'failed'
+    finally:
+        pool.close()
+    return status
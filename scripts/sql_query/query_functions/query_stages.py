@@ -0,0 +1,518 @@
+"""
+Sql template stages of the query scripts
+
+Each query script (01 to 07) runs one or two of the stages below. A stage
+holds the ordered list of templates the script used to loop over, the
+function that builds jinja variables (e.g. lab names) and the function that
+writes the query metrics read from the stage's volatile tables. The same
+stages are run together by 00_run_queries.py, which builds independent
+stages at the same time (see query_graph.py).
+
+Paths are relative to the sql_query folder that the scripts run from.
+"""
+
+import pandas
+
+from query_functions.query_graph import SqlStage
+from query_functions.lab_catalog import LabCatalog
+from query_functions.export import export_table, VisitCounter, ColumnStats
+from query_functions.export import column_stats_path
+from query_functions.export import visit_summary as summarize_visits
+
+# create lab list to search through; added fecal calprotecin
+# Note, there were no observations of calprotectin available in the April 2019
+# release. I will make a seperate query for these data.
+LABS_SEARCH_LIST = ['(WBC)', '(MCH)', '(MCHC)', '(MCV)', '(Na)', '(K)',
+                    'Glucose', '(BUN)', 'Creatinine', 'Calcium',
+                    'Bicarbonate', 'Chloride', 'Albumin', '(AST)', '(ALT)',
+                    '(CRP)', '(ALP)', 'Bilirubin.total', 'Platelet',
+                    'Neutrophil', 'Lymphocyte', 'Eosinophil', 'Basophil',
+                    'Monocyte', 'Calprotectin']
+
+# labs to exclude due to small number collected and based on feedback from
+# Diana
+LABS_EXCLUDE = ['Albumin.CSF', 'Creatinine clearance',
+                'Glucose.tolerance test.2 hour']
+
+# rows in the rolling lab windows of a full build: the current lab and the
+# 'ROWS 1000 PRECEDING' ones
+LAB_WINDOW_ROWS = 1001
+
+
+"""
+Cohort
+"""
+def cohort_metrics(con):
+    """cohort_metrics: Saves check and count of number of eligible subjects
+    and the attrition table. Out of the unique patients identified,
+    everyone is expected to have at least 1 outpatient visit, and the
+    minimum observed number of ibd_visits should be at least 2.
+    """
+    aggregate_cohort_metrics = pandas.read_sql_query(
+    """
+    SELECT COUNT(DISTINCT ptid) AS n_ptid,
+        SUM(outpatient_flag) AS one_or_more_outpatient,
+        SUM(inpatient_flag) AS one_or_more_inpatient,
+        MIN(ibd_visit_n) AS min_number_of_ibd_vis
+    FROM ibd_flare.ibd_cohort;
+    """, con)
+
+    print(aggregate_cohort_metrics)
+
+    # save aggregate cohort metrics
+    aggregate_cohort_metrics \
+        .to_csv("../../results/query_metrics/cohort_query_metrics.csv",
+                index = False)
+
+    #Step 1: Count of all patients in Optum IBD 2019 data cut
+    n_ptid = pandas.read_sql_query(
+    """
+    SELECT
+        COUNT(DISTINCT ptid) AS n_ptid
+    FROM RWD_VDM_OPTUM_EHRIBD.IBD_PATIENT
+    WHERE batch_title = 'OPTUM EHR IBD 2019 Apr';
+    """, con)
+
+    # add category column
+    n_ptid['Criteria'] = "All Patients in Optum"
+
+    # count of at least one ibd count between 2007-01-01 and 2018-12-30
+    n_one_ibd = pandas.read_sql_query(
+    """
+    SELECT
+        COUNT(DISTINCT ptid) AS n_ptid
+    FROM ibd_pos;
+    """, con)
+
+    n_one_ibd['Criteria'] = ('At least one inpatient or outpatient IBD ' +
+                             'diagnosis between 2007-01-01 to 2017-12-31')
+
+    # count at least two visits
+    n_two_ibd = pandas.read_sql_query(
+    """
+    SELECT COUNT(DISTINCT ptid) as n_ptid FROM two_ibd_visits;
+    """, con)
+
+    n_two_ibd['Criteria'] = ('At least two IBD diagnoses, with at least ' +
+                             'one office visit (outpatient)')
+
+    # 365 days after first ibd date
+    n_365 = pandas.read_sql_query(
+    """
+    SELECT COUNT(DISTINCT ptid) AS n_ptid FROM ibd_cont_enroll;
+    """, con)
+
+    n_365['Criteria'] = ('At least 365 days of follow up/activity in EHR ' +
+                         '(last active date - first IBD date)')
+
+    # over 18 ibd cohort
+    n_over18 = pandas.read_sql_query(
+    """
+    SELECT COUNT(DISTINCT ptid) AS n_ptid FROM ibd_flare.ibd_cohort;
+    """, con)
+
+    n_over18['Criteria'] = ('Over the age of 18 at the index IBD date ' +
+                            '(first date of IBD diagnosis)')
+
+    # create attrition table
+    attrition_tab = pandas.concat([n_ptid, n_one_ibd,
+                                   n_two_ibd, n_365,
+                                   n_over18])[['Criteria', 'n_ptid']]
+
+    # print attrition tab
+    print(attrition_tab)
+
+    # save attrition table
+    attrition_tab.to_csv('../../results/attrition_table.csv', index = False)
+
+
+"""
+Flares
+"""
+def steroid_daysup_missing(con):
+    """steroid_daysup_missing: Saves percent missing day supply as part of
+    sensitivity analyses to understand implications for our outpatient
+    flare definition.
+    """
+    day_supply_missing = pandas.read_sql_query(
+    """
+    SELECT day_supply_criteria,
+        COUNT(*) as n_obs,
+        COUNT(DISTINCT ptid) as n_ptid
+    FROM outpatient_oral_cortsteroid
+    GROUP BY day_supply_criteria;
+    """, con)
+
+    # precent obs with day supply
+    day_supply_missing['percent_n_obs'] = \
+        day_supply_missing['n_obs']*100.0/day_supply_missing['n_obs'].sum()
+    day_supply_missing['percent_n_ptid'] = \
+        day_supply_missing['n_ptid']*100.0/day_supply_missing['n_ptid'].sum()
+
+    print(day_supply_missing)
+    # write table
+    day_supply_missing.to_csv(
+        '../../results/query_metrics/steroid_daysup_missing.csv', index = False)
+
+
+"""
+Labs
+"""
+def find_labs(con, template_dir='./sql_templates/'):
+    """find_labs: Returns dataframe of labs in Waljee et al. 2017 with
+    valid values, defined as having a value within physiologically possible
+    range of results (Y) using the 'value_within_range' variable, without
+    the excluded labs.
+    """
+    from jinja2 import Template
+    # open query of lab counts
+    with open(template_dir + 'labs/id_labs_of_interest.sql') as f:
+        find_labs_template = f.read()
+    # build query using jinja2
+    find_query = Template(find_labs_template).render(labs=LABS_SEARCH_LIST)
+
+    print("Running query to find lab listed in Waljee et al with valid values")
+    labs_list = pandas.read_sql_query(find_query, con)
+    # subset to labs to extract from sql query
+    return labs_list[labs_list['TEST_NAME'].isin(LABS_EXCLUDE)==False]
+
+
+def numeric_lab_params(con):
+    """numeric_lab_params: Returns jinja variables of lab test names and
+    variable names (lab name and unit without special characters) for the
+    numeric labs templates and saves the labs extracted.
+    """
+    labs_to_extract = find_labs(con)
+    # save labs extracted to query metrics
+    print('Saving labs extracted table')
+    print(labs_to_extract)
+    labs_to_extract.to_csv('../../results/query_metrics/labs_extract.csv')
+    # variable names of the labs; saved for refreshes, the local labs engine
+    # and the analysis config
+    catalog = LabCatalog.from_extract(labs_to_extract)
+    catalog.save('../../results/query_metrics/lab_catalog.csv')
+    print('Lab catalog:')
+    print(catalog.labs)
+    return catalog.params()
+
+
+def saved_lab_params(con):
+    """saved_lab_params: Returns jinja variables of the labs in the catalog
+    saved by the last full labs build. A refresh updates the columns of the
+    existing ibd_flare.labs_wide, so it uses the same labs rather than
+    searching again.
+    """
+    return LabCatalog.read_or_extract(
+        '../../results/query_metrics/lab_catalog.csv',
+        '../../results/query_metrics/labs_extract.csv').params()
+
+
+def refresh_labs_metrics(con):
+    """refresh_labs_metrics: Prints the number of new lab rows of a refresh
+    and the number of rows skipped because they are dated on or before the
+    stored last date, and saves the skipped rows by lab test. A full build
+    is needed to add the skipped labs.
+
+    Also counts and saves the person and test pairs with more than
+    LAB_WINDOW_ROWS labs in ibd_flare.lab_state. The refresh continues the
+    rolling features over every stored lab while a full build only looks
+    at the last LAB_WINDOW_ROWS labs ('ROWS 1000 PRECEDING'), so the
+    features of these pairs no longer match a rebuild.
+    """
+    n_new = pandas.read_sql_query('SELECT COUNT(*) AS n FROM new_labs', con)
+    print('New lab rows added by refresh:', n_new.iloc[0, 0])
+
+    skipped = pandas.read_sql_query(
+    """
+    SELECT test_name, COUNT(*) AS n_obs, COUNT(DISTINCT ptid) AS n_ptid,
+        MIN(result_date) AS min_result_date, MAX(last_date) AS max_last_date
+    FROM skipped_labs
+    GROUP BY test_name;
+    """, con)
+    print('Lab rows skipped by refresh (dated on or before the stored last',
+          'date):', skipped['n_obs'].sum())
+    if len(skipped) > 0:
+        print(skipped)
+    skipped.to_csv('../../results/query_metrics/refresh_skipped_labs.csv',
+                   index = False)
+
+    exceeded = pandas.read_sql_query(
+    """
+    SELECT ptid, test_name, n_labs
+    FROM ibd_flare.lab_state
+    WHERE n_labs > {n_rows};
+    """.format(n_rows = LAB_WINDOW_ROWS), con)
+    exceeded.columns = exceeded.columns.str.lower()
+    print('Person and test pairs with more labs than the', LAB_WINDOW_ROWS,
+          'row window of a full build:', len(exceeded))
+    if len(exceeded) > 0:
+        print(exceeded.groupby('test_name')['ptid'].count()
+              .rename('n_ptid').reset_index())
+    # person level rows are saved with the data, not the results
+    exceeded.to_csv('../../data/refresh_window_exceeded.csv', index = False)
+
+
+def labs_stage(refresh_batch=None):
+    """labs_stage: Returns the numeric labs stage.
+
+    Without refresh_batch the longitudinal labs are built from every lab of
+    the cohort, and ibd_flare.lab_state stores the running count, sum, max
+    and last value and date of each person and test. With refresh_batch
+    (e.g. 'OPTUM EHR IBD 2019 Jul') only labs of that batch newer than the
+    stored last date are read; their rolling features are computed from
+    the state and merged into ibd_flare.labs_wide and ibd_flare.lab_state,
+    so a refresh costs the number of new rows rather than a full rebuild.
+    Labs of the batch dated on or before the stored last date are counted
+    in skipped_labs and saved by refresh_labs_metrics.
+
+    refresh_batch: batch_title of the labs to add or None for a full build.
+    """
+    if refresh_batch is None:
+        return SqlStage(
+            'labs', 'labs',
+            ['longitudinal_labs', 'ibd_flare.labs_wide',
+             'ibd_flare.lab_state'],
+            params=numeric_lab_params,
+            message='Building longitudinal numeric labs table')
+
+    def refresh_params(con):
+        params = saved_lab_params(con)
+        params['refresh_batch'] = refresh_batch
+        return params
+
+    return SqlStage(
+        'labs', 'labs',
+        ['new_labs', 'skipped_labs', 'longitudinal_labs_new',
+         'ibd_flare.labs_wide_refresh', 'ibd_flare.lab_state_refresh'],
+        params=refresh_params,
+        after=refresh_labs_metrics,
+        # MERGE updates the tables in place; they are declared as created
+        # so the stages reading labs_wide run after the refresh
+        creates={'ibd_flare.labs_wide_refresh': ['ibd_flare.labs_wide'],
+                 'ibd_flare.lab_state_refresh': ['ibd_flare.lab_state']},
+        message='Refreshing numeric labs with batch ' + refresh_batch)
+
+
+def categorical_lab_params(con):
+    """categorical_lab_params: Returns jinja variables of lab test names and
+    variable names for the categorical labs templates. Units are not needed
+    as the categorical variables are based on normal ranges relative to the
+    test observation.
+    """
+    labs_loop_list = find_labs(con)['TEST_NAME'].tolist()
+    var_name_list = [
+        i.lower()
+        # take first element before ()
+        .split('(')[0]
+        # strip trailing whitespace
+        .strip()
+        # replace spaces and other characters with _
+        .replace(' ', '_')
+        .replace('.', '_')
+        .replace('-', '_')
+        for i in labs_loop_list
+    ]
+    print('List of labs to extract:', labs_loop_list)
+    print('List of names to give lab variables:', var_name_list)
+    return {'labs': labs_loop_list,
+            'labs_zip': list(zip(labs_loop_list, var_name_list))}
+
+
+"""
+Visits
+"""
+def visit_obs(con):
+    """visit_obs: Saves number of visit type encounters and unique
+    persons.
+    """
+    visit_obs = pandas.read_sql_query(
+    """
+    SELECT interaction_type, SUM(n_enc), COUNT(visit_date), COUNT(DISTINCT ptid),
+        COUNT(visit_date)*1.0/COUNT(DISTINCT ptid) AS avg_visit_n
+    FROM
+        (
+         SELECT ptid, interaction_type, interaction_date AS visit_date,
+         COUNT(*) AS n_enc
+         FROM physical_encounters
+         GROUP BY ptid, interaction_date, interaction_type
+        ) AS temp
+    GROUP BY interaction_type;
+    """, con)
+
+    print(visit_obs)
+    # write table
+    visit_obs.to_csv('../../results/query_metrics/visit_obs.csv', index = False)
+
+
+"""
+Analysis tables
+"""
+def wide_lab_names(table):
+    """wide_lab_names: Returns function(con) that returns the jinja
+    variables of the analysis templates: names of lab variables in a wide
+    labs table (columns after ptid and date).
+    """
+    def params(con):
+        print('Reading in ' + table + ' table to extract names of labs.')
+        return {'labs': list(pandas.read_sql_query(
+            'SELECT TOP 1 * FROM ' + table + ';', con).columns)[2:]}
+    return params
+
+
+def export_analysis(con):
+    """export_analysis: Streams ibd_flare.analysis to the csv file and
+    parquet dataset used by the analysis scripts and saves the visit
+    summary and the column statistics next to the csv.
+    """
+    # stream chunks of 100000 rows to parquet part files and the csv file
+    # and count visits per patient chunk by chunk
+    visit_counter = VisitCounter(id_var='id', date_var='vis_date')
+    # completeness, min, max and mean of every column from the same pass
+    column_stats = ColumnStats()
+    write_path = '../../data/ibd_flare_analysis.csv'
+    parquet_path = '../../data/ibd_flare_analysis/'
+    n_rows, n_cols = export_table(con,
+                                  'SELECT * FROM ibd_flare.analysis',
+                                  parquet_dir=parquet_path,
+                                  csv_path=write_path,
+                                  chunksize=100000,
+                                  visit_counter=visit_counter,
+                                  column_stats=column_stats)
+    print('Finished writing labs of size:', (n_rows, n_cols))
+    column_stats.save(column_stats_path(write_path))
+
+    # find how many visits there are left
+    visit_summary = summarize_visits(visit_counter.counts)
+    # print number of visits per sumbect after visit
+    print(visit_summary)
+    # write summary
+    visit_summary.to_csv('../../results/query_metrics/visit_summary.csv')
+    print('Dataset saved to paths: ' + write_path + ', ' + parquet_path)
+
+
+def export_analysis_cat_labs(con):
+    """export_analysis_cat_labs: Streams ibd_flare.analysis_cat_labs to a
+    csv file and parquet dataset.
+    """
+    write_path = '../../data/ibd_flare_analysis_cat_labs.csv'
+    parquet_path = '../../data/ibd_flare_analysis_cat_labs/'
+    n_rows, n_cols = export_table(con,
+                                  'SELECT * FROM ibd_flare.analysis_cat_labs',
+                                  parquet_dir=parquet_path,
+                                  csv_path=write_path,
+                                  chunksize=100000)
+    print('Finished writing labs of size:', (n_rows, n_cols))
+    print('Dataset saved to paths: ' + write_path + ', ' + parquet_path)
+
+
+"""
+Miscellaneous
+"""
+def cdiff_statistics(con):
+    """cdiff_statistics: Saves how many outpatient corticosteroid events
+    may be misclassified due to a c-diff diagnosis +/- 7 days.
+    """
+    cdiff_statistics = pandas.read_sql_query(
+    """
+    SELECT COUNT(*) AS cortsteroid_count,
+        COUNT(cdiff_flag) AS cdiff_count,
+        cdiff_count*100.0/cortsteroid_count AS prop_cdiff
+    FROM
+        (
+        SELECT a.*,
+            b.diag_date AS cdiff_date,
+            b.cdiff_flag
+        FROM ibd_flare.analysis AS a
+        LEFT JOIN ibd_flare.cdiff AS b
+        ON (a.ptid = b.ptid) AND
+            (a.flare_date >= b.diag_date - 7 AND a.flare_date <= b.diag_date + 7)
+        WHERE a.flare_cat = 'outpat_corticosteroid_flare'
+        ) AS temp;
+    """, con)
+
+    # save to results folder
+    with open("../../results/cdiff_stats.txt", "w") as f:
+        print('Outpatient corticosteroid events with possible C-Diff ' +
+              'misclassification\n\n', cdiff_statistics, file=f)
+
+
+def fecal_cal_export(con):
+    """fecal_cal_export: Saves fecal calprotectin labs and counts of
+    observations and unique patients.
+    """
+    # sql table to pandas
+    fecal_cal = pandas.read_sql_query('SELECT * FROM ibd_flare.fecal_cal', con)
+    # set columns to lower
+    fecal_cal.columns = map(str.lower, fecal_cal.columns)
+
+    # summary statistics on fecal cal on count of observations and unique patients
+    fecal_cal_count = fecal_cal.agg({'ptid': ['count', 'nunique']})
+    print(fecal_cal_count)
+
+    # save to dataframe in results folder
+    fecal_cal_count.to_csv('../../results/manuscript/fecal_cal_count.csv')
+    # write to data folder
+    fecal_cal.to_csv('../../data/fecal_cal.csv')
+
+
+"""
+Stages
+"""
+IBD_COHORT = SqlStage(
+    'ibd_cohort', 'ibd_cohort',
+    ['ibd_enc_count', 'ibd_enc_date', 'ibd_pos', 'ibd_visit',
+     'two_ibd_visits', 'ibd_cont_enroll', 'ibd_cohort'],
+    after=cohort_metrics,
+    message='Building IBD cohort and attrition table')
+
+FLARE = SqlStage(
+    'flare', 'flare',
+    ['ibd_enc_count', 'ibd_enc_date', 'ibd_pos', 'inpat_flare',
+     'outpatient_oral_cortsteroid', 'cortsteroid_no_comorb',
+     'ibd_flare.flares'],
+    after=steroid_daysup_missing,
+    message='Building flare outcomes')
+
+LABS = labs_stage()
+
+CATEGORICAL_LABS = SqlStage(
+    'categorical_labs', 'labs',
+    ['categorical_labs', 'ibd_flare.categorical_labs_wide'],
+    params=categorical_lab_params,
+    message='Building categorical labs table')
+
+VISITS = SqlStage(
+    'visits', 'visits',
+    ['physical_encounters', 'visits', 'previous_flare_sum', 'flare_visits'],
+    after=visit_obs,
+    message='Joining flare events to visits')
+
+ANALYSIS = SqlStage(
+    'analysis', 'analysis',
+    ['immuno_med_date_window', 'flare_predictors', 'ibd_flare.analysis'],
+    params=wide_lab_names('ibd_flare.labs_wide'),
+    after=export_analysis,
+    message='Building and exporting numeric labs analysis table')
+
+ANALYSIS_CAT_LABS = SqlStage(
+    'analysis_cat_labs', 'analysis',
+    ['immuno_med_date_window', 'flare_predictors_cat',
+     'ibd_flare.analysis_cat_labs'],
+    params=wide_lab_names('ibd_flare.categorical_labs_wide'),
+    after=export_analysis_cat_labs,
+    message='Building and exporting categorical labs analysis table')
+
+CDIFF = SqlStage(
+    'cdiff', 'cdiff', ['ibd_flare.cdiff'],
+    after=cdiff_statistics,
+    reads=['ibd_flare.analysis'],
+    message='Building c-diff diagnoses table')
+
+FECAL_CAL = SqlStage(
+    'fecal_cal', 'fecal_cal', ['ibd_flare.fecal_cal'],
+    after=fecal_cal_export,
+    message='Building fecal calprotectin table')
+
+# every stage of the query scripts
+QUERY_STAGES = [IBD_COHORT, FLARE, LABS, CATEGORICAL_LABS, VISITS,
+                ANALYSIS, ANALYSIS_CAT_LABS, CDIFF, FECAL_CAL]
@@ -0,0 +1,293 @@
+"""
+Title: Seed a local duckdb database
+Date Created: 2026-10-18
+
+Purpose: Writes synthetic RWD_VDM_OPTUM_EHRIBD source tables (patients,
+encounters, diagnoses, labs, prescriptions and medication administrations)
+to a duckdb file, so the query stages can run locally with
+'00_run_queries.py --duckdb' without the Optum database. Columns are named
+and typed as the templates read them (upper case names as returned by
+Teradata, birth year and months active as text). The values are random and
+only meant to exercise the templates; they are not a sample of the cohort.
+
+Besides the 'OPTUM EHR IBD 2019 Apr' batch used by the templates, labs of a
+later batch ('OPTUM EHR IBD 2019 Jul', with some dated before the last lab
+of the Apr batch) exercise '--refresh-batch', and calprotectin labs of the
+'OPTUM EHR IBD 2019 Oct Update 2' batch the fecal calprotectin stage.
+
+Run from the sql_query folder:
+
+'python3 seed_duckdb.py local.duckdb'
+'python3 00_run_queries.py --duckdb local.duckdb'
+'python3 00_run_queries.py --duckdb local.duckdb --refresh-batch "OPTUM EHR IBD 2019 Jul" labs'
+
+The stage metrics and exports are written to results/ and data/ as in a
+Teradata run, so run them on a copy of the repository to keep the saved
+results.
+"""
+
+import argparse
+
+import numpy
+import pandas
+
+BATCH = 'OPTUM EHR IBD 2019 Apr'
+REFRESH_BATCH = 'OPTUM EHR IBD 2019 Jul'
+FECAL_CAL_BATCH = 'OPTUM EHR IBD 2019 Oct Update 2'
+
+INTERACTION_TYPES = ['Office or clinic patient', 'Office or clinic patient',
+                     'Ambulatory patient services', 'Urgent care',
+                     'Inpatient', 'Emergency patient', 'Observation patient',
+                     'Letter / Email']
+
+# test name, test type, unit, normal range, mean and sd of results
+LABS = [('C-reactive protein (CRP)', 'CHEMISTRY', 'mg/l', '0-10', 8, 6),
+        ('White blood cell count (WBC)', 'HEMATOLOGY', 'x10^3/ul',
+         '4.5-11', 7.5, 2.5),
+        ('Albumin', 'CHEMISTRY', 'g/dl', '3.5-5.5', 4.0, 0.5),
+        ('Platelet count (PLT)', 'HEMATOLOGY', 'x10^3/ul', '150-400',
+         280, 70),
+        ('Sodium (Na)', 'CHEMISTRY', 'mmol/l', '135-145', 139, 3),
+        ('Glucose.random', 'CHEMISTRY', 'mg/dl', '70-140', 105, 25),
+        ('Monocyte.percent', 'HEMATOLOGY', '%', '2-8', 6, 2)]
+
+# steroids and immunosuppressive medications of the flare and analysis
+# templates; MEDROL prescriptions are excluded by the flare definition
+PRESCRIPTIONS = [('PREDNISONE 20 MG TAB', 'prednisone'),
+                 ('BUDESONIDE 3 MG CAP', 'budesonide'),
+                 ('MEDROL 4 MG DOSEPACK', 'methylprednisolone'),
+                 ('AZATHIOPRINE 50 MG TAB', 'AZATHIOPRINE'),
+                 ('MERCAPTOPURINE 50 MG TAB', 'MERCAPTOPURINE')]
+
+
+def random_dates(rng, start, end, size):
+    """random_dates: Returns array of random dates between start and end."""
+    start, end = numpy.datetime64(start), numpy.datetime64(end)
+    days = rng.integers(0, (end - start).astype(int), size=size)
+    return start + days.astype('timedelta64[D]')
+
+
+def make_patients(rng, n_patients):
+    """make_patients: Returns dataframe of IBD_PATIENT rows."""
+    ptid = numpy.array(['PT%06d' % i for i in range(n_patients)])
+    deceased = rng.random(n_patients) < 0.05
+    death_month = pandas.Series(random_dates(rng, '2012-01-01', '2019-01-01',
+                                             n_patients)).dt.strftime('%Y%m')
+    return pandas.DataFrame({
+        'PTID': ptid,
+        'BIRTH_YR': rng.integers(1935, 2000, n_patients).astype(str),
+        'GENDER': rng.choice(['Female', 'Male', 'Unknown'], n_patients,
+                             p=[0.52, 0.46, 0.02]),
+        'RACE': rng.choice(['Caucasian', 'African American', 'Asian',
+                            'Other/Unknown'], n_patients),
+        'ETHNICITY': rng.choice(['Not Hispanic', 'Hispanic', 'Unknown'],
+                                n_patients),
+        'REGION': rng.choice(['Northeast', 'Midwest', 'South', 'West'],
+                             n_patients),
+        'DIVISION': rng.choice(['East North Central', 'Pacific',
+                                'South Atlantic'], n_patients),
+        'AVG_HH_INCOME': rng.choice(['$50000-$74999', '$75000-$99999'],
+                                    n_patients),
+        'PCT_COLLEGE_EDUC': rng.choice(['25-50%', '50-75%'], n_patients),
+        'DECEASED_INDICATOR': deceased.astype(int),
+        'DATE_OF_DEATH': death_month.where(deceased, None),
+        'PROVID_PCP': rng.integers(1000, 9999, n_patients).astype(str),
+        'FIRST_MONTH_ACTIVE': rng.choice(['200601', '200701', '200801'],
+                                         n_patients),
+        'LAST_MONTH_ACTIVE': rng.choice(['201812', '201906'], n_patients),
+        'BATCH_TITLE': BATCH})
+
+
+def make_encounters(rng, patients, visits_per_patient):
+    """make_encounters: Returns dataframe of IBD_ENCOUNTER rows, at least
+    two per patient.
+    """
+    n_visits = rng.poisson(visits_per_patient, len(patients)) + 2
+    ptid = numpy.repeat(patients['PTID'].to_numpy(), n_visits)
+    n = len(ptid)
+    return pandas.DataFrame({
+        'PTID': ptid,
+        'VISITID': ['V%08d' % i for i in range(n)],
+        'ENCID': ['E%08d' % i for i in range(n)],
+        'INTERACTION_TYPE': rng.choice(INTERACTION_TYPES, n),
+        'INTERACTION_DATE': random_dates(rng, '2007-06-01', '2017-12-01', n),
+        'ACADEMIC_COMMUNITY_FLAG': rng.choice(['Academic', 'Community'], n),
+        'BATCH_TITLE': BATCH})
+
+
+def make_diagnoses(rng, patients, encounters):
+    """make_diagnoses: Returns dataframe of IBD_DIAGNOSIS rows: a Crohn's
+    disease or ulcerative colitis diagnosis (both for some patients) on most
+    encounters, and some comorbidity (asthma) and c-diff diagnoses.
+    """
+    subtype = pandas.Series(rng.choice(['cd', 'uc', 'ic'], len(patients),
+                                       p=[0.45, 0.45, 0.1]),
+                            index=patients['PTID'])
+    enc = encounters[rng.random(len(encounters)) < 0.85].reset_index(drop=True)
+    n = len(enc)
+    enc_subtype = subtype.loc[enc['PTID']].to_numpy()
+    # indeterminate colitis patients get both codes
+    is_cd = numpy.where(enc_subtype == 'ic', rng.random(n) < 0.5,
+                        enc_subtype == 'cd')
+    icd10 = rng.random(n) < 0.6
+    code = numpy.where(is_cd,
+                       numpy.where(icd10, 'K5090', '5559'),
+                       numpy.where(icd10, 'K5190', '5569'))
+    ibd = pandas.DataFrame({'PTID': enc['PTID'], 'ENCID': enc['ENCID'],
+                            'DIAG_DATE': enc['INTERACTION_DATE'],
+                            'DIAGNOSIS_CD_TYPE': numpy.where(icd10, 'ICD10',
+                                                             'ICD9'),
+                            'DIAGNOSIS_CD': code,
+                            'DESCRIPTION': numpy.where(is_cd,
+                                                       "Crohn's disease",
+                                                       'Ulcerative colitis')})
+    other = encounters.sample(frac=0.1, random_state=1)
+    other_code = rng.choice(['J45909', 'A047'], len(other))
+    other = pandas.DataFrame({'PTID': other['PTID'], 'ENCID': other['ENCID'],
+                              'DIAG_DATE': other['INTERACTION_DATE'],
+                              'DIAGNOSIS_CD_TYPE': 'ICD10',
+                              'DIAGNOSIS_CD': other_code,
+                              'DESCRIPTION': numpy.where(
+                                  other_code == 'A047', 'C. difficile',
+                                  'Asthma')})
+    diagnoses = pandas.concat([ibd, other], ignore_index=True)
+    diagnoses['DIAGNOSIS_STATUS'] = rng.choice(
+        ['Diagnosis of', 'Diagnosis of', 'History of'], len(diagnoses))
+    diagnoses['BATCH_TITLE'] = BATCH
+    return diagnoses
+
+
+def make_labs(rng, encounters, batch, frac, date_shift=0):
+    """make_labs: Returns dataframe of IBD_LABS rows for a random part of
+    the encounters, one row per lab measured.
+
+    date_shift: days added to the encounter date of each lab.
+    """
+    enc = encounters.sample(frac=frac, random_state=rng.integers(1e6))
+    rows = []
+    for test_name, test_type, unit, normal_range, mean, sd in LABS:
+        measured = enc[rng.random(len(enc)) < 0.7]
+        result = numpy.abs(rng.normal(mean, sd, len(measured))).round(1)
+        rows.append(pandas.DataFrame({
+            'PTID': measured['PTID'], 'ENCID': measured['ENCID'],
+            'TEST_NAME': test_name, 'TEST_TYPE': test_type,
+            'ORDER_DATE': measured['INTERACTION_DATE'],
+            'COLLECTED_DATE': measured['INTERACTION_DATE'],
+            'RESULT_DATE': (measured['INTERACTION_DATE'] +
+                            pandas.Timedelta(days=date_shift)),
+            'TEST_RESULT': result.astype(str),
+            'RELATIVE_INDICATOR': None, 'RESULT_UNIT': unit,
+            'NORMAL_RANGE': normal_range, 'EVALUATED_FOR_RANGE': 'Y',
+            'VALUE_WITHIN_RANGE': numpy.where(rng.random(len(measured)) < 0.97,
+                                              'Y', 'N'),
+            'BATCH_TITLE': batch}))
+    return pandas.concat(rows, ignore_index=True)
+
+
+def make_fecal_cal(rng, encounters):
+    """make_fecal_cal: Returns dataframe of calprotectin IBD_LABS rows."""
+    enc = encounters.sample(frac=0.05, random_state=2)
+    return pandas.DataFrame({
+        'PTID': enc['PTID'], 'ENCID': enc['ENCID'],
+        'TEST_NAME': 'Calprotectin.stool', 'TEST_TYPE': 'CHEMISTRY',
+        'ORDER_DATE': enc['INTERACTION_DATE'],
+        'COLLECTED_DATE': enc['INTERACTION_DATE'],
+        'RESULT_DATE': enc['INTERACTION_DATE'],
+        'TEST_RESULT': rng.gamma(2, 100, len(enc)).round(0).astype(str),
+        'RELATIVE_INDICATOR': None, 'RESULT_UNIT': 'ug/g',
+        'NORMAL_RANGE': '0-50', 'EVALUATED_FOR_RANGE': 'Y',
+        'VALUE_WITHIN_RANGE': 'Y', 'BATCH_TITLE': FECAL_CAL_BATCH})
+
+
+def make_prescriptions(rng, encounters):
+    """make_prescriptions: Returns dataframe of IBD_PRESCRIPTIONS rows on a
+    random part of the encounters.
+    """
+    enc = encounters.sample(frac=0.25, random_state=3)
+    n = len(enc)
+    drug = rng.integers(0, len(PRESCRIPTIONS), n)
+    return pandas.DataFrame({
+        'PTID': enc['PTID'], 'RXDATE': enc['INTERACTION_DATE'],
+        'DRUG_NAME': [PRESCRIPTIONS[i][0] for i in drug],
+        'NDC': rng.integers(1e9, 1e10, n).astype(str),
+        'NDC_SOURCE': 'NDC', 'ROUTE': numpy.where(rng.random(n) < 0.9,
+                                                  'Oral', 'Topical'),
+        'QUANTITY_PER_FILL': rng.integers(10, 60, n).astype(str),
+        'NUM_REFILLS': rng.integers(0, 3, n),
+        # missing day supply is common in the EHR
+        'DAYS_SUPPLY': pandas.Series(
+            numpy.where(rng.random(n) < 0.3, numpy.nan,
+                        rng.integers(3, 30, n)),
+            index=enc.index).astype('Int64'),
+        'GENERIC_DESC': [PRESCRIPTIONS[i][1] for i in drug],
+        'DRUG_CLASS': 'CORTICOSTEROIDS', 'BATCH_TITLE': BATCH})
+
+
+def make_administrations(rng, encounters):
+    """make_administrations: Returns dataframe of IBD_MED_ADMINISTRATIONS
+    rows of biologics given at a random part of the encounters.
+    """
+    enc = encounters.sample(frac=0.03, random_state=4)
+    return pandas.DataFrame({
+        'PTID': enc['PTID'], 'ADMIN_DATE': enc['INTERACTION_DATE'],
+        'GENERIC_DESC': rng.choice(['ADALIMUMAB', 'CERTOLIZUMAB'], len(enc)),
+        'BATCH_TITLE': BATCH})
+
+
+def seed(con, n_patients=300, visits_per_patient=12, seed=0):
+    """seed: Creates the RWD_VDM_OPTUM_EHRIBD schema and writes the
+    synthetic source tables, replacing tables that already exist.
+
+    con: duckdb connection.
+    n_patients: number of patients.
+    visits_per_patient: mean number of encounters per patient.
+    seed: seed of the random values.
+    """
+    rng = numpy.random.default_rng(seed)
+    patients = make_patients(rng, n_patients)
+    encounters = make_encounters(rng, patients, visits_per_patient)
+    # the refresh batch has labs of later encounters and some late labs of
+    # encounters before the last stored lab
+    later = encounters.sample(frac=0.15, random_state=5)
+    tables = {
+        'IBD_PATIENT': patients,
+        'IBD_ENCOUNTER': encounters,
+        'IBD_DIAGNOSIS': make_diagnoses(rng, patients, encounters),
+        'IBD_LABS': pandas.concat(
+            [make_labs(rng, encounters, BATCH, 0.6),
+             make_labs(rng, later, REFRESH_BATCH, 1.0, date_shift=400),
+             make_labs(rng, later, REFRESH_BATCH, 0.2),
+             make_fecal_cal(rng, encounters)], ignore_index=True),
+        'IBD_PRESCRIPTIONS': make_prescriptions(rng, encounters),
+        'IBD_MED_ADMINISTRATIONS': make_administrations(rng, encounters)}
+
+    con.execute('CREATE SCHEMA IF NOT EXISTS RWD_VDM_OPTUM_EHRIBD')
+    for name, df in tables.items():
+        # dates are written as dates, not timestamps, as in the VDM
+        for col in df.columns:
+            if pandas.api.types.is_datetime64_any_dtype(df[col]):
+                df[col] = df[col].dt.date
+        con.register('seed_df', df)
+        con.execute('CREATE OR REPLACE TABLE RWD_VDM_OPTUM_EHRIBD.' + name +
+                    ' AS SELECT * FROM seed_df')
+        con.unregister('seed_df')
+        print('RWD_VDM_OPTUM_EHRIBD.' + name, ':', len(df), 'rows')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Write synthetic Optum source tables to a duckdb file.')
+    parser.add_argument('database', help='duckdb file to write')
+    parser.add_argument('--patients', type=int, default=300,
+                        help='number of patients')
+    parser.add_argument('--visits', type=int, default=12,
+                        help='mean number of encounters per patient')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the random values')
+    args = parser.parse_args()
+
+    import duckdb
+    con = duckdb.connect(args.database)
+    seed(con, n_patients=args.patients, visits_per_patient=args.visits,
+         seed=args.seed)
+    con.close()
@@ -31,7 +31,7 @@ CREATE VOLATILE TABLE flare_predictors AS
                 THEN YEAR (vis_date) - '1929' 
                 WHEN (d.birth_yr LIKE '%Unknown%')
                 THEN NULL 
-                ELSE YEAR (vis_date) - d.birth_yr END age,
+                ELSE YEAR (vis_date) - CAST(d.birth_yr AS FLOAT) END age,
             CASE WHEN uc_count > 0 AND cd_count = 0 
             	THEN 'ulcerative colitis' 
             	WHEN cd_count > 0 AND uc_count = 0 
@@ -22,7 +22,7 @@ CREATE VOLATILE TABLE flare_visit_demo AS
                 THEN YEAR(visit_date) - '1929' 
                 WHEN (birth_yr LIKE '%Unknown%')
                 THEN NULL 
-                ELSE YEAR(visit_date) - birth_yr END age
+                ELSE YEAR(visit_date) - CAST(birth_yr AS FLOAT) END age
         FROM ibd_flare.flare_visits AS a
         LEFT JOIN ibd_flare.ibd_cohort AS b
         ON a.ptid = b.ptid
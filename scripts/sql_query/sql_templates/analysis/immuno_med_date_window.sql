@@ -31,8 +31,8 @@ CREATE VOLATILE TABLE immuno_med_date_window AS
             ) AS a
         INNER JOIN ibd_flare.ibd_cohort AS b
         ON a.ptid = b.ptid  
-        GROUP BY a.ptid
         WHERE a.immuno_med_date IS NOT NULL
+        GROUP BY a.ptid
         ) 
  WITH DATA 
  ON COMMIT PRESERVE ROWS;  
\ No newline at end of file
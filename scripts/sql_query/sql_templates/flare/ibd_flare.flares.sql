@@ -0,0 +1,23 @@
+/* Creates permanent table of inpatient/ER and outpatient corticosteroid flare
+ events with columns to categorize flares and the criteria met or not met
+ (i.e. day supply) for the sensitivity analyses */
+CREATE TABLE ibd_flare.flares AS
+    (
+    -- inpatient or ER flares meet both flare definitions
+    SELECT ptid, visit_date AS flare_date, 1 AS inpat_flare,
+        interaction_type, 0 AS steroid_flare,
+        CAST(NULL AS VARCHAR(3)) AS day_supply_criteria, flare_cat,
+        1 AS flare_v1, 1 AS flare_v2
+    FROM inpat_flare
+    UNION ALL
+    -- outpatient corticosteroids only meet the stricter definition with
+    -- a 7 day supply
+    SELECT ptid, rxdate AS flare_date, 0 AS inpat_flare,
+        CAST(NULL AS VARCHAR(50)) AS interaction_type, 1 AS steroid_flare,
+        day_supply_criteria, flare_cat,
+        CASE WHEN day_supply_criteria = 'yes'
+            THEN 1 ELSE 0 END flare_v1,
+        1 AS flare_v2
+    FROM cortsteroid_no_comorb
+    )
+WITH DATA;
@@ -12,7 +12,7 @@ CREATE TABLE ibd_flare.ibd_cohort AS
                 THEN index_year - '1929'
             WHEN (birth_yr LIKE '%Unknown%')
                 THEN 9999
-            ELSE index_year - birth_yr END age_at_index
+            ELSE index_year - CAST(birth_yr AS FLOAT) END age_at_index
     -- relaxed cohort criteria to drop criteria for incident IBD visit
     FROM ibd_cont_enroll
     WHERE age_at_index >= 18 AND age_at_index <> 9999
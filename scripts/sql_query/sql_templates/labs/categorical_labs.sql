@@ -44,10 +44,10 @@ CREATE VOLATILE TABLE categorical_labs AS
 			first_ibd_date,
 			test_name,
 			result_date, 
-			COUNT(test_result) AS n_tests,
+			COUNT(num_result) AS n_tests,
 			-- aggregated on test result date and lab
 			-- take the highest lab result
-			MAX(test_result) AS test_result, 
+			MAX(num_result) AS test_result, 
 			MAX(normal_range) AS normal_range,
 			MAX(test_abnormal) AS test_abnormal,
 			MAX(test_ordinal) AS test_ordinal                
@@ -58,7 +58,9 @@ CREATE VOLATILE TABLE categorical_labs AS
 				a.encid, 
 				a.test_name, 
 				a.result_date,
-				TRYCAST(a.test_result AS NUMBER) AS test_result, 
+				-- named apart from the source column so the comparisons below
+				-- use the number
+				TRYCAST(a.test_result AS NUMBER) AS num_result, 
 				a.normal_range, 
 				-- try to convert the string element from split to number
 				TRYCAST(
@@ -80,17 +82,17 @@ CREATE VOLATILE TABLE categorical_labs AS
 					ELSE num_val_2 
 					END max_range,
 				-- class to indicate if lab value is abnormal (does not distinguish low or high)
-				CASE WHEN (test_result >= min_range AND test_result <= max_range)
+				CASE WHEN (num_result >= min_range AND num_result <= max_range)
 					THEN 0 
-				WHEN (test_result > max_range OR test_result < min_range)
+				WHEN (num_result > max_range OR num_result < min_range)
 					THEN 1
 					END test_abnormal,
 				-- categorical variable low, normal, high; added a number for easy ordering
-				CASE WHEN (test_result >= min_range AND test_result <= max_range)
+				CASE WHEN (num_result >= min_range AND num_result <= max_range)
 					THEN '1_normal' 
-				WHEN (test_result < min_range)
+				WHEN (num_result < min_range)
 					THEN '0_low'
-				WHEN (test_result > max_range)
+				WHEN (num_result > max_range)
 					THEN '2_high'
 					END test_ordinal
 			FROM RWD_VDM_OPTUM_EHRIBD.IBD_LABS AS a
@@ -0,0 +1,28 @@
+/* This sql template creates a permanent table of the running state of each
+lab for each person after the full longitudinal_labs build: number, sum and
+max of lab values and of acceleration values, and the last lab value and
+date. Incremental refreshes (longitudinal_labs_new) continue the rolling
+features from this state instead of recomputing the whole lab history */
+CREATE TABLE ibd_flare.lab_state AS
+    (
+    SELECT ptid, test_name, n_labs, sum_result, max_result, 
+        n_acc, sum_acc, max_acc,
+        result_date AS last_date, test_result AS last_result
+    FROM
+        (
+        SELECT ptid, test_name, result_date, test_result,
+            -- running totals over all labs of the person and test
+            COUNT(test_result) OVER (PARTITION BY ptid, test_name) AS n_labs,
+            SUM(test_result) OVER (PARTITION BY ptid, test_name) AS sum_result,
+            MAX(test_result) OVER (PARTITION BY ptid, test_name) AS max_result,
+            COUNT(acc_value) OVER (PARTITION BY ptid, test_name) AS n_acc,
+            SUM(acc_value) OVER (PARTITION BY ptid, test_name) AS sum_acc,
+            MAX(acc_value) OVER (PARTITION BY ptid, test_name) AS max_acc
+        FROM longitudinal_labs
+        -- keep the last lab of each person and test
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY ptid, test_name 
+                                   ORDER BY result_date DESC) = 1
+        ) AS temp
+    )
+WITH DATA
+PRIMARY INDEX (ptid, test_name);
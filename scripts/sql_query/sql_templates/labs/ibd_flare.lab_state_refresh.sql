@@ -0,0 +1,41 @@
+/* This sql template adds the new labs of a refresh batch to the running 
+state in ibd_flare.lab_state: counts and sums are added, max values are 
+compared and the last lab value and date are replaced */
+MERGE INTO ibd_flare.lab_state AS t
+USING
+    (
+    SELECT ptid, test_name, n_labs, sum_result, max_result, 
+        n_acc, sum_acc, max_acc,
+        result_date AS last_date, test_result AS last_result
+    FROM
+        (
+        SELECT ptid, test_name, result_date, test_result,
+            COUNT(test_result) OVER (PARTITION BY ptid, test_name) AS n_labs,
+            SUM(test_result) OVER (PARTITION BY ptid, test_name) AS sum_result,
+            MAX(test_result) OVER (PARTITION BY ptid, test_name) AS max_result,
+            COUNT(acc_value) OVER (PARTITION BY ptid, test_name) AS n_acc,
+            SUM(acc_value) OVER (PARTITION BY ptid, test_name) AS sum_acc,
+            MAX(acc_value) OVER (PARTITION BY ptid, test_name) AS max_acc
+        FROM longitudinal_labs_new
+        -- keep the last new lab of each person and test
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY ptid, test_name 
+                                   ORDER BY result_date DESC) = 1
+        ) AS temp
+    ) AS s
+ON t.ptid = s.ptid AND t.test_name = s.test_name
+WHEN MATCHED THEN UPDATE SET
+    n_labs = t.n_labs + s.n_labs,
+    sum_result = COALESCE(t.sum_result, 0) + COALESCE(s.sum_result, 0),
+    max_result = CASE WHEN s.max_result IS NULL OR t.max_result > s.max_result
+                     THEN t.max_result ELSE s.max_result END,
+    n_acc = t.n_acc + s.n_acc,
+    sum_acc = COALESCE(t.sum_acc, 0) + COALESCE(s.sum_acc, 0),
+    max_acc = CASE WHEN s.max_acc IS NULL OR t.max_acc > s.max_acc
+                  THEN t.max_acc ELSE s.max_acc END,
+    last_date = s.last_date,
+    last_result = s.last_result
+WHEN NOT MATCHED THEN INSERT VALUES
+    (
+    s.ptid, s.test_name, s.n_labs, s.sum_result, s.max_result,
+    s.n_acc, s.sum_acc, s.max_acc, s.last_date, s.last_result
+    );
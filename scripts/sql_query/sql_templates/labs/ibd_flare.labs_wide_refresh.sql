@@ -0,0 +1,51 @@
+/* This sql template merges the new labs of a refresh batch in to the 
+permanent ibd_flare.labs_wide table. New labs of a test are always dated 
+after the stored labs of the same test, so on a date that is already in the 
+table a lab column is either new or already filled and never both */
+MERGE INTO ibd_flare.labs_wide AS t
+USING
+    (
+    SELECT ptid, result_date AS visit_date
+        -- deduplicating labs by taking the max value on the same dates
+        {% for lab, var in labs_zip %}    
+        -- baseline value
+        , MAX(CASE WHEN test_name = '{{ lab }}'
+              THEN test_result 
+              ELSE NULL END) AS {{ var }}_base
+        -- rolling mean
+        , MAX(CASE WHEN test_name = '{{ lab }}'
+              THEN rolling_mean 
+              ELSE NULL END) AS {{ var }}_mean
+        -- rolling max
+        , MAX(CASE WHEN test_name = '{{ lab }}'
+              THEN rolling_max 
+              ELSE NULL END) AS {{ var }}_max
+        -- rolling mean of acceleration
+        , MAX(CASE WHEN test_name = '{{ lab }}'
+              THEN rolling_mean_acc 
+              ELSE NULL END) AS {{ var }}_mean_acc
+        -- rolling max of acceleration
+        , MAX(CASE WHEN test_name = '{{ lab }}'
+              THEN rolling_max_acc 
+              ELSE NULL END) AS {{ var }}_max_acc
+        {% endfor %}
+    FROM longitudinal_labs_new
+    GROUP BY ptid, result_date
+    ) AS s
+ON t.ptid = s.ptid AND t.visit_date = s.visit_date
+WHEN MATCHED THEN UPDATE SET
+    {% for lab, var in labs_zip %}
+    {% if loop.first == False %}, {% endif %}{{ var }}_base = COALESCE(s.{{ var }}_base, t.{{ var }}_base)
+    , {{ var }}_mean = COALESCE(s.{{ var }}_mean, t.{{ var }}_mean)
+    , {{ var }}_max = COALESCE(s.{{ var }}_max, t.{{ var }}_max)
+    , {{ var }}_mean_acc = COALESCE(s.{{ var }}_mean_acc, t.{{ var }}_mean_acc)
+    , {{ var }}_max_acc = COALESCE(s.{{ var }}_max_acc, t.{{ var }}_max_acc)
+    {% endfor %}
+WHEN NOT MATCHED THEN INSERT VALUES
+    (
+    s.ptid, s.visit_date
+    {% for lab, var in labs_zip %}
+    , s.{{ var }}_base, s.{{ var }}_mean, s.{{ var }}_max
+    , s.{{ var }}_mean_acc, s.{{ var }}_max_acc
+    {% endfor %}
+    );
@@ -15,9 +15,9 @@ CREATE VOLATILE TABLE longitudinal_labs AS
     FROM
         (
         SELECT ptid, encid, test_name, result_date, 
-        LAG(char_date, 1, 0) OVER (PARTITION BY ptid, test_name 
+        LAG(char_date, 1, '0') OVER (PARTITION BY ptid, test_name 
                                    ORDER BY result_date) as lag_date,
-        CASE WHEN lag_date <> 0
+        CASE WHEN lag_date <> '0'
             THEN result_date - CAST(lag_date AS DATE FORMAT 'YYYY-MM-DD') 
             ELSE NULL 
             END time_diff,
@@ -0,0 +1,82 @@
+/* This sql template creates a volatile table with the same columns as 
+longitudinal_labs for the new labs of a refresh batch only. Rolling mean, 
+rolling max and acceleration continue from the running state stored in 
+ibd_flare.lab_state, so the lab history is not read again */
+CREATE VOLATILE TABLE longitudinal_labs_new AS
+    (
+    SELECT ptid, encid, test_name, result_date, test_result, 
+        rolling_mean, rolling_max, acc_value,
+        -- running mean of accelerated value including stored state
+        CASE WHEN n_acc > 0
+            THEN sum_acc/n_acc 
+            ELSE NULL END rolling_mean_acc,
+        -- running max of accelerated value including stored state
+        CASE WHEN new_max_acc IS NULL OR prev_max_acc > new_max_acc
+            THEN prev_max_acc 
+            ELSE new_max_acc END rolling_max_acc
+    FROM
+        (
+        SELECT ptid, encid, test_name, result_date, test_result, 
+            rolling_mean, rolling_max, acc_value, prev_max_acc,
+            COALESCE(prev_n_acc, 0) + 
+                COUNT(acc_value) OVER (PARTITION BY ptid, test_name ORDER BY result_date 
+                                       ROWS UNBOUNDED PRECEDING) AS n_acc,
+            COALESCE(prev_sum_acc, 0) + 
+                COALESCE(SUM(acc_value) OVER (PARTITION BY ptid, test_name ORDER BY result_date
+                                              ROWS UNBOUNDED PRECEDING), 0) AS sum_acc,
+            MAX(acc_value) OVER (PARTITION BY ptid, test_name ORDER BY result_date
+                                 ROWS UNBOUNDED PRECEDING) AS new_max_acc
+        FROM
+            (
+            SELECT ptid, encid, test_name, result_date, test_result, 
+                prev_n_acc, prev_sum_acc, prev_max_acc,
+                -- calculate acceleration for time_diff not equal to 0 (labs on same day)
+                CASE WHEN time_diff <> 0
+                    THEN (test_result - lag_value)/time_diff
+                    ELSE NULL END acc_value,
+                -- running mean including stored state
+                CASE WHEN n_labs > 0
+                    THEN sum_result/n_labs
+                    ELSE NULL END rolling_mean,
+                -- running max including stored state
+                CASE WHEN new_max IS NULL OR prev_max > new_max
+                    THEN prev_max
+                    ELSE new_max END rolling_max
+            FROM
+                (
+                SELECT a.ptid, a.encid, a.test_name, a.result_date, a.test_result,
+                    c.n_acc AS prev_n_acc, c.sum_acc AS prev_sum_acc, 
+                    c.max_acc AS prev_max_acc, c.max_result AS prev_max,
+                    ROW_NUMBER() OVER (PARTITION BY a.ptid, a.test_name 
+                                       ORDER BY a.result_date) AS new_n,
+                    -- previous lab; the stored last lab for the first new lab
+                    CASE WHEN new_n = 1
+                        THEN a.result_date - c.last_date
+                        ELSE a.result_date - LAG(a.result_date) OVER 
+                            (PARTITION BY a.ptid, a.test_name ORDER BY a.result_date)
+                        END time_diff,
+                    CASE WHEN new_n = 1
+                        THEN c.last_result
+                        ELSE LAG(a.test_result) OVER 
+                            (PARTITION BY a.ptid, a.test_name ORDER BY a.result_date)
+                        END lag_value,
+                    COALESCE(c.n_labs, 0) + 
+                        COUNT(a.test_result) OVER (PARTITION BY a.ptid, a.test_name 
+                                                   ORDER BY a.result_date 
+                                                   ROWS UNBOUNDED PRECEDING) AS n_labs,
+                    COALESCE(c.sum_result, 0) + 
+                        COALESCE(SUM(a.test_result) OVER (PARTITION BY a.ptid, a.test_name 
+                                                          ORDER BY a.result_date 
+                                                          ROWS UNBOUNDED PRECEDING), 0) AS sum_result,
+                    MAX(a.test_result) OVER (PARTITION BY a.ptid, a.test_name 
+                                             ORDER BY a.result_date 
+                                             ROWS UNBOUNDED PRECEDING) AS new_max
+                FROM new_labs AS a
+                LEFT JOIN ibd_flare.lab_state AS c
+                ON a.ptid = c.ptid AND a.test_name = c.test_name
+                ) AS temp
+            ) AS temp2
+        ) AS temp3
+    )
+WITH DATA
+ON COMMIT PRESERVE ROWS;
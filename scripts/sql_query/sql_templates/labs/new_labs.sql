@@ -0,0 +1,30 @@
+/* This sql template creates a volatile table of the labs of interest in a 
+refresh batch that are newer than the last lab of the same person and test 
+in ibd_flare.lab_state. Labs dated on or before the stored last date are 
+already summarized in the state (or arrived late) and are not added */
+CREATE VOLATILE TABLE new_labs AS
+    (
+    SELECT a.ptid, a.encid, a.test_name, a.result_date, 
+        TRYCAST(a.test_result AS FLOAT) AS test_result
+    FROM RWD_VDM_OPTUM_EHRIBD.IBD_LABS AS a
+    INNER JOIN ibd_flare.ibd_cohort AS b
+    ON a.ptid = b.ptid AND a.result_date >= b.first_ibd_date
+    LEFT JOIN ibd_flare.lab_state AS c
+    ON a.ptid = c.ptid AND a.test_name = c.test_name
+    WHERE a.batch_title = '{{ refresh_batch }}' 
+        AND a.result_date IS NOT NULL
+        AND a.encid IS NOT NULL
+        AND a.value_within_range = 'Y'
+        AND (c.last_date IS NULL OR a.result_date > c.last_date)
+        AND a.test_name IN (
+            {% for lab in labs %}
+                {% if loop.first == True %}
+                '{{ lab }}'
+                {% else %}
+                , '{{ lab }}'
+                {% endif %}
+            {% endfor %}
+        )
+    )
+WITH DATA
+ON COMMIT PRESERVE ROWS;
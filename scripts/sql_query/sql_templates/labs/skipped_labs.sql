@@ -0,0 +1,31 @@
+/* This sql template creates a volatile table of the labs of interest in a 
+refresh batch that are not added by new_labs because they are dated on or 
+before the last lab of the same person and test in ibd_flare.lab_state 
+(late arriving labs). It runs before ibd_flare.lab_state_refresh so the 
+stored last date is the one new_labs compared against; the counts are 
+printed and saved to query metrics */
+CREATE VOLATILE TABLE skipped_labs AS
+    (
+    SELECT a.ptid, a.test_name, a.result_date, c.last_date
+    FROM RWD_VDM_OPTUM_EHRIBD.IBD_LABS AS a
+    INNER JOIN ibd_flare.ibd_cohort AS b
+    ON a.ptid = b.ptid AND a.result_date >= b.first_ibd_date
+    INNER JOIN ibd_flare.lab_state AS c
+    ON a.ptid = c.ptid AND a.test_name = c.test_name
+    WHERE a.batch_title = '{{ refresh_batch }}' 
+        AND a.result_date IS NOT NULL
+        AND a.encid IS NOT NULL
+        AND a.value_within_range = 'Y'
+        AND a.result_date <= c.last_date
+        AND a.test_name IN (
+            {% for lab in labs %}
+                {% if loop.first == True %}
+                '{{ lab }}'
+                {% else %}
+                , '{{ lab }}'
+                {% endif %}
+            {% endfor %}
+        )
+    )
+WITH DATA
+ON COMMIT PRESERVE ROWS;
@@ -48,9 +48,9 @@ CREATE TABLE ibd_flare.flare_visits AS
     ON (a.ptid = b.ptid) AND (b.flare_date >= a.visit_date 
                      AND b.flare_date <= a.visit_date + 180)
     ) AS temp
-    -- deduping multiple flare events joined to a single visit
-    GROUP BY ptid, visit_date, visit_n
     -- excluding visit dates on the same day as flare date for now
     WHERE (visit_date <> flare_date OR flare_date IS NULL) 
+    -- deduping multiple flare events joined to a single visit
+    GROUP BY ptid, visit_date, visit_n
     ) 
 WITH DATA;
\ No newline at end of file